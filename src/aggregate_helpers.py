@@ -0,0 +1,182 @@
+"""
+Provides streaming aggregation of GA cookies into summary statistics
+"""
+
+import heapq
+import time
+from collections import Counter
+
+import parser_helpers
+import sample_helpers
+import spill_helpers
+
+# strftime formats of the first visit histogram buckets
+HISTOGRAM_BUCKETS = {"day": "%Y-%m-%d",
+                     "month": "%Y-%m",
+                     "year": "%Y"}
+
+class TopHosts:
+    """
+    The top_n hosts with the most visits, where a host's visits are the
+    largest visit count of any of its cookies, kept as a min-heap of
+    (visits, host) which holds each host at most once
+    """
+    def __init__(self, top_n):
+        self.top_n = top_n
+        self.heap = []
+
+        # {host: visits} of the hosts in the heap
+        self.visits = {}
+
+    def push(self, visits, host):
+        """
+        Add a visit count of one of a host's cookies
+        """
+        current = self.visits.get(host)
+        if current is not None:
+            # Only a larger count replaces the host's entry. The heap holds
+            # only top_n entries, so it is simply made again
+            if visits > current:
+                self.heap[self.heap.index((current, host))] = (visits, host)
+                heapq.heapify(self.heap)
+                self.visits[host] = visits
+            return
+
+        # The smallest entry only ever grows, so a host which was pushed
+        # out needs no entry until it has more visits than that
+        if len(self.heap) < self.top_n:
+            heapq.heappush(self.heap, (visits, host))
+        elif (visits, host) > self.heap[0]:
+            _, removed = heapq.heapreplace(self.heap, (visits, host))
+            del self.visits[removed]
+        else:
+            return
+        self.visits[host] = visits
+
+    def most_common(self):
+        """
+        Return [(visits, host), ...] from the most visits to the fewest
+        """
+        return sorted(self.heap, reverse=True)
+
+class CookieAggregator:
+    """
+    Collects summary statistics from GA cookies passed one at a time to add,
+    so that a whole cookie store can be summarised in one pass. The top
+    hosts, ranges, cookie counts and the estimate of the number of domains
+    take a fixed amount of memory, but the source and search term counters
+    grow with the number of distinct values found, as does the histogram
+    with the number of buckets. If a budget is given the counters spill to
+    disk once they would go over it, and otherwise they are only limited by
+    the available memory
+    """
+    def __init__(self, top_n=10, bucket="month", budget=None):
+        self.top_n = top_n
+        self.bucket_format = HISTOGRAM_BUCKETS[bucket]
+
+        self.cookie_counts = Counter()
+
+        # Only the number of domains is reported, which is estimated rather
+        # than keeping every domain
+        self.domains = sample_helpers.HyperLogLog()
+
+        # The hosts with the most visits
+        self.top_hosts_utma = TopHosts(top_n)
+        self.top_hosts_utmz = TopHosts(top_n)
+
+        self.visit_sources = spill_helpers.SpillCounter(budget)
+        self.search_terms = spill_helpers.SpillCounter(budget)
+
+        # [earliest, latest] epoch times
+        self.first_visit_range = [None, None]
+        self.recent_visit_range = [None, None]
+
+        self.first_visit_histogram = Counter()
+
+    def add(self, name, host, _creation_time, value):
+        """
+        Add one GA cookie to the statistics
+        """
+        self.cookie_counts[name] += 1
+        self.domains.add(host)
+
+        elements = value.split(".") if "." in value else []
+
+        if name == "_ga":
+            padded_elements = parser_helpers.create_ga_list(elements, 4)
+            first_visit = parser_helpers.parse_epoch(padded_elements[3])
+            if first_visit is not None:
+                self.update_range(self.first_visit_range, first_visit)
+                self.first_visit_histogram[time.strftime(self.bucket_format,
+                                                         time.gmtime(first_visit))] += 1
+
+        elif name == "__utma":
+            padded_elements = parser_helpers.create_ga_list(elements, 6)
+            recent_visit = parser_helpers.parse_epoch(padded_elements[4])
+            if recent_visit is not None:
+                self.update_range(self.recent_visit_range, recent_visit)
+            self.push_top(self.top_hosts_utma, padded_elements[5], host)
+
+        elif name == "__utmz":
+            padded_elements = parser_helpers.create_ga_list(elements, 5)
+            self.push_top(self.top_hosts_utmz, padded_elements[2], host)
+
+            source = parser_helpers.try_parse_kvp(padded_elements[4], "utmcsr")
+            if source != "<not found>":
+                self.visit_sources.add(source)
+
+            search_term = parser_helpers.try_parse_kvp(padded_elements[4], "utmctr")
+            if search_term != "<not found>":
+                self.search_terms.add(search_term)
+
+    @staticmethod
+    def update_range(epoch_range, epoch):
+        """
+        Widen the [earliest, latest] range to include epoch
+        """
+        if epoch_range[0] is None or epoch < epoch_range[0]:
+            epoch_range[0] = epoch
+        if epoch_range[1] is None or epoch > epoch_range[1]:
+            epoch_range[1] = epoch
+
+    @staticmethod
+    def push_top(top_hosts, visits, host):
+        """
+        Add a host's visit count to a TopHosts if it is a valid count
+        """
+        visits = parser_helpers.try_parse_int(visits)
+        if not isinstance(visits, int):
+            return
+
+        host = host or "" # So that hosts with equal visits can be compared
+        top_hosts.push(visits, host)
+
+    def report(self):
+        """
+        Return a dict of the collected statistics, with times formatted like
+        the rest of the parsed cookie output
+        """
+        def format_range(epoch_range):
+            return [parser_helpers.try_parse_epoch_datetime(epoch)
+                    if epoch is not None else "<not found>" for epoch in epoch_range]
+
+        return {"cookie_counts": dict(self.cookie_counts),
+                "total_cookies": sum(self.cookie_counts.values()),
+                "domain_count": self.domains.count(),
+                "domain_error": self.domains.get_error(),
+                "top_hosts_utma": self.top_hosts_utma.most_common(),
+                "top_hosts_utmz": self.top_hosts_utmz.most_common(),
+                "top_visit_sources": self.visit_sources.most_common(self.top_n),
+                "top_search_terms": self.search_terms.most_common(self.top_n),
+                "first_visit_range": format_range(self.first_visit_range),
+                "recent_visit_range": format_range(self.recent_visit_range),
+                "first_visit_histogram": sorted(self.first_visit_histogram.items())}
+
+def aggregate(fetcher, top_n=10, bucket="month"):
+    """
+    Return the CookieAggregator report for every cookie the fetcher finds
+    """
+    aggregator = CookieAggregator(top_n, bucket, fetcher.budget)
+    for cookie in fetcher.iter_cookies():
+        aggregator.add(*cookie)
+    return aggregator.report()
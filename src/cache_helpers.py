@@ -0,0 +1,180 @@
+"""
+Provides a caching facade around cookie fetchers, shared across the
+program, so that the GUI and CLI can ask for the same results as often as
+they like without the cookie file being read again
+"""
+
+import collections
+import os
+
+import cookie_parser
+
+# Number of get_domain_info results kept by each CachedFetcher
+DOMAIN_INFO_CACHE_SIZE = 4096
+
+# Number of CachedFetchers kept by get_cached_fetcher, each of which may
+# hold a file open along with everything remembered about it
+FETCHER_CACHE_SIZE = 4
+
+# {(browser, path, cookie names, options): CachedFetcher}, least recently
+# used first, see get_cached_fetcher
+FETCHERS = collections.OrderedDict()
+
+def get_file_signature(path):
+    """
+    Return a value which changes whenever the file at path, or the
+    write-ahead log SQLite keeps next to it, is changed
+    """
+    signature = []
+    for file_path in [path, path + "-wal"]:
+        try:
+            stat = os.stat(file_path)
+            signature.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append(None)
+    return signature
+
+def get_cached_fetcher(browser, filepath, cookie_names, **options):
+    """
+    Return the CachedFetcher for the given get_cookie_fetcher arguments,
+    which is the same object every time they are the same while it is one
+    of the FETCHER_CACHE_SIZE most recently used. The least recently used
+    fetcher is closed to make room for another.
+
+    A fetcher which couldn't open the file is returned but not kept, so
+    that the file is tried again next time
+    """
+    key = (browser, os.path.abspath(filepath), tuple(cookie_names),
+           repr(sorted(options.items())))
+
+    if key in FETCHERS:
+        FETCHERS.move_to_end(key)
+        return FETCHERS[key]
+
+    fetcher = CachedFetcher(browser, filepath, cookie_names, **options)
+    if fetcher.error is None:
+        if len(FETCHERS) >= FETCHER_CACHE_SIZE:
+            FETCHERS.popitem(last=False)[1].close()
+        FETCHERS[key] = fetcher
+    return fetcher
+
+class CachedFetcher:
+    """
+    Wraps the CookieFetcher returned by cookie_parser.get_cookie_fetcher,
+    remembering the results of the methods which always give the same
+    result for the same file.
+
+    The domains and the number of cookies are found together, in a single
+    pass for fetchers which have to read the whole file for each. Whenever
+    the file changes, the remembered results are forgotten and the file is
+    opened again. Everything else, such as iter_cookies and error, is
+    passed straight to the wrapped fetcher
+    """
+    def __init__(self, browser, filepath, cookie_names, **options):
+        self.browser_name = browser
+        self.filepath = filepath
+        self.cookie_names = cookie_names
+        self.options = options
+
+        self.fetcher = None
+        self.signature = None
+
+        # {method name: result}
+        self.results = {}
+        # {domain: get_domain_info result}, least recently used first
+        self.domain_info = collections.OrderedDict()
+
+        self.callback = None
+
+        self.get_fetcher()
+
+    def get_fetcher(self):
+        """
+        Return the wrapped fetcher, opening the file again first if it has
+        changed since it was opened
+        """
+        signature = get_file_signature(self.filepath)
+        if self.fetcher is None or signature != self.signature:
+            self.fetcher = cookie_parser.get_cookie_fetcher(self.browser_name, self.filepath,
+                                                            self.cookie_names, **self.options)
+            self.fetcher.progress_callback = self.callback
+            self.signature = signature
+
+            self.results.clear()
+            self.domain_info.clear()
+
+        return self.fetcher
+
+    def __getattr__(self, name):
+        # Only called for attributes this class doesn't have
+        return getattr(self.get_fetcher(), name)
+
+    def close(self):
+        """
+        Close the wrapped fetcher and forget the remembered results. The
+        file is opened again if the CachedFetcher is used afterwards
+        """
+        if self.fetcher is not None:
+            self.fetcher.close()
+        self.fetcher = None
+
+        self.results.clear()
+        self.domain_info.clear()
+
+    @property
+    def progress_callback(self):
+        """
+        The progress_callback of the wrapped fetcher, which is kept if the
+        file is opened again
+        """
+        return self.callback
+
+    @progress_callback.setter
+    def progress_callback(self, callback):
+        self.callback = callback
+        if self.fetcher is not None:
+            self.fetcher.progress_callback = callback
+
+    def get_result(self, name, function):
+        """
+        Return the remembered result of calling function, calling it first
+        if needed, where name identifies the result
+        """
+        fetcher = self.get_fetcher()
+        if name not in self.results:
+            self.results[name] = function(fetcher)
+        return self.results[name]
+
+    def get_domain_summary(self):
+        return self.get_result("domain_summary", lambda fetcher: fetcher.get_domain_summary())
+
+    def get_domains(self):
+        # A copy, so that the remembered list can't be changed
+        return list(self.get_domain_summary()[0])
+
+    def get_cookie_count(self):
+        return self.get_domain_summary()[1]
+
+    def get_domain_count(self):
+        # Unless the domains are already known, counting them is cheaper
+        # than listing them
+        self.get_fetcher()
+        if "domain_summary" in self.results:
+            return len(self.results["domain_summary"][0])
+        return self.get_result("domain_count", lambda fetcher: fetcher.get_domain_count())
+
+    def get_progress_total(self):
+        return self.get_result("progress_total", lambda fetcher: fetcher.get_progress_total())
+
+    def get_domain_info(self, domain):
+        fetcher = self.get_fetcher()
+
+        if domain in self.domain_info:
+            self.domain_info.move_to_end(domain)
+        else:
+            if len(self.domain_info) >= DOMAIN_INFO_CACHE_SIZE:
+                self.domain_info.popitem(last=False)
+            self.domain_info[domain] = fetcher.get_domain_info(domain)
+
+        # A copy, so that the remembered dict can't be changed
+        return dict(self.domain_info[domain])
@@ -2,45 +2,218 @@
 Becomes the executable which provides a command line interface for the parser
 """
 
+import contextlib
+import itertools
+import multiprocessing
 import sys
 import os
-
-import csv
+import time
 
 import click
 
+import aggregate_helpers
+import cache_helpers
+import columnar_index
+import compression_helpers
 import cookie_parser
+import dedup_helpers
+import export_helpers
 import general_helpers
+import report_helpers
+import sample_helpers
+import spill_helpers
+
+def parse_columns(_ctx, _param, value):
+    """
+    Convert a --columns value such as "name=Cookie Name,host=3" to a dict of
+    {field: column name or index} for CSVFetcher
+    """
+    if value is None:
+        return None
+
+    columns = {}
+    for pair in value.split(","):
+        field, _, column = pair.partition("=")
+        field = field.strip()
+
+        if field not in cookie_parser.CSV_COLUMN_KEYWORDS or not column.strip():
+            raise click.BadParameter("expected field=column pairs, where field is one of "
+                                     + ", ".join(cookie_parser.CSV_COLUMN_KEYWORDS))
 
-@click.group()
+        columns[field] = int(column) if column.strip().isdigit() else column.strip()
+    return columns
+
+def parse_delimiter(_ctx, _param, value):
+    """
+    Check a --delimiter value is a single character, allowing \\t for tab
+    """
+    if value is None:
+        return None
+
+    value = value.replace("\\t", "\t")
+    if len(value) != 1:
+        raise click.BadParameter("the delimiter must be a single character")
+    return value
+
+def parse_max_memory(_ctx, _param, value):
+    """
+    Convert a --max-memory value such as "512M" or "2G" to a number of bytes
+    """
+    if value is None:
+        return None
+
+    try:
+        return spill_helpers.parse_size(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+def format_rate(amount, unit, seconds):
+    """
+    Return the rate of progress as e.g. "5000 rows/s" or "2.5 MB/s"
+    """
+    rate = amount / seconds if seconds > 0 else 0
+    if unit == "bytes":
+        return "{:.1f} MB/s".format(rate / (1024 * 1024))
+    return "{:.0f} {}/s".format(rate, unit)
+
+def echo_sample_note(fetcher):
+    """
+    Say that the results are from a sample, if the fetcher is sampled
+    """
+    if isinstance(fetcher, sample_helpers.SampledFetcher):
+        click.echo(click.style("Results are from a random sample of {} GA cookies\n".format(
+            len(fetcher.get_sample().cookies)), "yellow"))
+
+def echo_resume_hint(output, compression):
+    """
+    Say how to continue an interrupted export, if it can be continued
+    """
+    if export_helpers.can_resume(output, compression):
+        click.echo(click.style("Run the same command with --resume to continue the export",
+                               "yellow"))
+
+def format_estimate(estimate, error):
+    """
+    Return an estimate with its error bound, e.g. "5000 ± 120", or just the
+    number if it is exact
+    """
+    if error == 0:
+        return str(estimate)
+    return "{} ± {}".format(estimate, error)
+
+@contextlib.contextmanager
+def show_progress(fetcher, label):
+    """
+    Show a progress bar, with the throughput and time remaining, while the
+    fetcher makes a single pass over the cookies. Nothing is shown, and the
+    fetcher doesn't report its progress, if stdout is not a terminal
+    """
+    if not sys.stdout.isatty():
+        yield
+        return
+
+    total, unit = fetcher.get_progress_total()
+    start = time.monotonic()
+
+    with click.progressbar(length=total, label=label, show_eta=True,
+                           item_show_func=lambda rate: rate) as progress_bar:
+        def update(amount):
+            progress_bar.current_item = format_rate(progress_bar.pos + amount, unit,
+                                                    time.monotonic() - start)
+            progress_bar.update(amount)
+
+        fetcher.progress_callback = update
+        try:
+            yield
+        finally:
+            fetcher.progress_callback = None
+
+        # Counts and sorted domains which a fetcher gets with a query, rather
+        # than by reading every cookie, aren't reported as they are found
+        if progress_bar.pos < total:
+            progress_bar.update(total - progress_bar.pos)
+
+class CookieGroup(click.Group):
+    """
+    Group of the commands, which reports a compressed cookie file found to
+    be damaged part way through reading it, rather than showing a traceback
+    """
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except compression_helpers.CompressionError as error:
+            click.echo(click.style(str(error), "red"))
+            sys.exit(1)
+
+@click.group(cls=CookieGroup)
 @click.option('--input', '-i', required=True, type=click.Path(exists=True,
                                                               dir_okay=False,
                                                               writable=False))
-@click.option("--browser", "-b", required=True, type=click.Choice(["firefox.3+", "csv"]))
+@click.option("--browser", "-b", required=True, type=click.Choice(["firefox.3+", "csv",
+                                                                             "index"]))
+@click.option("--scan-mode", type=click.Choice(["full", "mmap"]), default="full")
+@click.option("--delimiter", callback=parse_delimiter)
+@click.option("--columns", callback=parse_columns)
+@click.option("--max-memory", callback=parse_max_memory)
+@click.option("--sample", type=click.IntRange(min=1))
 @click.version_option(version=general_helpers.APPLICATION_VERSION,
                       prog_name="Google Analytics Cookie Parser")
 @click.pass_context
-def cli(ctx, input, browser): # pylint: disable=redefined-builtin
+def cli(ctx, input, browser, scan_mode, delimiter, columns, max_memory, sample):
+    # pylint: disable=redefined-builtin,too-many-arguments
     """
     Google Analytics Cookie Parser, developed by Patrick Beart.
     """
     click.echo(click.style("Processing cookie file...", "cyan"))
     cookies = ["_ga", "__utma", "__utmb", "__utmz"]
 
-    # Provide all subcommands with the parser object
-    ctx.obj = cookie_parser.get_cookie_fetcher(browser, input, cookies)
+    # Options which only apply to some fetchers
+    fetcher_options = {}
+    if browser == "csv":
+        fetcher_options["scan_mode"] = scan_mode
+        fetcher_options["delimiter"] = delimiter
+        fetcher_options["columns"] = columns
+
+    # Collections which would use more memory than this spill to disk
+    if max_memory is not None:
+        fetcher_options["max_memory"] = max_memory
+
+    # Provide all subcommands with the parser object, which remembers what
+    # it has found so that it is only found once
+    ctx.obj = cache_helpers.get_cached_fetcher(browser, input, cookies, **fetcher_options)
     if ctx.obj.error is not None:
         click.echo(click.style(ctx.obj.error, "red"))
         sys.exit()
 
+    # Commands are answered from a random sample of the cookies instead
+    if sample is not None:
+        ctx.obj = sample_helpers.SampledFetcher(ctx.obj, sample)
+
 @cli.command()
 @click.pass_context
 def info(ctx):
     """
     Shows information about parsed cookies and found domains
     """
-    cookie_count = ctx.obj.get_cookie_count()
-    domain_count = len(ctx.obj.get_domains())
+    if isinstance(ctx.obj, sample_helpers.SampledFetcher):
+        with show_progress(ctx.obj, "Sampling cookies"):
+            sample = ctx.obj.get_sample()
+
+        echo_sample_note(ctx.obj)
+        click.echo(click.style("Found about {} GA cookies over about {} domains".format(
+            format_estimate(sample.cookie_count, sample.cookie_error),
+            format_estimate(sample.domain_count, sample.domain_error)), fg="yellow"))
+
+        click.echo(click.style("\nTop domains by GA cookies:", fg="cyan"))
+        for domain, estimate, error in sample.get_top_domains():
+            click.echo("{}: {}".format(domain, format_estimate(estimate, error)))
+
+        click.echo(click.style("\nBounds are 95% confidence intervals", fg="cyan"))
+        return
+
+    with show_progress(ctx.obj, "Counting cookies"):
+        cookie_count = ctx.obj.get_cookie_count()
+        domain_count = ctx.obj.get_domain_count()
 
     info_template = "Found {} GA cookies over {} domains"
 
@@ -48,13 +221,71 @@ def info(ctx):
                            fg="yellow"))
 
 @cli.command()
+@click.option("--top", "-n", default=10, type=click.IntRange(min=1))
+@click.option("--bucket", type=click.Choice(list(aggregate_helpers.HISTOGRAM_BUCKETS)),
+              default="month")
 @click.pass_context
-def list_domains(ctx):
+def aggregate(ctx, top, bucket):
+    """
+    Shows summary statistics of all found GA cookies, computed in one pass
+    """
+    with show_progress(ctx.obj, "Reading cookies"):
+        report = aggregate_helpers.aggregate(ctx.obj, top, bucket)
+
+    echo_sample_note(ctx.obj)
+
+    domain_count = format_estimate(report["domain_count"], report["domain_error"])
+    click.echo(click.style("Found {} GA cookies over about {} domains".format(
+        report["total_cookies"], domain_count), fg="yellow"))
+
+    click.echo(click.style("\nCookies by type:", fg="cyan"))
+    for cookie in general_helpers.COOKIE_FILENAMES:
+        click.echo("{}: {}".format(cookie, report["cookie_counts"].get(cookie, 0)))
+
+    click.echo(click.style("\nVisit times:", fg="cyan"))
+    click.echo("First visits (_ga): {} to {}".format(*report["first_visit_range"]))
+    click.echo("Most recent visits (__utma): {} to {}".format(*report["recent_visit_range"]))
+
+    sections = [("Top hosts by visits (__utma)", report["top_hosts_utma"]),
+                ("Top hosts by visits (__utmz)", report["top_hosts_utmz"])]
+    for title, hosts in sections:
+        click.echo(click.style("\n{}:".format(title), fg="cyan"))
+        for visits, host in hosts:
+            click.echo("{}: {}".format(host, visits))
+
+    sections = [("Top visit sources (__utmz)", report["top_visit_sources"]),
+                ("Top search terms (__utmz)", report["top_search_terms"]),
+                ("First visits by {} (_ga)".format(bucket), report["first_visit_histogram"])]
+    for title, counts in sections:
+        click.echo(click.style("\n{}:".format(title), fg="cyan"))
+        for value, count in counts:
+            click.echo("{}: {}".format(value, count))
+
+@cli.command()
+@click.option("--limit", type=click.IntRange(min=0))
+@click.option("--offset", type=click.IntRange(min=0), default=0)
+@click.option("--sort/--no-sort", default=True)
+@click.pass_context
+def list_domains(ctx, limit, offset, sort):
     """
     Shows a list of domains found in input file
     """
+    if sort:
+        # Sorted domains can only be listed once every cookie has been read,
+        # which happens before the first domain is given
+        with show_progress(ctx.obj, "Finding domains"):
+            domains = ctx.obj.iter_domains(sorted=True, limit=limit, offset=offset)
+            first = list(itertools.islice(domains, 1))
+        domains = itertools.chain(first, domains)
+    else:
+        domains = ctx.obj.iter_domains(sorted=False, limit=limit, offset=offset)
+
+    echo_sample_note(ctx.obj)
     click.echo(click.style("Found domains with GA cookies:\n", fg="cyan"))
-    for domain in ctx.obj.get_domains():
+
+    # Unsorted domains are shown as soon as they are found, without a
+    # progress bar which they would be mixed up with
+    for domain in domains:
         click.echo(domain)
 
 
@@ -77,18 +308,35 @@ def domain_info(ctx, domain):
 @click.option("--output", "-o", required=True, type=click.Path(exists=True,
                                                                file_okay=False))
 @click.option("--force-overwrite", "-f", is_flag=True, default=False)
+@click.option("--compress", type=click.Choice(["none", "gzip", "zstd"]), default="none")
+@click.option("--dedup", is_flag=True, default=False)
+@click.option("--dedup-store", type=click.Path(dir_okay=False))
+@click.option("--resume", is_flag=True, default=False)
+@click.option("--checkpoint-rows", type=click.IntRange(min=1),
+              default=export_helpers.CHECKPOINT_ROWS)
 @click.pass_context
-def export_csv(ctx, output, force_overwrite):
+def export_csv(ctx, output, force_overwrite, compress, dedup, dedup_store, resume,
+               checkpoint_rows):
+    # pylint: disable=too-many-arguments,too-many-locals
     """
     Exports all found GA cookie data to the selected output directory
     """
-    conflicts = []
+    compression = None if compress == "none" else compress
+
+    # A sample is exported in one go, as another sample would be different
+    if isinstance(ctx.obj, sample_helpers.SampledFetcher):
+        if resume:
+            click.echo(click.style("An export of a sample can't be continued", "red"))
+            return
+        checkpoint_rows = None
+
+    # A dedup store keeps the cookies seen by previous exports
+    deduplicate = dedup or dedup_store is not None
 
-    # Check whether any of the files we want to write already exists
-    for filename in general_helpers.COOKIE_FILENAMES.values():
-        # If we find a conflict...
-        if os.path.exists(os.path.join(output, filename)):
-            conflicts.append(filename) # Add it to the list
+    # Check whether any of the files we want to write already exists, unless
+    # this was already agreed to when the export was started
+    conflicts = [] if resume else export_helpers.find_conflicts(output, compression,
+                                                                deduplicate)
 
     if conflicts and not force_overwrite:
         click.confirm(click.style("{} already exist(s).\n"\
@@ -97,27 +345,130 @@ def export_csv(ctx, output, force_overwrite):
 
     # Didn't abort
 
-    for cookie in general_helpers.COOKIE_FILENAMES:
-        try:
-            with open(os.path.join(output,
-                                   general_helpers.COOKIE_FILENAMES[cookie]),
-                      "w",
-                      newline="\n") as csvfile:
-
-                writer = csv.writer(csvfile,
-                                    delimiter=',',
-                                    quotechar='"',
-                                    quoting=csv.QUOTE_MINIMAL)
-
-                writer.writerows(ctx.obj.get_cookies(cookie))
-        except PermissionError: # Unable to write to cookie file
-            message = "Could not export cookies because access\
+    # Without a dedup store, the cookies seen are kept in the output
+    # directory until the export has finished, so that it can be continued
+    work_store = None
+    if deduplicate and dedup_store is None:
+        work_store = os.path.join(output, general_helpers.DEDUP_WORK_FILENAME)
+        if not resume and os.path.exists(work_store):
+            os.remove(work_store)
+
+    deduplicator = None
+    if deduplicate:
+        deduplicator = dedup_helpers.CookieDeduplicator(dedup_store or work_store,
+                                                        budget=ctx.obj.budget)
+
+    try:
+        with show_progress(ctx.obj, "Exporting cookies"):
+            export_helpers.export_csv(ctx.obj, output, compression, deduplicator,
+                                      os.path.abspath(ctx.parent.params["input"]),
+                                      checkpoint_rows=checkpoint_rows, resume=resume)
+    except PermissionError as error: # Unable to write to cookie file
+        message = "Could not export cookies because access\
 was denied to {}.\n(You probably have it open in another program)\
-".format(general_helpers.COOKIE_FILENAMES[cookie])
+".format(os.path.basename(error.filename))
 
-            click.echo(click.style(message, "red"))
-            return
+        click.echo(click.style(message, "red"))
+        echo_resume_hint(output, compression)
+        return
+    except compression_helpers.CompressionError as error:
+        click.echo(click.style(str(error), "red"))
+        echo_resume_hint(output, compression)
+        return
+    except cookie_parser.ResumeError as error:
+        click.echo(click.style("Could not continue the export: {}".format(error), "red"))
+        return
+    except KeyboardInterrupt:
+        click.echo(click.style("\nExport interrupted", "yellow"))
+        echo_resume_hint(output, compression)
+        return
+    finally:
+        if deduplicator is not None:
+            deduplicator.close()
+
+    if work_store is not None:
+        os.remove(work_store)
 
     click.echo(click.style("Successfully exported cookies", "green"))
+    echo_sample_note(ctx.obj)
+    if deduplicator is not None:
+        click.echo(click.style("Left out {} duplicate cookies, listed in {}".format(
+            deduplicator.duplicate_count, general_helpers.DUPLICATES_FILENAME), "green"))
+
+@cli.command()
+@click.option("--output", "-o", required=True, type=click.Path(dir_okay=False))
+@click.option("--force-overwrite", "-f", is_flag=True, default=False)
+@click.pass_context
+def index(ctx, output, force_overwrite):
+    """
+    Writes all found GA cookies to an index file, which can be read much
+    faster than the original file by using the browser name "index"
+    """
+    if isinstance(ctx.obj, sample_helpers.SampledFetcher):
+        click.echo(click.style("An index must hold every cookie, so it can't be written "
+                               "from a sample", "red"))
+        return
+
+    if os.path.exists(output) and not force_overwrite:
+        click.confirm(click.style("{} already exists.\n"\
+"Do you want to replace it?".format(output), "yellow"),
+                      abort=True) # If they say no then end the program
+
+    try:
+        with show_progress(ctx.obj, "Indexing cookies"):
+            rows = columnar_index.write_index(ctx.obj, output, ctx.obj.cookie_names)
+    except PermissionError:
+        click.echo(click.style("Could not write the index because access was denied to {}\
+".format(output), "red"))
+        return
+
+    click.echo(click.style("Successfully indexed {} GA cookies".format(rows), "green"))
+
+@cli.command()
+@click.option("--output", "-o", required=True, type=click.Path(dir_okay=False))
+@click.option("--force-overwrite", "-f", is_flag=True, default=False)
+@click.option("--format", "report_format", type=click.Choice(report_helpers.REPORT_FORMATS))
+@click.option("--processes", type=click.IntRange(min=1))
+@click.pass_context
+def report(ctx, output, force_overwrite, report_format, processes):
+    """
+    Writes the info shown by domain-info for every domain found in the
+    input file to a single text or HTML report
+    """
+    if os.path.exists(output) and not force_overwrite:
+        click.confirm(click.style("{} already exists.\n"\
+"Do you want to replace it?".format(output), "yellow"),
+                      abort=True) # If they say no then end the program
+
+    # Unless it is given, the format is chosen by the file extension
+    if report_format is None:
+        report_format = "text"
+        if os.path.splitext(output)[1].lower() in [".html", ".htm"]:
+            report_format = "html"
+
+    title = "{}: {}".format(report_helpers.REPORT_TITLE, ctx.obj.filepath)
+
+    try:
+        with open(output, "w", encoding="utf-8") as report_file:
+            if sys.stdout.isatty():
+                with click.progressbar(length=ctx.obj.get_domain_count(),
+                                       label="Writing report") as progress_bar:
+                    domains = report_helpers.write_report(ctx.obj, report_file, report_format,
+                                                          processes, title=title,
+                                                          progress_callback=progress_bar.update)
+            else:
+                domains = report_helpers.write_report(ctx.obj, report_file, report_format,
+                                                      processes, title=title)
+    except PermissionError:
+        click.echo(click.style("Could not write the report because access was denied to {}\
+".format(output), "red"))
+        return
+
+    click.echo(click.style("Successfully reported on {} domains".format(domains), "green"))
+    echo_sample_note(ctx.obj)
 
-cli() # pylint: disable=no-value-for-parameter
+# Worker processes, such as those rendering a report, import this module
+# again when they are spawned rather than forked, which must not run the CLI
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # For the frozen executable
+    cli() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,460 @@
+"""
+Provides a compact columnar file format for GA cookies, which can be
+memory-mapped for repeated analysis without reading the original cookie
+store again. IndexFetcher in cookie_parser reads these files.
+
+An index file is made up of:
+    MAGIC, then the length of the header as an unsigned 64 bit integer
+    a utf-8 JSON header, giving the cookie names, row count and the
+    [offset, length, typecode] of every section
+    the sections, each a packed array in the writer's byte order, aligned
+    to ALIGNMENT bytes
+
+Every row is one GA cookie. String columns are stored as a ".offsets"
+section of n + 1 positions into a ".data" section of utf-8 bytes, and a
+".nulls" section of the positions, in ascending order, of the strings which
+are None, such as the NULL hosts and values of a Firefox database
+"""
+
+import array
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+import parser_helpers
+
+MAGIC = b"GACPIDX1"
+FORMAT_VERSION = 2
+
+ALIGNMENT = 8
+
+# Value of the int64 typed columns for rows which have no valid value
+MISSING = -2**63
+
+# Value of the creation_time_text column for rows whose creation time is
+# None, where -1 means the creation time is a number
+NO_CREATION_TIME = -2
+
+# Number of rows buffered in memory for each column before being written
+CHUNK_ROWS = 65536
+
+# Sections of the file, and the array typecode of their items
+#   name: code of the cookie name, an index into the header's cookie_names
+#   host: code of the cookie host, an index into the hosts strings
+#   creation_time: creation time in seconds, where it is a number
+#   creation_time_text: index into the creation_time_texts strings for
+#       creation times which are kept as they were found, otherwise -1, or
+#       NO_CREATION_TIME
+#   value: the raw cookie value
+#   visits: number of visits, from __utma or __utmz
+#   time_first_visit: first visit epoch time in seconds, from _ga
+#   time_most_recent_visit: most recent visit epoch time in seconds, from __utma
+#   visit_source, search_term: codes into the terms strings, from __utmz,
+#       where 0 is <not found>
+#   host_index: for each host code, the rows with that host in ascending
+#       order, as host_index.offsets into host_index.rows
+SECTION_TYPECODES = {"name": "B",
+                     "host": "I",
+                     "hosts.offsets": "q",
+                     "hosts.data": "B",
+                     "hosts.nulls": "q",
+                     "creation_time": "d",
+                     "creation_time_text": "q",
+                     "creation_time_texts.offsets": "q",
+                     "creation_time_texts.data": "B",
+                     "creation_time_texts.nulls": "q",
+                     "value.offsets": "q",
+                     "value.data": "B",
+                     "value.nulls": "q",
+                     "visits": "q",
+                     "time_first_visit": "q",
+                     "time_most_recent_visit": "q",
+                     "visit_source": "I",
+                     "search_term": "I",
+                     "terms.offsets": "q",
+                     "terms.data": "B",
+                     "terms.nulls": "q",
+                     "host_index.offsets": "q",
+                     "host_index.rows": "q"}
+
+class InvalidIndexError(Exception):
+    """
+    Raised when a file is not a readable GA cookie index
+    """
+
+class SectionWriter:
+    """
+    Buffers the items of one section and appends them to a temporary file
+    """
+    def __init__(self, directory, name):
+        self.typecode = SECTION_TYPECODES[name]
+        self.path = os.path.join(directory, name)
+        self.file = open(self.path, "wb")
+        self.buffer = array.array(self.typecode)
+
+    def append(self, item):
+        """
+        Add one item to the section
+        """
+        self.buffer.append(item)
+        if len(self.buffer) >= CHUNK_ROWS:
+            self.flush()
+
+    def write_bytes(self, data):
+        """
+        Add raw bytes to a "B" section
+        """
+        self.flush()
+        self.file.write(data)
+
+    def flush(self):
+        """
+        Write the buffered items to the file
+        """
+        self.buffer.tofile(self.file)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        """
+        Write any remaining items and close the file
+        """
+        self.flush()
+        self.file.close()
+
+class StringSectionWriter:
+    """
+    Writes a string column as .offsets, .data and .nulls sections
+    """
+    def __init__(self, directory, name):
+        self.offsets = SectionWriter(directory, name + ".offsets")
+        self.data = SectionWriter(directory, name + ".data")
+        self.nulls = SectionWriter(directory, name + ".nulls")
+        self.position = 0
+        self.count = 0
+        self.offsets.append(0)
+
+    def append(self, string):
+        """
+        Add one string, or None, to the column
+        """
+        if string is None:
+            # Stored as an empty string, which the nulls section marks
+            self.nulls.append(self.count)
+        else:
+            encoded = string.encode("utf-8", "surrogatepass")
+            self.data.write_bytes(encoded)
+            self.position += len(encoded)
+
+        self.offsets.append(self.position)
+        self.count += 1
+
+    def close(self):
+        """
+        Close the sections' files
+        """
+        self.offsets.close()
+        self.data.close()
+        self.nulls.close()
+
+class Dictionary:
+    """
+    Assigns consecutive codes to strings, or None, and writes them to a
+    string column
+    """
+    def __init__(self, directory, name, initial=()):
+        self.codes = {}
+        self.strings = StringSectionWriter(directory, name)
+        for string in initial:
+            self.code(string)
+
+    def code(self, string):
+        """
+        Return the code of the string, adding it if it is new
+        """
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.codes)
+            self.strings.append(string)
+        return code
+
+def epoch_seconds(text):
+    """
+    Return the epoch time in text as whole seconds, or MISSING
+    """
+    epoch = parser_helpers.parse_epoch(text)
+    return MISSING if epoch is None else math.floor(epoch)
+
+def parse_visits(text):
+    """
+    Return a visit count as an int, or MISSING
+    """
+    visits = parser_helpers.try_parse_int(text)
+    return visits if isinstance(visits, int) and -2**63 < visits < 2**63 else MISSING
+
+def write_index(fetcher, path, cookie_names):
+    """
+    Write every GA cookie found by the fetcher to an index file at path,
+    returning the number of cookies written
+    """
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+
+    try:
+        sections = {name: SectionWriter(directory, name)
+                    for name in ["name", "host", "creation_time", "creation_time_text",
+                                 "visits", "time_first_visit", "time_most_recent_visit",
+                                 "visit_source", "search_term"]}
+        values = StringSectionWriter(directory, "value")
+        hosts = Dictionary(directory, "hosts")
+        creation_time_texts = StringSectionWriter(directory, "creation_time_texts")
+        terms = Dictionary(directory, "terms", ["<not found>"])
+
+        cookie_codes = {name: code for code, name in enumerate(cookie_names)}
+        cookie_counts = [0] * len(cookie_names)
+        text_count = 0
+        rows = 0
+
+        for name, host, creation_time, value in fetcher.iter_cookies():
+            code = cookie_codes.get(name)
+            if code is None:
+                continue
+
+            # Cookies without a host aren't counted, as by the count of
+            # a Firefox database
+            if host is not None:
+                cookie_counts[code] += 1
+            rows += 1
+
+            sections["name"].append(code)
+            sections["host"].append(hosts.code(host))
+            values.append(value)
+
+            # Creation times are stored as numbers only where they would be
+            # formatted the same way as the original value, otherwise the
+            # original is kept so the output is identical
+            if creation_time is None:
+                sections["creation_time"].append(math.nan)
+                sections["creation_time_text"].append(NO_CREATION_TIME)
+            elif isinstance(creation_time, float) or\
+               parser_helpers.try_parse_epoch_datetime(creation_time) is not creation_time:
+                sections["creation_time"].append(float(creation_time))
+                sections["creation_time_text"].append(-1)
+            else:
+                sections["creation_time"].append(math.nan)
+                sections["creation_time_text"].append(text_count)
+                creation_time_texts.append(str(creation_time))
+                text_count += 1
+
+            write_typed_columns(sections, terms, name, value)
+
+        for section in list(sections.values()) + [values, hosts.strings,
+                                                   creation_time_texts, terms.strings]:
+            section.close()
+
+        write_host_index(directory, len(hosts.codes), rows)
+
+        header = {"version": FORMAT_VERSION,
+                  "byteorder": sys.byteorder,
+                  "rows": rows,
+                  "cookie_names": list(cookie_names),
+                  "cookie_counts": cookie_counts}
+
+        assemble(directory, path, header)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return rows
+
+def write_typed_columns(sections, terms, name, value):
+    """
+    Append the parsed GA fields of one cookie to the typed columns
+    """
+    # A value of None has no fields, like one without any dots
+    elements = value.split(".") if value is not None and "." in value else []
+
+    visits = time_first_visit = time_most_recent_visit = MISSING
+    visit_source = search_term = 0
+
+    if name == "_ga":
+        time_first_visit = epoch_seconds(parser_helpers.create_ga_list(elements, 4)[3])
+    elif name == "__utma":
+        padded_elements = parser_helpers.create_ga_list(elements, 6)
+        time_most_recent_visit = epoch_seconds(padded_elements[4])
+        visits = parse_visits(padded_elements[5])
+    elif name == "__utmz":
+        padded_elements = parser_helpers.create_ga_list(elements, 5)
+        visits = parse_visits(padded_elements[2])
+        visit_source = terms.code(parser_helpers.try_parse_kvp(padded_elements[4], "utmcsr"))
+        search_term = terms.code(parser_helpers.try_parse_kvp(padded_elements[4], "utmctr"))
+
+    sections["visits"].append(visits)
+    sections["time_first_visit"].append(time_first_visit)
+    sections["time_most_recent_visit"].append(time_most_recent_visit)
+    sections["visit_source"].append(visit_source)
+    sections["search_term"].append(search_term)
+
+def write_host_index(directory, host_count, rows):
+    """
+    Write the host_index sections by counting sort of the host column
+    """
+    with open(os.path.join(directory, "host"), "rb") as host_file:
+        host_codes = array.array("I")
+        host_codes.fromfile(host_file, rows)
+
+    offsets = array.array("q", [0]) * (host_count + 1)
+    for code in host_codes:
+        offsets[code + 1] += 1
+    for code in range(host_count):
+        offsets[code + 1] += offsets[code]
+
+    next_position = array.array("q", offsets[:-1])
+    sorted_rows = array.array("q", [0]) * rows
+    for row, code in enumerate(host_codes):
+        sorted_rows[next_position[code]] = row
+        next_position[code] += 1
+
+    with open(os.path.join(directory, "host_index.offsets"), "wb") as offsets_file:
+        offsets.tofile(offsets_file)
+    with open(os.path.join(directory, "host_index.rows"), "wb") as rows_file:
+        sorted_rows.tofile(rows_file)
+
+def assemble(directory, path, header):
+    """
+    Join the section files in directory into one index file at path
+    """
+    sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in SECTION_TYPECODES}
+
+    # The header holds the section offsets, which depend on the header's
+    # length, so lay the sections out after a generous estimate of it
+    header["sections"] = {name: [0, size, SECTION_TYPECODES[name]]
+                          for name, size in sizes.items()}
+    start = align(len(MAGIC) + 8 + len(json.dumps(header)) + 32 * len(sizes))
+
+    position = start
+    for name in SECTION_TYPECODES:
+        header["sections"][name][0] = position
+        position = align(position + sizes[name])
+
+    encoded_header = json.dumps(header).encode("utf-8")
+    if len(MAGIC) + 8 + len(encoded_header) > start:
+        raise ValueError("Index header is larger than the space left for it")
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(MAGIC)
+        index_file.write(struct.pack("<Q", len(encoded_header)))
+        index_file.write(encoded_header)
+
+        for name in SECTION_TYPECODES:
+            index_file.write(b"\0" * (header["sections"][name][0] - index_file.tell()))
+            with open(os.path.join(directory, name), "rb") as section_file:
+                shutil.copyfileobj(section_file, index_file)
+
+    os.replace(temp_path, path)
+
+def align(position):
+    """
+    Round position up to a multiple of ALIGNMENT
+    """
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+class StringColumn:
+    """
+    Read-only sequence of the strings, or None, in an index string column
+    """
+    def __init__(self, offsets, data, nulls):
+        self.offsets = offsets
+        self.data = data
+
+        # There are usually none, so they are simply kept in a set
+        self.nulls = set(nulls)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if self.nulls and index in self.nulls:
+            return None
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]],
+                   "utf-8", "surrogatepass")
+
+    def decode_all(self):
+        """
+        Return every string in the column as a list
+        """
+        return [self[index] for index in range(len(self))]
+
+class IndexFile:
+    """
+    Memory-maps an index file, giving access to its sections without
+    reading them into memory
+    """
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            if index_file.read(len(MAGIC)) != MAGIC:
+                raise InvalidIndexError("The selected file is not a GA cookie index")
+
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            header_length = struct.unpack_from("<Q", self.map, len(MAGIC))[0]
+            header_start = len(MAGIC) + 8
+            self.header = json.loads(self.map[header_start:header_start + header_length]
+                                     .decode("utf-8"))
+        except (struct.error, ValueError):
+            raise InvalidIndexError("The selected index file is damaged")
+
+        if self.header.get("version") != FORMAT_VERSION:
+            raise InvalidIndexError("The selected index was written by an unsupported version")
+        if self.header["byteorder"] != sys.byteorder:
+            raise InvalidIndexError("The selected index was written on a computer "
+                                    "with a different byte order")
+
+        self.rows = self.header["rows"]
+        self.cookie_names = self.header["cookie_names"]
+        self.cookie_counts = self.header["cookie_counts"]
+
+        self.view = memoryview(self.map)
+        self.sections = {}
+
+    def section(self, name):
+        """
+        Return the named section as a memoryview of its typed items
+        """
+        if name not in self.sections:
+            offset, length, typecode = self.header["sections"][name]
+            self.sections[name] = self.view[offset:offset + length].cast(typecode)
+        return self.sections[name]
+
+    def strings(self, name):
+        """
+        Return the named string column as a StringColumn
+        """
+        return StringColumn(self.section(name + ".offsets"), self.section(name + ".data"),
+                            self.section(name + ".nulls"))
+
+    def find_rows(self, section_name, byte):
+        """
+        Yield the rows of a "B" section whose item is byte, searching the
+        mapped file directly rather than each item in turn
+        """
+        offset, length, _ = self.header["sections"][section_name]
+        target = bytes([byte])
+        position = self.map.find(target, offset, offset + length)
+        while position != -1:
+            yield position - offset
+            position = self.map.find(target, position + 1, offset + length)
+
+    def close(self):
+        """
+        Release the sections and unmap the file
+        """
+        for section in self.sections.values():
+            section.release()
+        self.sections = {}
+        self.view.release()
+        self.map.close()
@@ -0,0 +1,205 @@
+"""
+Provides helpers for reading cookie files which have been compressed with
+gzip, xz or zstd, or stored in a .zip archive, and for writing compressed
+output files
+"""
+
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+
+# The leading bytes which identify each supported compression format
+MAGIC_NUMBERS = {"gzip": b"\x1f\x8b",
+                 "xz": b"\xfd7zXZ\x00",
+                 "zstd": b"\x28\xb5\x2f\xfd",
+                 "zip": b"PK\x03\x04"}
+
+# The file name suffix of each format which output files can be compressed with
+OUTPUT_SUFFIXES = {None: "",
+                   "gzip": ".gz",
+                   "zstd": ".zst"}
+
+# Size of the chunks in which decompressed data is copied
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The errors which can be raised while reading a damaged compressed file
+DECOMPRESSION_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error, zipfile.BadZipFile)
+
+class CompressionError(Exception):
+    """
+    Raised when a compressed file can't be read, e.g. because the package
+    for its format is not installed or an archive has no usable member
+    """
+
+def detect_compression(path):
+    """
+    Return the name of the compression format of the file at path, from
+    its leading bytes, or None if it is not compressed
+    """
+    with open(path, "rb") as raw_file:
+        header = raw_file.read(8)
+
+    for compression, magic_number in MAGIC_NUMBERS.items():
+        if header.startswith(magic_number):
+            return compression
+    return None
+
+class DecompressedFile(io.RawIOBase):
+    """
+    Raw binary file which reads from a file object of decompressed data,
+    raising CompressionError instead of any of errors, so that data found to
+    be damaged part way through reading it is reported like data which
+    couldn't be opened
+    """
+    def __init__(self, source, errors=DECOMPRESSION_ERRORS):
+        super().__init__()
+        self.source = source
+        self.errors = errors
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.source.seekable()
+
+    def readinto(self, buffer):
+        try:
+            return self.source.readinto(buffer)
+        except self.errors as error:
+            raise CompressionError("The file could not be decompressed: {}".format(error))
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Seeking a compressed stream decompresses everything before the
+        # new position
+        try:
+            return self.source.seek(offset, whence)
+        except self.errors as error:
+            raise CompressionError("The file could not be decompressed: {}".format(error))
+
+    def tell(self):
+        return self.source.tell()
+
+    def close(self):
+        if not self.closed:
+            self.source.close()
+        super().close()
+
+def choose_archive_member(archive, suffixes=()):
+    """
+    Return the name of the member of a zipfile.ZipFile to read: the first
+    file whose name ends with one of the suffixes, or the only file
+    """
+    members = [info.filename for info in archive.infolist() if not info.is_dir()]
+
+    for member in members:
+        if member.lower().endswith(tuple(suffixes)):
+            return member
+
+    if len(members) == 1:
+        return members[0]
+
+    raise CompressionError("The archive does not contain a {} file".format(" or ".join(suffixes)))
+
+def import_zstandard():
+    """
+    Return the zstandard module, which is an optional dependency
+    """
+    try:
+        import zstandard # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise CompressionError("Reading or writing .zst files requires the zstandard package")
+    return zstandard
+
+def open_decompressed(path, suffixes=(), raw_file=None):
+    """
+    Return a binary file object which reads the decompressed contents of the
+    file at path, or the file itself if it is not compressed. For .zip
+    archives the member is chosen with choose_archive_member.
+
+    raw_file may be an already opened raw binary file of path to read the
+    data from, which the caller must close. Errors while reading compressed
+    data are raised as CompressionError
+    """
+    compression = detect_compression(path)
+
+    errors = DECOMPRESSION_ERRORS
+    if compression == "gzip":
+        source = gzip.open(raw_file or path, "rb")
+    elif compression == "xz":
+        source = lzma.open(raw_file or path, "rb")
+    elif compression == "zstd":
+        zstandard = import_zstandard()
+        errors += (zstandard.ZstdError,)
+        source = zstandard.ZstdDecompressor().stream_reader(raw_file or open(path, "rb"),
+                                                            closefd=True)
+    elif compression == "zip":
+        archive = zipfile.ZipFile(raw_file or path)
+        try:
+            # The archive's file stays open until the member is closed
+            source = archive.open(choose_archive_member(archive, suffixes))
+        finally:
+            archive.close()
+    elif raw_file is not None:
+        return io.BufferedReader(raw_file)
+    else:
+        return open(path, "rb")
+
+    return io.BufferedReader(DecompressedFile(source, errors), COPY_CHUNK_SIZE)
+
+def open_decompressed_text(path, suffixes=(), encoding=None, raw_file=None):
+    """
+    Return a text file object which reads the decompressed contents of the
+    file at path with universal newlines, like open(path, "r")
+    """
+    return io.TextIOWrapper(open_decompressed(path, suffixes, raw_file), encoding=encoding)
+
+def decompress_to_memory_or_file(path, suffixes=(), memory_limit=0):
+    """
+    Decompress the file at path, returning (data, None) if it fits within
+    memory_limit bytes, or otherwise (None, temp_path) where temp_path is
+    a temporary file holding the data, which the caller must delete
+    """
+    with open_decompressed(path, suffixes) as source:
+        # Some decompressors return short reads, so read until we either
+        # pass the limit or reach the end of the data
+        chunks = []
+        remaining = memory_limit + 1 if memory_limit > 0 else 0
+        while remaining > 0:
+            chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                return b"".join(chunks), None
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = b"".join(chunks)
+
+        # Too large to keep in memory, so write what we have to disk
+        temp_file = tempfile.NamedTemporaryFile(suffix=suffixes[0] if suffixes else "",
+                                                delete=False)
+        try:
+            with temp_file:
+                temp_file.write(data)
+                shutil.copyfileobj(source, temp_file, COPY_CHUNK_SIZE)
+        except Exception:
+            os.remove(temp_file.name)
+            raise
+
+    return None, temp_file.name
+
+def open_compressed_writer(raw_file, compression=None):
+    """
+    Return a binary file object which writes to raw_file, an open binary
+    file, compressing the data with the given format from OUTPUT_SUFFIXES
+    """
+    if compression == "gzip":
+        # A fixed mtime means the same data always gives the same file
+        return gzip.GzipFile(fileobj=raw_file, mode="wb", mtime=0)
+    if compression == "zstd":
+        return import_zstandard().ZstdCompressor().stream_writer(raw_file, closefd=False)
+
+    return raw_file
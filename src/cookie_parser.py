@@ -3,11 +3,64 @@ Provide helper functions and classes for parsing cookies and GA cookie
 info from supported browsers
 """
 
+import os
 import sqlite3
 from urllib.request import pathname2url
 import csv
+import itertools
+import locale
+import mmap
+import random
+import re
+import weakref
 
+import columnar_index
+import compression_helpers
 import parser_helpers
+import progress_helpers
+import sample_helpers
+import spill_helpers
+import sqlite_helpers
+
+# The phrases which identify each needed column in a .csv file's header row
+CSV_COLUMN_KEYWORDS = {"name": ["name"],
+                       "value": ["value"],
+                       "host": ["host", "site", "domain"],
+                       "create_time": ["create_time", "creation time", "create time"]}
+
+# Size of the first sample of a .csv file given to the dialect sniffer, which
+# is doubled up to the maximum until it holds the whole header row
+SNIFF_SAMPLE_SIZE = 1024
+MAX_SNIFF_SAMPLE_SIZE = 1024 * 1024
+
+# Delimiters to try if the sniffer can't work out a .csv file's dialect
+FALLBACK_DELIMITERS = [",", ";", "\t", "|"]
+
+# Largest decompressed SQLite database which is kept in memory rather than in
+# a temporary file
+MAX_IN_MEMORY_SQLITE = 256 * 1024 * 1024
+
+# Errors raised when a compressed input file can't be read
+DECOMPRESSION_ERRORS = compression_helpers.DECOMPRESSION_ERRORS\
+                       + (compression_helpers.CompressionError,)
+
+# Results of CSVFetcher.read_layout, keyed by file path, size, modification
+# time and options, so that a file isn't sniffed again every time it's opened
+CSV_LAYOUT_CACHE = {}
+CSV_LAYOUT_CACHE_SIZE = 1024
+
+# Number of domains fetched by each query when paging through the domains of
+# an SQLite database in order
+DOMAIN_PAGE_SIZE = 1000
+
+# Estimated bytes used by each (start, end) of CSVFetcher.find_candidate_lines
+CANDIDATE_LINE_BYTES = 120
+
+class ResumeError(ValueError):
+    """
+    Raised when an interrupted pass over a cookie file can't be continued
+    from its checkpoint, e.g. because the file has changed since
+    """
 
 def get_cookie_fetcher(browser, *args, **kwargs):
     """
@@ -19,12 +72,53 @@ def get_cookie_fetcher(browser, *args, **kwargs):
         return Firefox3Fetcher(*args, **kwargs)
     elif browser == "csv":
         return CSVFetcher(*args, **kwargs)
+    elif browser == "index":
+        return IndexFetcher(*args, **kwargs)
+
+def remove_temp_database(conn, path):
+    """
+    Close the connection to a temporary database file and delete it
+    """
+    if conn is not None:
+        conn.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def page_domains(domains, limit=None, offset=0):
+    """
+    Return an iterator over up to limit of the domains, skipping the first
+    offset
+    """
+    return itertools.islice(domains, offset, None if limit is None else offset + limit)
+
+def microseconds_to_seconds(creation_time):
+    """
+    Convert a Firefox creationTime from microseconds to seconds, or return
+    it unchanged if it can't be converted to a float
+    """
+    try:
+        return float(creation_time)/1000000
+    except ValueError:
+        return creation_time # Could not be converted to float
 
 class CookieFetcher:
     """
     Template CookieFetcher for browser fetchers to inherit from
     """
 
+    # The browser shortname given to get_cookie_fetcher for this fetcher
+    browser = None
+
+    # If set, called with the amount of progress made, in the units given by
+    # get_progress_total, as the fetcher works through the cookie file
+    progress_callback = None
+
+    # The spill_helpers.MemoryBudget shared by the fetcher's collections,
+    # and those of anything made with it, or None if memory isn't limited
+    budget = None
+
     def __init__(self, filepath):
         """
         Should be used to prepare target browser artifact to be
@@ -36,11 +130,39 @@ class CookieFetcher:
         Return a list of unique domains for which GA cookies are found
         """
 
+    def iter_domains(self, sorted=True, limit=None, offset=0):
+        # pylint: disable=redefined-builtin
+        """
+        Yield the unique domains for which GA cookies are found, in order if
+        sorted is set, skipping the first offset and stopping after limit
+        if it is given, without needing to build the whole list first
+        """
+
+    def close(self):
+        """
+        Release the cookie file, and anything else the fetcher holds open,
+        after which the fetcher can no longer be used
+        """
+
+    def get_domain_count(self):
+        """
+        Return the number of unique domains for which GA cookies are found
+        """
+
     def get_cookie_count(self):
         """
         Return the total number of GA cookies found
         """
 
+    def get_domain_summary(self):
+        """
+        Return (get_domains(), get_cookie_count()), which fetchers that read
+        the whole file for each of them find together in a single pass. If
+        the domains didn't fit in the memory budget, they are given as a
+        spill_helpers.SpillSet rather than a list
+        """
+        return self.get_domains(), self.get_cookie_count()
+
     def get_cookies(self, cookie_name):
         """
         Return a list of [(cookie host, creation time, value), ...]
@@ -51,153 +173,675 @@ class CookieFetcher:
         Return a ga_summary-style output dict of domain specific cookie
         information
         """
+        return parser_helpers.ga_summary(self.get_domain_rows(domain))
+
+    def get_domain_rows(self, domain):
+        """
+        Return a list of [(cookie name, value), ...] of the GA cookies with
+        the given domain, which get_domain_info summarises
+        """
+
+    def iter_domain_rows(self, domains):
+        """
+        Yield (domain, get_domain_rows(domain)) for each of the given
+        domains in turn, which fetchers that read the whole file for each
+        domain find for all of the domains in a single pass
+        """
+        for domain in domains:
+            yield domain, self.get_domain_rows(domain)
+
+    def iter_cookies(self):
+        """
+        Yield (cookie name, cookie host, creation time, value) for every GA
+        cookie found, in a single pass over the cookies
+        """
+
+    def iter_cookie_chunks(self, chunk_rows, position=None):
+        """
+        Yield (cookies, position) for each chunk of up to chunk_rows rows of
+        the cookie file, where cookies is a list of the chunk's (cookie name,
+        cookie host, creation time, value) in the same order as iter_cookies
+        and position is a JSON-serialisable checkpoint which, when passed
+        back as position, continues from the end of the chunk. Raises
+        ResumeError if position can't be continued from
+        """
+
+    def get_progress_total(self):
+        """
+        Return (total, unit) of the progress reported to progress_callback
+        during a single pass over the cookies, where unit is "rows" or
+        "bytes"
+        """
+
+    def get_sample(self, sample_size, rng=None):
+        """
+        Return a sample_helpers.CookieSample of about sample_size GA
+        cookies, chosen at random using rng, a random.Random. By default
+        every cookie is read once, choosing the sample by reservoir sampling
+        """
+        return sample_helpers.sample_stream(self.iter_cookies(), sample_size,
+                                            rng or random.Random())
 
 class CSVFetcher(CookieFetcher):
     """
     CookieFetcher for fetching from CSV files
     """
-    def __init__(self, file_path, cookie_names):
-        # pylint: disable=super-init-not-called
+    browser = "csv"
+
+    def __init__(self, file_path, cookie_names, scan_mode="full",
+                 delimiter=None, columns=None, max_memory=None):
+        # pylint: disable=super-init-not-called,too-many-arguments
 
         self.cookie_names = cookie_names
         self.error = None
 
+        # Collections which would hold more than max_memory bytes spill to
+        # disk
+        self.budget = spill_helpers.get_budget(max_memory)
+
         self.file_path = file_path
 
-        with open(file_path, "r") as self.csv_file:
-            try:
-                self.csv_dialect = csv.Sniffer().sniff(self.csv_file.read(1024))
-            except csv.Error:
-                self.error = "Error trying to parse .csv file"
-                return
+        # "full" parses every row with csv.reader, "mmap" only parses the
+        # lines which contain a GA cookie name, see scan_mmap
+        self.scan_mode = scan_mode
 
+        # ((file size, modification time), domains, number of cookies,
+        # sorted domains), see get_domain_summary
+        self.domain_summary = None
 
-            self.csv_file.seek(0) # Need to reset back to start after sniffing
+        # The encoding open() uses for the file in text mode, which the raw
+        # bytes searched by scan_mmap are decoded with
+        self.encoding = locale.getpreferredencoding(False)
 
-            reader = csv.reader(self.csv_file, self.csv_dialect)
+        # The file may be compressed, in which case it is decompressed as it
+        # is read
+        self.compression = compression_helpers.detect_compression(file_path)
 
-            # We need to find out which columns correspond to which values, so
-            # use find_headers
-            self.header_indices = self.find_headers(next(reader))
+        # delimiter and columns override the sniffed dialect and the
+        # keyword-matched column headers, see read_layout
+        try:
+            self.csv_dialect, self.header_indices, self.error = self.detect_layout(delimiter,
+                                                                                   columns)
+        except DECOMPRESSION_ERRORS as error:
+            self.error = "The selected file could not be decompressed: {}".format(error)
+
+    def open_text(self, raw_file=None):
+        """
+        Open the file for reading as text, decompressing it if needed. The
+        data is read from raw_file instead, if given
+        """
+        if self.compression is None and raw_file is None:
+            return open(self.file_path, "r")
+
+        return compression_helpers.open_decompressed_text(self.file_path, (".csv",),
+                                                          self.encoding, raw_file)
+
+    def detect_layout(self, delimiter=None, columns=None):
+        """
+        Return the (dialect, header_indices, error) of the file from
+        read_layout, reusing the result if this version of the file has
+        already been opened with the same options
+        """
+        stat = os.stat(self.file_path)
+        key = (os.path.abspath(self.file_path), stat.st_size, stat.st_mtime_ns,
+               delimiter, tuple(sorted((columns or {}).items())))
+
+        if key not in CSV_LAYOUT_CACHE:
+            # Forget the oldest file once the cache is full
+            if len(CSV_LAYOUT_CACHE) >= CSV_LAYOUT_CACHE_SIZE:
+                CSV_LAYOUT_CACHE.pop(next(iter(CSV_LAYOUT_CACHE)))
+
+            CSV_LAYOUT_CACHE[key] = self.read_layout(delimiter, columns)
+
+        dialect, header_indices, error = CSV_LAYOUT_CACHE[key]
+
+        # Copy the indices so that the cached ones can't be changed
+        return dialect, dict(header_indices), error
+
+    def read_layout(self, delimiter=None, columns=None):
+        """
+        Work out the dialect of the file and the header indices of its
+        columns, returning (dialect, header_indices, error) where error is
+        None if the file can be read
+        """
+        if delimiter is not None:
+            dialects = [type("explicit", (csv.excel,), {"delimiter": delimiter})]
+        else:
+            with self.open_text() as csv_file:
+                dialects = self.sniff_dialects(csv_file)
+
+            if not dialects:
+                return None, {}, "Error trying to parse .csv file"
+
+        # Use the first dialect whose header row has all of the columns,
+        # otherwise report the columns missing with the most likely one.
+        # The file is reopened rather than rewound as decompressing streams
+        # may not be able to seek
+        missing = None
+        for dialect in dialects:
+            with self.open_text() as csv_file:
+                # We need to find out which columns correspond to which
+                # values, so use find_headers
+                header_indices = self.find_headers(next(csv.reader(csv_file, dialect), []),
+                                                   columns)
+
+            if None not in header_indices.values():
+                return dialect, header_indices, None
+
+            if missing is None:
+                missing = header_indices
 
         # If any of the header names couldn't be found
-        if None in self.header_indices.values():
-            not_found = ", ".join([k for k, v in self.header_indices.items() if v is None])
-            self.error = "Could not find the column headers: {}".format(not_found)
-            return
+        not_found = ", ".join([k for k, v in missing.items() if v is None])
+        return dialects[0], missing, "Could not find the column headers: {}".format(not_found)
 
-    def find_headers(self, row):
+    @staticmethod
+    def sniff_dialects(csv_file):
+        """
+        Return a list of the dialects the file is likely to be in, most
+        likely first, or an empty list if the dialect can't be found
+        """
+        # Keep doubling the sample until it holds the whole header row, so
+        # files with very wide headers can still be sniffed
+        sample = csv_file.read(SNIFF_SAMPLE_SIZE)
+        at_end = len(sample) < SNIFF_SAMPLE_SIZE
+
+        while "\n" not in sample and not at_end and len(sample) < MAX_SNIFF_SAMPLE_SIZE:
+            more = csv_file.read(len(sample))
+            at_end = len(more) < len(sample)
+            sample += more
+
+        # Only sniff whole lines, so that the row cut off at the end of the
+        # sample doesn't confuse the sniffer
+        if not at_end and "\n" in sample:
+            sample = sample[:sample.rindex("\n") + 1]
+
+        dialects = []
+        try:
+            dialects.append(csv.Sniffer().sniff(sample))
+        except csv.Error:
+            pass
+
+        # Fall back to the common delimiter which appears most in the header
+        header = sample.split("\n", 1)[0]
+        delimiter = max(FALLBACK_DELIMITERS, key=header.count)
+        if delimiter in header:
+            dialects.append(type("guessed", (csv.excel,), {"delimiter": delimiter}))
+
+        return dialects
+
+    @staticmethod
+    def find_headers(row, columns=None):
         """
         Return a dict of the column indexes in which the fields name, value,
         host, and create_time are found in the given header row, in the format
-        {"name": n1, "value": n2, ...}
+        {"name": n1, "value": n2, ...}. columns may give the column name or
+        index of any of the fields, to be used instead of keyword matching
         """
-        keywords = {"name": ["name"],
-                    "value": ["value"],
-                    "host": ["host", "site", "domain"],
-                    "create_time": ["create_time", "creation time", "create time"]}
+        columns = columns or {}
 
         keyword_indices = {"name": None,
                            "value": None,
                            "host": None,
                            "create_time": None}
 
+        lowered = [column.strip().lower() for column in row]
+
+        # Explicitly given columns, either by index or by exact name
+        for field, column in columns.items():
+            if isinstance(column, int):
+                if 0 <= column < len(row):
+                    keyword_indices[field] = column
+            elif column.strip().lower() in lowered:
+                keyword_indices[field] = lowered.index(column.strip().lower())
+
+        # Fields which still need to be found by keyword
+        remaining = [field for field in keyword_indices if field not in columns]
+
         # For every column in the header row, try to match it to a header name
         # by checking if it contains any of the relevant keywords, and from
         # this update the keyword_indices dict with the found index
 
-        for column_index, column in enumerate(row):
-            # Header names, who have key values of None in keyword_indices,
-            # i.e. whose column index has not yet been found.
-            filtered_headers = [k for k, v in keyword_indices.items() if v is None]
-            for possible_column_name in filtered_headers:
-                # The column contains one of the keywords
-                if any([i in column.lower() for i in keywords[possible_column_name]]):
-                    keyword_indices[possible_column_name] = column_index
+        for column_index, column in enumerate(lowered):
+            for field in remaining:
+                # The field's column has not been found yet, and this column
+                # contains one of its keywords
+                if keyword_indices[field] is None\
+                   and any(keyword in column for keyword in CSV_COLUMN_KEYWORDS[field]):
+                    keyword_indices[field] = column_index
 
         return keyword_indices
 
+    def iter_ga_rows(self):
+        """
+        Yield every row (excluding the header row) whose cookie name is one
+        of cookie_names, using the configured scan_mode
+        """
+        # Compressed files can't be searched in place
+        if self.scan_mode == "mmap" and self.compression is None:
+            lines = self.find_candidate_lines()
+            if lines is not None:
+                return self.scan_mmap(lines, self.progress_callback)
+
+        return self.scan_full()
+
+    def scan_full(self):
+        """
+        Yield GA cookie rows by parsing every row of the file
+        """
+        name_index = self.header_indices["name"]
+
+        # Progress is counted in bytes of the file on disk, so the file is
+        # opened here to be able to tell how far through it we are
+        raw_file = None
+        if self.progress_callback is not None:
+            raw_file = open(self.file_path, "rb", buffering=0)
+
+        try:
+            with self.open_text(raw_file) as csv_file:
+                reader = csv.reader(csv_file, self.csv_dialect)
+
+                # Get rid of the header row from the reader
+                next(reader)
+
+                # The rows are read in chunks when reporting progress
+                chunks = [reader]
+                if raw_file is not None:
+                    chunks = progress_helpers.report_chunks(reader, lambda _: raw_file.tell(),
+                                                            os.path.getsize(self.file_path),
+                                                            self.progress_callback)
+
+                for chunk in chunks:
+                    for row in chunk:
+                        if row[name_index] in self.cookie_names:
+                            yield row
+        finally:
+            if raw_file is not None:
+                raw_file.close()
+
+    def find_candidate_lines(self):
+        """
+        Search the raw bytes of the file for the cookie names, returning a
+        list of (start, end) byte offsets of the lines which contain one, or
+        None if line boundaries can't be trusted to be row boundaries, in
+        which case the whole file must be parsed
+        """
+        tokens = sorted((name.encode(self.encoding) for name in self.cookie_names),
+                        key=len, reverse=True)
+        pattern = re.compile(b"|".join(re.escape(token) for token in tokens))
+
+        quotechar = (self.csv_dialect.quotechar or "").encode(self.encoding)
+
+        with open(self.file_path, "rb") as raw_file:
+            try:
+                data = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # Empty file, which can't be mapped
+                return []
+
+            with data:
+                # Quoted fields may contain newlines, so if the file has any
+                # quotes we keep count of them: a line only starts a row if an
+                # even number of quotes came before it
+                track_quotes = bool(quotechar)\
+                               and self.csv_dialect.quoting != csv.QUOTE_NONE\
+                               and data.find(quotechar) != -1
+                if track_quotes and self.csv_dialect.escapechar:
+                    return None # Escaped quotes make the count meaningless
+
+                quotes_before = 0
+                counted_to = 0
+
+                # Skip the header row
+                position = data.find(b"\n") + 1
+                if position == 0:
+                    return []
+
+                lines = []
+                match = pattern.search(data, position)
+                while match is not None:
+                    start = data.rfind(b"\n", 0, match.start()) + 1
+                    end = data.find(b"\n", match.end())
+                    if end == -1:
+                        end = len(data)
+
+                    line = data[start:end]
+
+                    # A lone carriage return is also a line break in text mode
+                    if b"\r" in line.rstrip(b"\r"):
+                        return None
+
+                    if track_quotes:
+                        quotes_before += data[counted_to:start].count(quotechar)
+                        counted_to = start
+                        if quotes_before % 2 or line.count(quotechar) % 2:
+                            return None
+
+                    lines.append((start, end))
+
+                    # Parsing the whole file doesn't need the list of lines
+                    if self.budget is not None\
+                       and len(lines)*CANDIDATE_LINE_BYTES > self.budget.available():
+                        return None
+
+                    match = pattern.search(data, end + 1)
+
+        return lines
+
+    def scan_mmap(self, lines, progress_callback=None):
+        """
+        Yield GA cookie rows by decoding and parsing only the given
+        (start, end) byte ranges of the file, reporting the progress through
+        the file to progress_callback if given
+        """
+        if not lines:
+            if progress_callback is not None:
+                progress_callback(os.path.getsize(self.file_path))
+            return
+
+        name_index = self.header_indices["name"]
+
+        with open(self.file_path, "rb") as raw_file,\
+             mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+            # Progress is counted up to the end of each chunk of lines
+            chunks = [lines]
+            if progress_callback is not None:
+                chunks = progress_helpers.report_chunks(lines, lambda line: line[1],
+                                                        len(data), progress_callback)
+
+            decoded = (data[start:end].decode(self.encoding).rstrip("\r")
+                       for chunk in chunks for start, end in chunk)
+
+            for row in csv.reader(decoded, self.csv_dialect):
+                # The cookie name may have only appeared in another column
+                if row[name_index] in self.cookie_names:
+                    yield row
 
     def get_domains(self):
-        with open(self.file_path, "r") as self.csv_file:
-            reader = csv.reader(self.csv_file, self.csv_dialect)
+        # Find all domains by getting the nth element of each GA row, where
+        # n is the index of the host value header from header_indices, and
+        # use a set to make them unique
+        host_index = self.header_indices["host"]
+        unique_domains = spill_helpers.make_set(self.budget)
+        for row in self.iter_ga_rows():
+            unique_domains.add(row[host_index])
 
-            # Get rid of the header row from the reader
-            next(reader)
+        return list(unique_domains)
 
-            # All rows containing GA cookies
-            ga_rows = [row for row in reader\
-                       if row[self.header_indices["name"]] in self.cookie_names]
+    def get_sorted_domains(self):
+        """
+        Return the sorted list of unique domains, which is kept until the
+        file changes so that paging through it only reads the file once
+        """
+        self.get_domain_summary()
+        return self.domain_summary[3]
 
-            # Find all domains by getting the nth element of each row, where
-            # n is the index of the host value header from header_indices
-            all_domains = [row[self.header_indices["host"]] for row in ga_rows]
+    def iter_domains(self, sorted=True, limit=None, offset=0):
+        # pylint: disable=redefined-builtin
+        if sorted:
+            return page_domains(self.get_sorted_domains(), limit, offset)
 
-            # Use set to make list unique
-            unique_domains = list(set(all_domains))
-        return unique_domains
+        # Otherwise each domain is given as soon as it is first found
+        return page_domains(self.iter_new_domains(), limit, offset)
 
-    def get_domain_info(self, domain):
-        with open(self.file_path, "r") as self.csv_file:
-            reader = csv.reader(self.csv_file, self.csv_dialect)
+    def iter_new_domains(self):
+        """
+        Yield each unique domain in the order they are found in the file
+        """
+        host_index = self.header_indices["host"]
+        found = spill_helpers.make_set(self.budget)
+
+        for row in self.iter_ga_rows():
+            if row[host_index] not in found:
+                found.add(row[host_index])
+                yield row[host_index]
+
+    def get_domain_count(self):
+        return len(self.get_sorted_domains())
+
+    def get_domain_rows(self, domain):
+        # Find all rows with GA cookies with this domain
+        structured_rows = [[row[self.header_indices["name"]],
+                            row[self.header_indices["value"]]] for row in self.iter_ga_rows()\
+                           if row[self.header_indices["host"]] == domain]
 
-            # Get rid of the header row from the reader
-            next(reader)
+        return structured_rows
 
-            # Find all rows with GA cookies with this domain
-            domain_rows = [row for row in reader\
-                           if row[self.header_indices["host"]] == domain\
-                            and row[self.header_indices["name"]] in self.cookie_names]
+    def iter_domain_rows(self, domains):
+        # The domains are all found in one pass, rather than a pass each
+        name_index = self.header_indices["name"]
+        host_index = self.header_indices["host"]
+        value_index = self.header_indices["value"]
 
-            structured_rows = [[row[self.header_indices["name"]],
-                                row[self.header_indices["value"]]] for row in domain_rows]
-        return parser_helpers.ga_summary(structured_rows)
+        domain_rows = spill_helpers.SpillGroups(self.budget)
+        for domain in domains:
+            domain_rows.add_key(domain)
+
+        for row in self.iter_ga_rows():
+            if row[host_index] in domain_rows:
+                domain_rows.append(row[host_index], [row[name_index], row[value_index]])
+
+        try:
+            yield from domain_rows.items()
+        finally:
+            domain_rows.close()
 
     def get_cookie_count(self):
-        with open(self.file_path, "r") as self.csv_file:
-            reader = csv.reader(self.csv_file, self.csv_dialect)
+        return sum(1 for _ in self.iter_ga_rows())
 
-            # All rows containing GA cookies
-            ga_rows = [row for row in reader\
-                       if row[self.header_indices["name"]] in self.cookie_names]
-            return len(ga_rows)
+    def close(self):
+        # The domains may have been spilled to a temporary database
+        if self.domain_summary is not None\
+           and isinstance(self.domain_summary[1], spill_helpers.SpillSet):
+            self.domain_summary[1].close()
+        self.domain_summary = None
 
-    def get_cookies(self, cookie_name):
-        with open(self.file_path, "r") as self.csv_file:
-            reader = csv.reader(self.csv_file, self.csv_dialect)
+    def get_domain_summary(self):
+        # Found in one pass, and kept along with the sorted domains until the
+        # file changes
+        stat = os.stat(self.file_path)
+        key = (stat.st_size, stat.st_mtime_ns)
+
+        if self.domain_summary is None or self.domain_summary[0] != key:
+            host_index = self.header_indices["host"]
 
-            # Create a list of lists in the form:
-            # [[Cookie host, Creation time, Value], ...]
-            structured_rows = [[row[self.header_indices["host"]],
-                                row[self.header_indices["create_time"]],
-                                row[self.header_indices["value"]]] for row in reader\
-                               if row[self.header_indices["name"]] == cookie_name]
+            if self.domain_summary is not None\
+               and isinstance(self.domain_summary[1], spill_helpers.SpillSet):
+                self.domain_summary[1].close()
+
+            # The domains are added to the set in the same order as
+            # get_domains adds them, so the list is in the same order too
+            domains = spill_helpers.make_set(self.budget)
+            cookie_count = 0
+            for row in self.iter_ga_rows():
+                domains.add(row[host_index])
+                cookie_count += 1
+
+            if isinstance(domains, spill_helpers.SpillSet) and domains.spilled:
+                # Iterating over a spilled set gives the domains in order
+                self.domain_summary = (key, domains, cookie_count, domains)
+                return domains, cookie_count
+
+            domains = list(domains)
+            self.domain_summary = (key, domains, cookie_count, sorted(domains))
+
+        if isinstance(self.domain_summary[1], spill_helpers.SpillSet):
+            return self.domain_summary[1], self.domain_summary[2]
+        return list(self.domain_summary[1]), self.domain_summary[2]
+
+    def get_cookies(self, cookie_name):
+        # Create a list of lists in the form:
+        # [[Cookie host, Creation time, Value], ...]
+        structured_rows = [[row[self.header_indices["host"]],
+                            row[self.header_indices["create_time"]],
+                            row[self.header_indices["value"]]] for row in self.iter_ga_rows()\
+                           if row[self.header_indices["name"]] == cookie_name]
 
         return parser_helpers.ga_generate_table(structured_rows, cookie_name)
 
+    def iter_cookies(self):
+        name_index = self.header_indices["name"]
+        host_index = self.header_indices["host"]
+        create_time_index = self.header_indices["create_time"]
+        value_index = self.header_indices["value"]
+
+        for row in self.iter_ga_rows():
+            yield row[name_index], row[host_index], row[create_time_index], row[value_index]
+
+    def get_cookie_tuples(self, rows):
+        """
+        Return a list of (cookie name, cookie host, creation time, value) for
+        each of the given GA cookie rows
+        """
+        name_index = self.header_indices["name"]
+        host_index = self.header_indices["host"]
+        create_time_index = self.header_indices["create_time"]
+        value_index = self.header_indices["value"]
+
+        return [(row[name_index], row[host_index], row[create_time_index], row[value_index])
+                for row in rows]
+
+    def iter_cookie_chunks(self, chunk_rows, position=None):
+        # Compressed files can't be searched in place
+        lines = None
+        if self.scan_mode == "mmap" and self.compression is None:
+            lines = self.find_candidate_lines()
+
+        # A checkpoint is only meaningful to the same kind of scan
+        scan = "full" if lines is None else "mmap"
+        if position is not None and position.get("scan") != scan:
+            raise ResumeError("The .csv file can't be continued from its checkpoint, as it "
+                              "is no longer read in the same way")
+
+        if lines is None:
+            return self.iter_full_chunks(chunk_rows, position)
+        return self.iter_mmap_chunks(lines, chunk_rows, position)
+
+    def iter_full_chunks(self, chunk_rows, position=None):
+        """
+        iter_cookie_chunks for scan_full. Each position holds the number of
+        rows read after the header and, unless the file is compressed in a
+        way which can't be seeked, the position in the text after them
+        """
+        name_index = self.header_indices["name"]
+
+        # Progress is counted in bytes of the file on disk, as in scan_full
+        raw_file = None
+        if self.progress_callback is not None:
+            raw_file = open(self.file_path, "rb", buffering=0)
+        reported = 0
+
+        try:
+            with self.open_text(raw_file) as csv_file:
+                # The text position can't be told while iterating over the
+                # file, but it can while reading it line by line
+                reader = csv.reader(iter(csv_file.readline, ""), self.csv_dialect)
+                seekable = csv_file.seekable()
+
+                rows_read = 0
+                if position is not None and position["offset"] is not None:
+                    csv_file.seek(position["offset"])
+                    rows_read = position["rows"]
+                else:
+                    # Get rid of the header row from the reader
+                    next(reader)
+                    if position is not None:
+                        rows_read = position["rows"]
+                        for _ in itertools.islice(reader, rows_read):
+                            pass
+
+                while True:
+                    rows = list(itertools.islice(reader, chunk_rows))
+                    if not rows:
+                        break
+                    rows_read += len(rows)
+
+                    cookies = self.get_cookie_tuples(row for row in rows
+                                                     if row[name_index] in self.cookie_names)
+                    yield cookies, {"scan": "full", "rows": rows_read,
+                                    "offset": csv_file.tell() if seekable else None}
+
+                    if raw_file is not None and raw_file.tell() > reported:
+                        self.progress_callback(raw_file.tell() - reported)
+                        reported = raw_file.tell()
+        finally:
+            if raw_file is not None:
+                raw_file.close()
+
+        total = os.path.getsize(self.file_path)
+        if self.progress_callback is not None and total > reported:
+            self.progress_callback(total - reported)
+
+    def iter_mmap_chunks(self, lines, chunk_rows, position=None):
+        """
+        iter_cookie_chunks for scan_mmap, in chunks of candidate lines. Each
+        position holds the byte offset of the end of the chunk's last line
+        """
+        if position is not None:
+            lines = [line for line in lines if line[0] >= position["offset"]]
+
+        reported = 0
+        for start in range(0, len(lines), chunk_rows):
+            chunk = lines[start:start + chunk_rows]
+            yield self.get_cookie_tuples(self.scan_mmap(chunk)),\
+                  {"scan": "mmap", "offset": chunk[-1][1]}
+
+            if self.progress_callback is not None and chunk[-1][1] > reported:
+                self.progress_callback(chunk[-1][1] - reported)
+                reported = chunk[-1][1]
+
+        total = os.path.getsize(self.file_path)
+        if self.progress_callback is not None and total > reported:
+            self.progress_callback(total - reported)
+
+    def get_progress_total(self):
+        return os.path.getsize(self.file_path), "bytes"
+
 class Firefox3Fetcher(CookieFetcher):
     """
     CookieFetcher for Firefox 3+
     """
-    def __init__(self, filepath, cookie_names):
-        # pylint: disable=super-init-not-called
+    browser = "firefox.3+"
 
-        # Use a path uri to prevent sqlite from creating the
-        # database, allowing us to check whether the database
-        # can be read without automatically creating it
-        path_uri = "file:{}?mode=rw".format(pathname2url(filepath))
+    def __init__(self, filepath, cookie_names, max_memory=None):
+        # pylint: disable=super-init-not-called
 
         self.cookie_names = cookie_names
 
         self.error = None
 
-        # Test file can actually be opened
+        # Set by open_compressed, deletes the decompressed copy
+        self.remove_temp = None
+
+        # SQLite's page caches and temporary tables are kept within the
+        # budget
+        self.budget = spill_helpers.get_budget(max_memory)
+
+        # Compressed databases are decompressed into memory, or into a
+        # temporary file if they are too large
         try:
-            self.conn = sqlite3.connect(path_uri, uri=True)
-        except sqlite3.OperationalError:
+            compression = compression_helpers.detect_compression(filepath)
+        except OSError:
             self.error = "The selected file could not be opened"
             return
 
+        if compression is not None:
+            self.open_compressed(filepath)
+            if self.error is not None:
+                return
+        else:
+            # Use a path uri to prevent sqlite from creating the
+            # database, allowing us to check whether the database
+            # can be read without automatically creating it
+            path_uri = "file:{}?mode=rw".format(pathname2url(filepath))
+
+            # Test file can actually be opened
+            try:
+                self.conn = sqlite3.connect(path_uri, uri=True)
+            except sqlite3.OperationalError:
+                self.error = "The selected file could not be opened"
+                return
+
         # Test that it is a valid database, and that the moz_cookies
         # table exists
         try:
@@ -214,57 +858,437 @@ but did not have the moz_cookies table"
             self.error = "The selected file is not a valid sqlite3 database"
             return
 
+        spill_helpers.limit_sqlite_memory(self.conn, self.budget)
+
+        # Columns have been added and removed between Firefox versions
+        try:
+            self.schema = sqlite_helpers.detect_schema(self.conn)
+        except sqlite3.DatabaseError:
+            self.error = "The selected file is not a valid sqlite3 database"
+            return
+
+        missing_columns = self.schema.get_missing_columns()
+        if missing_columns:
+            self.error = "The moz_cookies table of the selected file does not have the \
+{} column(s)".format(", ".join(missing_columns))
+            return
+
+        # Chooses the table each query is run on
+        self.planner = sqlite_helpers.GAQueryPlanner(self.conn, self.cookie_names, self.schema)
+
+    def open_compressed(self, filepath):
+        """
+        Decompress the database and connect to the decompressed copy
+        """
+        # Connection.deserialize is needed to load a database from memory
+        memory_limit = MAX_IN_MEMORY_SQLITE if hasattr(sqlite3.Connection, "deserialize") else 0
+        if self.budget is not None:
+            memory_limit = min(memory_limit, self.budget.available() // 2)
+
+        try:
+            data, temp_path = compression_helpers.decompress_to_memory_or_file(filepath,
+                                                                               (".sqlite",),
+                                                                               memory_limit)
+        except DECOMPRESSION_ERRORS as error:
+            self.error = "The selected file could not be decompressed: {}".format(error)
+            return
+
+        try:
+            if temp_path is None:
+                self.conn = sqlite3.connect(":memory:")
+                self.conn.deserialize(data)
+            else:
+                self.conn = sqlite3.connect(temp_path)
+        except sqlite3.DatabaseError:
+            self.error = "The selected file is not a valid sqlite3 database"
+
+        if temp_path is not None:
+            # Delete the temporary copy once this fetcher is no longer used
+            self.remove_temp = weakref.finalize(self, remove_temp_database,
+                                                getattr(self, "conn", None), temp_path)
+
+    def close(self):
+        if self.remove_temp is not None:
+            # Also closes the connection
+            self.remove_temp()
+        elif getattr(self, "conn", None) is not None:
+            self.conn.close()
+
     def get_domains(self):
-        # Create a list with the correct number of ?s to act as a parameter
-        # substition template for the SQLite query
-        question_marks = ",".join(["?"]*len(self.cookie_names))
-        # Use the question_marks list to create the query
-        self.cursor.execute("SELECT DISTINCT host FROM moz_cookies WHERE \
-name IN ({})".format(question_marks),
-                            self.cookie_names)
+        self.planner.execute(self.cursor, "domains")
 
-        results = self.cursor.fetchall()
-        return [result[0] for result in results]
+        return [result[0] for result in self.cursor]
 
-    def get_domain_info(self, domain):
-        # Create a list with the correct number of ?s to act as a parameter
-        # substition template for the SQLite query
-        question_marks = ",".join(["?"]*len(self.cookie_names))
-        # Use the question_marks list to create the query
-        self.cursor.execute("SELECT name,value FROM moz_cookies WHERE \
-name IN ({}) AND host = ?".format(question_marks),
-                            self.cookie_names+[domain])
+    def iter_domains(self, sorted=True, limit=None, offset=0):
+        # pylint: disable=redefined-builtin
+        # A separate cursor, so that other queries can be made while the
+        # domains are being iterated over
+        cursor = self.conn.cursor()
+
+        if not sorted:
+            self.planner.execute(cursor, "domain_page", [-1 if limit is None else limit, offset])
+            for (host,) in cursor:
+                yield host
+            return
+
+        # Fetch a page at a time, starting each page after the last domain
+        # of the one before, so that SQLite never has to skip over the
+        # domains which have already been given and no page is held for long
+        remaining = limit
+        page = []
+
+        while remaining is None or remaining > 0:
+            page_size = DOMAIN_PAGE_SIZE if remaining is None else min(DOMAIN_PAGE_SIZE, remaining)
+
+            if not page: # The first page, which may start at an offset
+                self.planner.execute(cursor, "first_sorted_domains", [page_size, offset])
+            else:
+                # NULL sorts first, so is only ever in the first page
+                self.planner.execute(cursor, "next_sorted_domains", [page[-1], page_size])
+
+            page = [host for (host,) in cursor.fetchall()]
+            yield from page
+
+            if remaining is not None:
+                remaining -= len(page)
+            if len(page) < page_size or page[-1] is None:
+                break
 
-        return parser_helpers.ga_summary(self.cursor.fetchall())
+    def get_domain_count(self):
+        self.planner.execute(self.cursor, "domain_count")
+
+        return self.cursor.fetchone()[0]
+
+    def get_domain_rows(self, domain):
+        self.planner.execute(self.cursor, "domain_info", [domain])
+
+        return self.cursor.fetchall()
 
     def get_cookies(self, cookie_name):
         # Create a list of lists in the form:
         # [[Cookie host, Creation time, Value], ...]
-        self.cursor.execute("SELECT host, creationTime, value FROM moz_cookies WHERE name = ?",
-                            [cookie_name])
+        self.planner.execute(self.cursor, "cookies", [cookie_name])
 
         rows = []
 
         # Convert creationTime in all rows from microseconds to seconds
-        for row in self.cursor.fetchall():
-            row_list = list(row)
-            try:
-                row_list[1] = float(row[1])/1000000 # Convert from microseconds to seconds
-            except ValueError:
-                pass # Could not be converted to float
-            finally:
-                rows.append(tuple(row_list))
+        for host, creation_time, value in self.cursor:
+            rows.append((host, microseconds_to_seconds(creation_time), value))
 
         return parser_helpers.ga_generate_table(rows, cookie_name)
 
     def get_cookie_count(self):
-        # Create a list with the correct number of ?s to act as a parameter
-        # substition template for the SQLite query
-        question_marks = ",".join(["?"]*len(self.cookie_names))
-        # Use the question_marks list to create the query
-        self.cursor.execute("SELECT COUNT(host) FROM moz_cookies WHERE \
-name IN ({})".format(question_marks),
-                            self.cookie_names)
+        self.planner.execute(self.cursor, "cookie_count")
 
         results = self.cursor.fetchone()
         return results[0]
+
+    def iter_cookies(self):
+        # A separate cursor, so that other queries can be made while the
+        # cookies are being iterated over
+        cursor = self.conn.cursor()
+        self.planner.execute(cursor, "all_cookies")
+
+        for name, host, creation_time, value in progress_helpers.report_rows(
+                cursor, self.progress_callback):
+            yield name, host, microseconds_to_seconds(creation_time), value
+
+    def iter_cookie_chunks(self, chunk_rows, position=None):
+        # Each position holds the number of rows read, which the query
+        # continues from, and the rowid of the last of them, which is used to
+        # check that the rows are still in the same order
+        cursor = self.conn.cursor()
+
+        rows_read = 0 if position is None else position["rows"]
+
+        # The same query as iter_cookies, so that the rows are in the same
+        # order, starting from the last row already read
+        self.planner.execute(cursor, "cookie_chunks", [max(rows_read - 1, 0)])
+
+        if rows_read:
+            last_row = cursor.fetchone()
+            if last_row is None or last_row[0] != position["rowid"]:
+                raise ResumeError("The cookie database has changed since its checkpoint")
+
+            if self.progress_callback is not None:
+                self.progress_callback(rows_read)
+
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            rows_read += len(rows)
+
+            yield [(name, host, microseconds_to_seconds(creation_time), value)
+                   for _, name, host, creation_time, value in rows],\
+                  {"rows": rows_read, "rowid": rows[-1][0]}
+
+            if self.progress_callback is not None:
+                self.progress_callback(len(rows))
+
+    def get_progress_total(self):
+        self.planner.execute(self.cursor, "row_count")
+
+        return self.cursor.fetchone()[0], "rows"
+
+    def get_sample(self, sample_size, rng=None):
+        # SQLite has no TABLESAMPLE, so blocks of consecutive rowids are
+        # read in a random order instead, each found through the rowid
+        # rather than by reading the table, until enough GA cookies have
+        # been found. Unless every GA cookie has to be read anyway, the
+        # number of cookies is estimated from the number in each block read
+        rng = rng or random.Random()
+
+        self.cursor.execute("SELECT MIN(rowid), MAX(rowid) FROM moz_cookies")
+        first_rowid, last_rowid = self.cursor.fetchone()
+
+        # The domains are counted exactly if an index makes that quick.
+        # Otherwise only the hosts are read for every cookie, to estimate
+        # the number of domains without having to keep them, which counts
+        # the cookies exactly too. That pass is the progress reported
+        exact_count = None
+        if self.planner.needs_ga_table("domain_count"):
+            hosts = sample_helpers.HyperLogLog()
+            self.planner.execute(self.cursor, "hosts")
+
+            # zip stops at the end of the hosts, before taking a number
+            # from counter, so the next number is the number of hosts
+            counter = itertools.count()
+            hosts.update(host for (host,), _ in zip(
+                progress_helpers.report_rows(self.cursor, self.progress_callback), counter))
+            exact_count = next(counter)
+
+            domain_count, domain_error = hosts.count(), hosts.get_error()
+        else:
+            domain_count, domain_error = self.get_domain_count(), 0
+
+        # Otherwise the progress is how close the blocks read are to being
+        # enough, as a share of the total of get_progress_total
+        progress_total = 0
+        if exact_count is None and self.progress_callback is not None:
+            progress_total = self.get_progress_total()[0]
+        reported = 0
+
+        rows = []
+        block_counts = []
+        block_count = 0
+        if first_rowid is not None:
+            block_count = (last_rowid - first_rowid) // sample_helpers.SAMPLE_BLOCK_ROWS + 1
+
+            for block in sample_helpers.iter_random_blocks(block_count, rng):
+                start = first_rowid + block * sample_helpers.SAMPLE_BLOCK_ROWS
+                self.planner.execute(self.cursor, "sample_block",
+                                     [start, start + sample_helpers.SAMPLE_BLOCK_ROWS - 1])
+                block_rows = self.cursor.fetchall()
+
+                rows.extend(block_rows)
+                block_counts.append(len(block_rows))
+
+                if progress_total:
+                    done = min(len(rows) / sample_size,
+                               len(block_counts) / sample_helpers.MIN_SAMPLE_BLOCKS, 1)
+                    if int(done * progress_total) > reported:
+                        self.progress_callback(int(done * progress_total) - reported)
+                        reported = int(done * progress_total)
+
+                if len(rows) >= sample_size\
+                   and len(block_counts) >= sample_helpers.MIN_SAMPLE_BLOCKS:
+                    break
+
+        # Every block was read without taking enough
+        if progress_total > reported:
+            self.progress_callback(progress_total - reported)
+
+        # In rowid order, which is the order the table stores them in
+        rows.sort(key=lambda row: row[0])
+        cookies = [(name, host, microseconds_to_seconds(creation_time), value)
+                   for _, name, host, creation_time, value in rows]
+
+        cookie_count, cookie_error = sample_helpers.estimate_block_total(block_counts,
+                                                                         block_count)
+        if exact_count is not None:
+            cookie_count, cookie_error = exact_count, 0
+        sample = sample_helpers.CookieSample(cookies, cookie_count, cookie_error,
+                                             domain_count, domain_error)
+
+        # Every block was read, so the domains are known exactly
+        if len(block_counts) == block_count:
+            sample.domain_count, sample.domain_error = len(sample.get_domains()), 0
+        return sample
+
+class IndexFetcher(CookieFetcher):
+    """
+    CookieFetcher for index files written by columnar_index.write_index,
+    which are memory-mapped so that opening them takes almost no time
+    """
+    browser = "index"
+
+    def __init__(self, filepath, cookie_names, max_memory=None):
+        # pylint: disable=super-init-not-called
+
+        self.cookie_names = cookie_names
+        self.error = None
+
+        # The index is memory-mapped, so only what is made with the fetcher
+        # uses the budget
+        self.budget = spill_helpers.get_budget(max_memory)
+
+        try:
+            self.index = columnar_index.IndexFile(filepath)
+        except OSError:
+            self.error = "The selected file could not be opened"
+            return
+        except columnar_index.InvalidIndexError as error:
+            self.error = str(error)
+            return
+
+        # Codes of the cookie names in the index which were asked for
+        self.codes = [code for code, name in enumerate(self.index.cookie_names)
+                      if name in cookie_names]
+
+        # The host strings are only decoded when first needed
+        self.hosts = None
+        self.host_codes = None
+        self.sorted_domains = None
+
+    def close(self):
+        if getattr(self, "index", None) is not None:
+            self.index.close()
+
+    def get_hosts(self):
+        """
+        Return the list of every host in the index, by host code
+        """
+        if self.hosts is None:
+            self.hosts = self.index.strings("hosts").decode_all()
+        return self.hosts
+
+    def get_creation_time(self, row):
+        """
+        Return the creation time of a row as it was given to the index
+        """
+        text_index = self.index.section("creation_time_text")[row]
+        if text_index >= 0:
+            return self.index.strings("creation_time_texts")[text_index]
+        return self.index.section("creation_time")[row]
+
+    def iter_rows(self, code):
+        """
+        Yield the rows of the cookies with the given cookie name code
+        """
+        return self.index.find_rows("name", code)
+
+    def get_domains(self):
+        hosts = self.get_hosts()
+
+        # Every host in the index has a cookie of an indexed cookie name
+        if len(self.codes) == len(self.index.cookie_names):
+            return list(hosts)
+
+        host_section = self.index.section("host")
+        found = set()
+        for code in self.codes:
+            found.update(host_section[row] for row in self.iter_rows(code))
+
+        return [hosts[code] for code in sorted(found)]
+
+    def get_sorted_domains(self):
+        """
+        Return the sorted list of unique domains, sorting them only once
+        """
+        if self.sorted_domains is None:
+            # A host of None comes first, as NULL does in SQLite
+            self.sorted_domains = sorted(self.get_domains(),
+                                         key=lambda host: (host is not None, host))
+        return self.sorted_domains
+
+    def iter_domains(self, sorted=True, limit=None, offset=0):
+        # pylint: disable=redefined-builtin
+        if sorted:
+            return page_domains(self.get_sorted_domains(), limit, offset)
+        return page_domains(self.get_domains(), limit, offset)
+
+    def get_domain_count(self):
+        return len(self.get_domains())
+
+    def get_domain_rows(self, domain):
+        if self.host_codes is None:
+            self.host_codes = {host: code for code, host in enumerate(self.get_hosts())}
+
+        # No host matches None, as no host is equal to NULL in SQLite
+        host_code = self.host_codes.get(domain)
+        if host_code is None or domain is None:
+            return []
+
+        offsets = self.index.section("host_index.offsets")
+        rows = self.index.section("host_index.rows")[offsets[host_code]:offsets[host_code + 1]]
+
+        names = self.index.section("name")
+        values = self.index.strings("value")
+
+        structured_rows = [[self.index.cookie_names[names[row]], values[row]] for row in rows
+                           if names[row] in self.codes]
+
+        return structured_rows
+
+    def get_cookie_count(self):
+        return sum(self.index.cookie_counts[code] for code in self.codes)
+
+    def get_cookies(self, cookie_name):
+        if cookie_name not in self.index.cookie_names:
+            return parser_helpers.ga_generate_table([], cookie_name)
+
+        hosts = self.get_hosts()
+        host_section = self.index.section("host")
+        values = self.index.strings("value")
+
+        # Create a list of lists in the form:
+        # [[Cookie host, Creation time, Value], ...]
+        structured_rows = [[hosts[host_section[row]], self.get_creation_time(row), values[row]]
+                           for row in self.iter_rows(self.index.cookie_names.index(cookie_name))]
+
+        return parser_helpers.ga_generate_table(structured_rows, cookie_name)
+
+    def iter_cookies(self):
+        hosts = self.get_hosts()
+        names = self.index.section("name")
+        host_section = self.index.section("host")
+        values = self.index.strings("value")
+
+        for row in progress_helpers.report_rows(range(self.index.rows),
+                                                self.progress_callback):
+            if names[row] in self.codes:
+                yield (self.index.cookie_names[names[row]], hosts[host_section[row]],
+                       self.get_creation_time(row), values[row])
+
+    def iter_cookie_chunks(self, chunk_rows, position=None):
+        # Each position holds the number of index rows read
+        hosts = self.get_hosts()
+        names = self.index.section("name")
+        host_section = self.index.section("host")
+        values = self.index.strings("value")
+
+        start = 0 if position is None else position["row"]
+        if start and self.progress_callback is not None:
+            self.progress_callback(start)
+
+        for chunk_start in range(start, self.index.rows, chunk_rows):
+            chunk_end = min(chunk_start + chunk_rows, self.index.rows)
+
+            yield [(self.index.cookie_names[names[row]], hosts[host_section[row]],
+                    self.get_creation_time(row), values[row])
+                   for row in range(chunk_start, chunk_end) if names[row] in self.codes],\
+                  {"row": chunk_end}
+
+            if self.progress_callback is not None:
+                self.progress_callback(chunk_end - chunk_start)
+
+    def get_progress_total(self):
+        return self.index.rows, "rows"
+
+    def column(self, name):
+        """
+        Return one of the typed columns of the index, e.g. "visits" or
+        "time_first_visit", as a memoryview with one item per cookie
+        """
+        return self.index.section(name)
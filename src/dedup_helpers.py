@@ -0,0 +1,184 @@
+"""
+Provides detection of duplicate cookies across one or more cookie stores,
+such as overlapping backups of the same browser profile
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+import spill_helpers
+
+# Default size of the in-memory filter of seen cookies
+DEFAULT_FILTER_BYTES = 64 * 1024 * 1024
+
+# Number of bits set in the filter for each cookie
+FILTER_HASHES = 7
+
+# With a memory budget, the filter is at most this fraction of what is left
+# of it
+FILTER_BUDGET_FRACTION = 4
+
+# Version of the hashes in the database, kept as its user_version. Databases
+# of version 0 hashed the fields joined by "\0", and are hashed again
+HASH_VERSION = 1
+
+def cookie_hash(host, name, value):
+    """
+    Return a signed 64 bit hash of a cookie's host, name and value, any of
+    which may be None. The key is the repr of the three, so that None and
+    "" differ and no field can run into the next
+    """
+    key = repr((host, name, value)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little", signed=True)
+
+class CookieDeduplicator:
+    """
+    Detects cookies whose (host, name, value) has already been seen.
+
+    Every first-seen cookie is stored, with the source it was first seen in
+    and its number of duplicates, in an SQLite database on disk, indexed by
+    its 64 bit hash. A fixed-size Bloom filter of the hashes is kept in
+    memory, so most new cookies are recognised without a database lookup
+    and memory use does not grow with the number of cookies. Cookies whose
+    hash may have been seen are compared exactly with the stored cookies,
+    so hash collisions never cause a cookie to be dropped.
+
+    If path is given the database is kept there, so that cookies seen by an
+    earlier run are also treated as duplicates. If a budget is given, the
+    filter and SQLite's page cache are made small enough to fit in it.
+    """
+    def __init__(self, path=None, filter_bytes=DEFAULT_FILTER_BYTES, budget=None):
+        self.temp_path = None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(handle)
+            self.temp_path = path
+
+        self.path = path
+
+        # The database may be used from the thread which reads the cookies
+        # rather than the one which created it, but never by both at once
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        spill_helpers.limit_sqlite_memory(self.conn, budget)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cookies (hash INTEGER, host TEXT, \
+name TEXT, value TEXT, source TEXT, duplicates INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cookies_hash ON cookies (hash)")
+
+        # Cookies stored by a previous version are hashed the current way
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < HASH_VERSION:
+            rehashed = [(cookie_hash(host, name, value), rowid) for rowid, host, name, value
+                        in self.conn.execute("SELECT rowid, host, name, value FROM cookies")]
+            self.conn.executemany("UPDATE cookies SET hash = ? WHERE rowid = ?", rehashed)
+            self.conn.execute("PRAGMA user_version = {}".format(HASH_VERSION))
+            self.conn.commit()
+
+        # Holds the checkpoint of an export, see commit
+        self.conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY, \
+manifest TEXT)")
+
+        # A smaller filter only means more cookies are looked up
+        self.budget = budget
+        if budget is not None:
+            filter_bytes = max(min(filter_bytes, budget.available() // FILTER_BUDGET_FRACTION), 1)
+            budget.reserve(filter_bytes)
+
+        self.filter_bits = filter_bytes * 8
+        self.filter = bytearray(filter_bytes)
+
+        # Cookies stored by a previous run need to be in the filter too
+        for (stored_hash,) in self.conn.execute("SELECT hash FROM cookies"):
+            self.add_to_filter(stored_hash)
+
+        self.duplicate_count = 0
+
+    def filter_positions(self, hash_value):
+        """
+        Return the filter bit positions of a hash, by double hashing its
+        two 32 bit halves
+        """
+        low = hash_value & 0xFFFFFFFF
+        high = (hash_value >> 32) & 0xFFFFFFFF
+        return [(low + i * high) % self.filter_bits for i in range(FILTER_HASHES)]
+
+    def add_to_filter(self, hash_value):
+        """
+        Set the filter bits of a hash
+        """
+        for position in self.filter_positions(hash_value):
+            self.filter[position >> 3] |= 1 << (position & 7)
+
+    def in_filter(self, hash_value):
+        """
+        Return whether the hash may have been added to the filter
+        """
+        return all(self.filter[position >> 3] & (1 << (position & 7))
+                   for position in self.filter_positions(hash_value))
+
+    def is_duplicate(self, host, name, value, source=None):
+        """
+        Return True if the cookie has been seen before, counting it as a
+        duplicate, or otherwise record it as first seen in source and
+        return False
+        """
+        hash_value = cookie_hash(host, name, value)
+
+        if self.in_filter(hash_value):
+            # IS rather than =, so that NULL fields match too
+            matches = self.conn.execute("SELECT rowid FROM cookies WHERE hash = ? AND host IS ? \
+AND name IS ? AND value IS ?", (hash_value, host, name, value)).fetchone()
+            if matches is not None:
+                self.conn.execute("UPDATE cookies SET duplicates = duplicates + 1 WHERE rowid = ?",
+                                  matches)
+                self.duplicate_count += 1
+                return True
+
+        self.conn.execute("INSERT INTO cookies VALUES (?, ?, ?, ?, ?, 0)",
+                          (hash_value, host, name, value, source))
+        self.add_to_filter(hash_value)
+        return False
+
+    def commit(self, checkpoint=None):
+        """
+        Save the cookies seen so far to the database, along with the text of
+        a checkpoint if given, so that the two are always saved together
+        """
+        if checkpoint is not None:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoint VALUES (1, ?)", (checkpoint,))
+        self.conn.commit()
+
+    def get_checkpoint(self):
+        """
+        Return the text of the last checkpoint saved by commit, or None
+        """
+        row = self.conn.execute("SELECT manifest FROM checkpoint WHERE id = 1").fetchone()
+        return None if row is None else row[0]
+
+    def rollback(self):
+        """
+        Forget the cookies seen since the last commit, so that they are new
+        again to whichever run sees them next
+        """
+        self.conn.rollback()
+
+    def iter_duplicated(self):
+        """
+        Yield (host, name, value, first source, duplicates) for every cookie
+        which was seen more than once
+        """
+        return self.conn.execute("SELECT host, name, value, source, duplicates FROM cookies \
+WHERE duplicates > 0 ORDER BY rowid")
+
+    def close(self):
+        """
+        Close the database, deleting it if it was temporary. Cookies seen
+        since the last commit are forgotten, so that an export which failed
+        before commit was called doesn't leave them out of the next one
+        """
+        self.conn.rollback()
+        self.conn.close()
+        if self.budget is not None:
+            self.budget.release(len(self.filter))
+        if self.temp_path is not None:
+            os.remove(self.temp_path)
@@ -0,0 +1,509 @@
+"""
+Provides the export of parsed GA cookies to .csv files, shared by the CLI
+and the GUI
+"""
+
+import csv
+import io
+import json
+import locale
+import os
+import queue
+import threading
+import uuid
+
+import compression_helpers
+import cookie_parser
+import general_helpers
+import parser_helpers
+
+# Number of cookies passed to a writer thread at once
+BATCH_ROWS = 1000
+
+# Number of batches which may wait for each writer thread before the reader
+# blocks, which bounds the memory used when writing is the slower stage
+QUEUE_BATCHES = 16
+
+# Buffer size of each output file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Number of rows of the cookie file read between the checkpoints of a
+# resumable export
+CHECKPOINT_ROWS = 100000
+
+# Version of the checkpoint manifest, which must match to continue an export.
+# Version 2 records the fetcher's browser rather than its class name
+MANIFEST_VERSION = 2
+
+def get_export_filenames(compression=None):
+    """
+    Return a dict of {cookie name: output file name} for the given output
+    compression
+    """
+    suffix = compression_helpers.OUTPUT_SUFFIXES[compression]
+    return {cookie: filename + suffix
+            for cookie, filename in general_helpers.COOKIE_FILENAMES.items()}
+
+def find_conflicts(output_dir, compression=None, deduplicate=False):
+    """
+    Return a list of the output file names which already exist in output_dir
+    """
+    filenames = list(get_export_filenames(compression).values())
+    if deduplicate:
+        filenames.append(general_helpers.DUPLICATES_FILENAME)
+
+    return [filename for filename in filenames
+            if os.path.exists(os.path.join(output_dir, filename))]
+
+class Checkpoint:
+    """
+    Passed to every writer thread, after the batches read before it, to have
+    them make everything written so far durable and report the size of
+    their temporary file
+    """
+    def __init__(self):
+        # (cookie name, file size), with a size of None from a writer which
+        # has failed
+        self.offsets = queue.Queue()
+
+class CookieFileWriter(threading.Thread):
+    """
+    Thread which formats batches of one cookie type's cookies into table rows
+    and writes them to a temporary file, which replaces the output file once
+    every batch has been written
+    """
+    def __init__(self, cookie_name, path, compression=None, resume_offset=None,
+                 keep_partial=False):
+        # pylint: disable=too-many-arguments
+        super().__init__(daemon=True)
+
+        self.cookie_name = cookie_name
+        self.path = path
+        self.compression = compression
+
+        # If given, the temporary file is continued from this size, which it
+        # had at a checkpoint, rather than started again
+        self.resume_offset = resume_offset
+
+        # Whether the temporary file is kept if the export fails, so that it
+        # can be continued
+        self.keep_partial = keep_partial
+
+        self.encoding = locale.getpreferredencoding(False)
+
+        # Batches of [(cookie host, creation time, value), ...] and
+        # Checkpoints, ended by None
+        self.batches = queue.Queue(maxsize=QUEUE_BATCHES)
+
+        # Set by the reader to say whether every cookie was read, so whether
+        # the output file should be kept
+        self.completed = False
+
+        # Whether the final None batch has been taken from the queue
+        self.received_all = False
+
+        self.error = None
+
+    def run(self):
+        temp_path = None
+
+        try:
+            # Written next to the output file so that it can be renamed over it
+            temp_path = self.path + ".tmp"
+
+            if self.resume_offset is None:
+                raw_file = open(temp_path, "wb", buffering=WRITE_BUFFER_SIZE)
+            else:
+                # Anything written after the checkpoint is written again
+                raw_file = open(temp_path, "r+b", buffering=WRITE_BUFFER_SIZE)
+                raw_file.truncate(self.resume_offset)
+                raw_file.seek(self.resume_offset)
+
+            with raw_file:
+                self.write(raw_file)
+
+            if self.completed:
+                os.replace(temp_path, self.path)
+        except PermissionError as error:
+            # Report the output file rather than the temporary one
+            self.error = PermissionError(error.errno, error.strerror, self.path)
+        except Exception as error: # pylint: disable=broad-except
+            self.error = error
+
+        # Keep taking batches so the reader isn't left blocked
+        while not self.received_all:
+            batch = self.batches.get()
+            if isinstance(batch, Checkpoint):
+                batch.offsets.put((self.cookie_name, None))
+            self.received_all = batch is None
+
+        if temp_path is not None and os.path.exists(temp_path) and not self.keep_partial:
+            os.remove(temp_path)
+
+    def format_rows(self, rows):
+        """
+        Return table rows formatted as .csv lines, encoded like a file
+        opened in text mode
+        """
+        text = io.StringIO()
+        writer = csv.writer(text,
+                            delimiter=',',
+                            quotechar='"',
+                            quoting=csv.QUOTE_MINIMAL)
+        writer.writerows(rows)
+
+        return text.getvalue().encode(self.encoding)
+
+    def write(self, raw_file):
+        """
+        Write the header row, unless continuing from a checkpoint, and then
+        every batch until None is received
+        """
+        # Each checkpoint ends the compressed stream, and a new one is
+        # started for the next batch, since compressed streams such as gzip
+        # members and zstd frames can be concatenated
+        compressed = None
+
+        if self.resume_offset is None:
+            compressed = compression_helpers.open_compressed_writer(raw_file, self.compression)
+            compressed.write(self.format_rows([parser_helpers.ga_table_headers(self.cookie_name)]))
+
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                self.received_all = True
+                break
+
+            if isinstance(batch, Checkpoint):
+                self.checkpoint(raw_file, compressed, batch)
+                compressed = None
+                continue
+
+            if compressed is None:
+                compressed = compression_helpers.open_compressed_writer(raw_file,
+                                                                        self.compression)
+            compressed.write(self.format_rows(parser_helpers.ga_table_rows(batch,
+                                                                           self.cookie_name)))
+
+        if compressed is not None and compressed is not raw_file:
+            compressed.close()
+
+    def checkpoint(self, raw_file, compressed, checkpoint):
+        """
+        End the compressed stream, if one is open, and make the file durable
+        up to its current size, which is reported to the checkpoint
+        """
+        offset = None
+        try:
+            if compressed is not None and compressed is not raw_file:
+                compressed.close()
+
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+            offset = raw_file.tell()
+        finally:
+            checkpoint.offsets.put((self.cookie_name, offset))
+
+def get_source_signature(source):
+    """
+    Return [size, modification time] of the file at source, which changes
+    whenever the file is changed, or None if there is no such file
+    """
+    try:
+        stat = os.stat(source)
+    except (OSError, TypeError, ValueError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def read_checkpoint(output_dir, deduplicator=None):
+    """
+    Return the manifest of the last checkpoint of an interrupted export to
+    output_dir, or None if there isn't one. The deduplicator's database
+    holds a copy of each manifest, committed with the cookies it has seen,
+    which is used if it is newer than the manifest file
+    """
+    try:
+        with open(os.path.join(output_dir, general_helpers.EXPORT_MANIFEST_FILENAME)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        raise cookie_parser.ResumeError("The export checkpoint in {} can't be read".format(
+            output_dir))
+
+    if deduplicator is not None:
+        stored = deduplicator.get_checkpoint()
+        if stored is not None:
+            stored = json.loads(stored)
+            if stored.get("id") == manifest.get("id")\
+               and stored["sequence"] > manifest["sequence"]:
+                manifest = stored
+
+    return manifest
+
+def save_checkpoint(output_dir, manifest, deduplicator=None):
+    """
+    Save the manifest of a checkpoint to output_dir, replacing the last one
+    in a single step, after saving the cookies the deduplicator has seen
+    """
+    manifest["sequence"] += 1
+    text = json.dumps(manifest)
+
+    if deduplicator is not None:
+        deduplicator.commit(checkpoint=text)
+
+    path = os.path.join(output_dir, general_helpers.EXPORT_MANIFEST_FILENAME)
+    with open(path + ".tmp", "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+def is_renamed(path, offset):
+    """
+    Return whether the partly written file of an output file at path has
+    already been renamed to it, which is the case if it is missing and the
+    output file has the size it had at the checkpoint
+    """
+    return not os.path.exists(path + ".tmp") and os.path.exists(path)\
+        and os.path.getsize(path) == offset
+
+def can_resume(output_dir, compression=None):
+    """
+    Return whether an interrupted export to output_dir left a checkpoint,
+    and the partly written files it refers to, so that it can be continued
+    """
+    try:
+        manifest = read_checkpoint(output_dir)
+    except cookie_parser.ResumeError:
+        return False
+    if manifest is None:
+        return False
+
+    filenames = get_export_filenames(compression)
+    for cookie, offset in manifest["files"].items():
+        path = os.path.join(output_dir, filenames[cookie])
+        if not os.path.exists(path + ".tmp") and not is_renamed(path, offset):
+            return False
+    return True
+
+def check_checkpoint(manifest, fetcher, output_dir, compression, deduplicator, source):
+    # pylint: disable=too-many-arguments
+    """
+    Raise cookie_parser.ResumeError if the export described by the
+    checkpoint manifest can't be continued with the given arguments, and
+    otherwise move back any output file which was renamed before the export
+    failed
+    """
+    if manifest is None:
+        raise cookie_parser.ResumeError("No checkpoint of an interrupted export was found in "
+                                        "{}".format(output_dir))
+
+    if manifest.get("version") != MANIFEST_VERSION\
+       or manifest.get("browser") != fetcher.browser\
+       or manifest["source"] != source:
+        raise cookie_parser.ResumeError("The checkpoint in {} is of an export of a different "
+                                        "cookie file".format(output_dir))
+
+    if manifest["source_signature"] != get_source_signature(source):
+        raise cookie_parser.ResumeError("{} has changed since the export was "
+                                        "interrupted".format(source))
+
+    if manifest["compression"] != compression\
+       or manifest["deduplicate"] != (deduplicator is not None):
+        raise cookie_parser.ResumeError("The interrupted export must be continued with the "
+                                        "same compression and deduplication options")
+
+    filenames = get_export_filenames(compression)
+    for cookie, offset in manifest["files"].items():
+        path = os.path.join(output_dir, filenames[cookie])
+
+        # A writer which finished before another failed has already renamed
+        # its file, which is continued as if it hadn't
+        if is_renamed(path, offset):
+            os.replace(path, path + ".tmp")
+
+        temp_path = path + ".tmp"
+        if not os.path.exists(temp_path) or os.path.getsize(temp_path) < offset:
+            raise cookie_parser.ResumeError("The partly written {} is missing or "
+                                            "incomplete".format(temp_path))
+
+def export_csv(fetcher, output_dir, compression=None, deduplicator=None, source=None,
+               checkpoint_rows=None, resume=False):
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    """
+    Export every GA cookie found by the fetcher to one .csv file per cookie
+    type in output_dir.
+
+    The cookies are read in a single pass and handed in batches to one
+    writer thread per cookie type, so reading, parsing and writing overlap.
+    Files are only replaced once they have been completely written. Raises
+    PermissionError, with the output file as its filename, if a file could
+    not be written.
+
+    If a dedup_helpers.CookieDeduplicator is given, cookies it has already
+    seen are left out, new ones are recorded as first seen in source, and
+    the duplicated cookies are listed in DUPLICATES_FILENAME.
+
+    If checkpoint_rows is given, a checkpoint is saved to
+    EXPORT_MANIFEST_FILENAME in output_dir after every checkpoint_rows rows
+    of the cookie file, where source is the file's path, and the partly
+    written files are kept if the export fails. If resume is set, an
+    interrupted export is continued from its last checkpoint instead, giving
+    exactly the same files as if it had not been interrupted. Raises
+    cookie_parser.ResumeError if it can't be continued
+    """
+    filenames = get_export_filenames(compression)
+
+    # Fail before starting any threads if the compression is unavailable
+    if compression == "zstd":
+        compression_helpers.import_zstandard()
+
+    manifest = None
+    if resume:
+        manifest = read_checkpoint(output_dir, deduplicator)
+        check_checkpoint(manifest, fetcher, output_dir, compression, deduplicator, source)
+
+        if deduplicator is not None:
+            deduplicator.duplicate_count = manifest["duplicates"]
+    elif checkpoint_rows is not None:
+        manifest = {"version": MANIFEST_VERSION,
+                    "id": uuid.uuid4().hex,
+                    "sequence": 0,
+                    "browser": fetcher.browser,
+                    "source": source,
+                    "source_signature": get_source_signature(source),
+                    "compression": compression,
+                    "deduplicate": deduplicator is not None,
+                    "checkpoint_rows": checkpoint_rows,
+                    "position": None,
+                    "files": {},
+                    "duplicates": 0}
+        save_checkpoint(output_dir, manifest, deduplicator)
+
+    offsets = {} if manifest is None else manifest["files"]
+    writers = {cookie: CookieFileWriter(cookie, os.path.join(output_dir, filename), compression,
+                                        offsets.get(cookie), keep_partial=manifest is not None)
+               for cookie, filename in filenames.items()}
+
+    for writer in writers.values():
+        writer.start()
+
+    try:
+        finish_export(fetcher, writers, output_dir, deduplicator, source, manifest)
+    except BaseException:
+        # Cookies seen since the last checkpoint, or every cookie without
+        # checkpoints, may not have been written, so whichever run comes
+        # next must see them as new
+        if deduplicator is not None:
+            deduplicator.rollback()
+        raise
+
+def finish_export(fetcher, writers, output_dir, deduplicator, source, manifest):
+    # pylint: disable=too-many-arguments,too-many-branches
+    """
+    Read every cookie into the started writers of export_csv, wait for them
+    to finish, and then save the cookies the deduplicator has seen and
+    remove the checkpoint, raising the first writer error if any failed
+    """
+    completed = False
+    try:
+        batches = {cookie: [] for cookie in writers}
+
+        # Without checkpoints every cookie is read as a single chunk
+        if manifest is None:
+            chunks = [(fetcher.iter_cookies(), None)]
+        else:
+            chunks = fetcher.iter_cookie_chunks(manifest["checkpoint_rows"],
+                                                manifest["position"])
+
+        for cookies, position in chunks:
+            for name, host, creation_time, value in cookies:
+                batch = batches.get(name)
+                if batch is None:
+                    continue
+
+                if deduplicator is not None and deduplicator.is_duplicate(host, name, value,
+                                                                          source):
+                    continue
+
+                batch.append((host, creation_time, value))
+                if len(batch) >= BATCH_ROWS:
+                    writers[name].batches.put(batch)
+                    batches[name] = []
+
+            if position is not None and not checkpoint(writers, batches, output_dir,
+                                                       manifest, position, deduplicator):
+                break
+        else:
+            for cookie, batch in batches.items():
+                if batch:
+                    writers[cookie].batches.put(batch)
+
+            completed = True
+    finally:
+        for writer in writers.values():
+            writer.completed = completed
+            writer.batches.put(None)
+
+        for writer in writers.values():
+            writer.join()
+
+    for writer in writers.values():
+        if writer.error is not None:
+            raise writer.error
+
+    if deduplicator is not None:
+        write_duplicates(deduplicator, output_dir)
+        deduplicator.commit()
+
+    if manifest is not None:
+        os.remove(os.path.join(output_dir, general_helpers.EXPORT_MANIFEST_FILENAME))
+
+def checkpoint(writers, batches, output_dir, manifest, position, deduplicator=None):
+    # pylint: disable=too-many-arguments
+    """
+    Hand every waiting batch to its writer and save a checkpoint at
+    position once they have all been written, returning False instead if
+    a writer has failed
+    """
+    marker = Checkpoint()
+    for cookie, writer in writers.items():
+        if batches[cookie]:
+            writer.batches.put(batches[cookie])
+            batches[cookie] = []
+        writer.batches.put(marker)
+
+    offsets = dict(marker.offsets.get() for _ in writers)
+    if None in offsets.values():
+        return False
+
+    manifest["position"] = position
+    manifest["files"] = offsets
+    if deduplicator is not None:
+        manifest["duplicates"] = deduplicator.duplicate_count
+
+    save_checkpoint(output_dir, manifest, deduplicator)
+    return True
+
+def write_duplicates(deduplicator, output_dir):
+    """
+    Write every cookie the deduplicator has seen more than once, with the
+    source it was first seen in, to DUPLICATES_FILENAME in output_dir
+    """
+    path = os.path.join(output_dir, general_helpers.DUPLICATES_FILENAME)
+
+    try:
+        with open(path + ".tmp", "w", newline="\n", buffering=WRITE_BUFFER_SIZE) as csvfile:
+            writer = csv.writer(csvfile,
+                                delimiter=',',
+                                quotechar='"',
+                                quoting=csv.QUOTE_MINIMAL)
+
+            writer.writerow(["Cookie host", "Cookie name", "Cookie value",
+                             "First seen in", "Duplicates"])
+            writer.writerows(deduplicator.iter_duplicated())
+
+        os.replace(path + ".tmp", path)
+    except PermissionError as error:
+        raise PermissionError(error.errno, error.strerror, path)
@@ -30,20 +30,38 @@ COOKIE_FILENAMES = {"_ga": "cookie_ga.csv",
                     "__utmb": "cookie__utmb.csv",
                     "__utmz": "cookie__utmz.csv"}
 
-def format_string_default(string, dictionary, default="<not found>"):
+# Lists cookies which were found more than once when exporting with
+# deduplication
+DUPLICATES_FILENAME = "cookie_duplicates.csv"
+
+# Records the last checkpoint of a resumable export, until it has finished
+EXPORT_MANIFEST_FILENAME = "cookie_export_checkpoint.json"
+
+# Cookies seen by a resumable export with deduplication but no dedup store,
+# until it has finished
+DEDUP_WORK_FILENAME = "cookie_export_dedup.sqlite"
+
+# Value used for any {format} key which wasn't found
+DEFAULT_VALUE = "<not found>"
+
+class Default(dict):
+    """
+    Class inheriting from dict, whose purpose is to provide
+    the default string rather than raising when a key
+    is not found
+    """
+    def __init__(self, dictionary, default=DEFAULT_VALUE):
+        super().__init__(dictionary)
+        self.default = default
+
+    def __missing__(self, key):
+        return self.default
+
+def format_string_default(string, dictionary, default=DEFAULT_VALUE):
     """
     Format a string with keys in the dictionary, using default value
     default if any {format} key in the string is not found in the dict
     """
-    class Default(dict):
-        """
-        Class inheriting from dict, whose purpose is to provide
-        the <not-found> string rather than raising when a key
-        is not found
-        """
-        def __missing__(self, key):
-            return default
-
     # Create our dict with the format placeholder names as keys
-    info_dict = Default(dictionary)
+    info_dict = Default(dictionary, default)
     return string.format_map(info_dict)
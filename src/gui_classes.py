@@ -5,20 +5,21 @@ Contains any wx GUI classe
 import os
 import sys
 
-import traceback
-from datetime import datetime
-
-import csv
-
 import wx
 
-import cookie_parser
+# The cookie fetchers, exports and error logging are only imported when they
+# are first used, so that they don't delay the window being shown:
+# cache_helpers in on_process, export_helpers in on_export_csv and traceback
+# and datetime in exception_hook
 import general_helpers
 
 # Stores the file filters of each browser and version, used when selecting a file
 BROWSER_FILETYPES = {
-    "firefox.3+": "SQLite3 files (*.sqlite)|*.sqlite",
-    "csv": "CSV (comma separated values) files (*.csv)|*.csv"
+    "firefox.3+": "SQLite3 files (*.sqlite)|*.sqlite|\
+Compressed SQLite3 files (*.gz, *.xz, *.zst, *.zip)|*.gz;*.xz;*.zst;*.zip",
+    "csv": "CSV (comma separated values) files (*.csv)|*.csv|\
+Compressed CSV files (*.gz, *.xz, *.zst, *.zip)|*.gz;*.xz;*.zst;*.zip",
+    "index": "GA cookie index files (*.gacpidx)|*.gacpidx"
 }
 
 # The instructions for each browser and version
@@ -31,14 +32,17 @@ with headers which contain the following phrases:\n\
 Cookie Name: 'name'\n\
 Cookie Value: 'value'\n\
 Host: 'host', 'site' or 'domain'\n\
-Creation Time: 'create_time', 'creation time' or 'create time'"
+Creation Time: 'create_time', 'creation time' or 'create time'",
+    "index": "Select an index file written by the command line tool's index \
+command, e.g. gacp_cli -i cookies.sqlite -b firefox.3+ index -o cookies.gacpidx"
 }
 
 # Convert the names in the browser selection dropdown to 'short names', which
 # are independent of how the browser name and version are displayed
 BROWSER_SHORTNAMES = {
     "Firefox v3+": "firefox.3+",
-    "CSV file": "csv"
+    "CSV file": "csv",
+    "GA cookie index": "index"
 }
 
 # WX styles for a display textarea
@@ -47,10 +51,18 @@ TEXTCTRL_DISPLAY_STYLES = wx.ALIGN_LEFT | wx.TE_READONLY | wx.TE_MULTILINE | wx.
 # The width of the column of setting labels
 LABEL_COLUMN_WIDTH = 150
 
+# Number of domains added to the domain dropdown at a time, and the option
+# at the end of the dropdown which adds the next page of them
+DOMAIN_PAGE_SIZE = 500
+LOAD_MORE_DOMAINS = "(Show more domains...)"
+
 def exception_hook(etype, value, trace):
     """
     Handles all raised exceptions
     """
+    # pylint: disable=import-outside-toplevel
+    import traceback
+    from datetime import datetime
 
     tmp = traceback.format_exception(etype, value, trace)
     exception = "".join(tmp)
@@ -84,6 +96,9 @@ class MainWindow(wx.Frame):
 
         self.parser = None
 
+        # Number of domains added to the domain dropdown so far
+        self.loaded_domains = 0
+
         self.create_widgets(parent, title)
     def create_widgets(self, parent, title):
         """
@@ -123,7 +138,8 @@ class MainWindow(wx.Frame):
         # Browser/version dropdown
         self.setting_browser_choice = wx.Choice(self.settings_frame,
                                                 choices=["Firefox v3+",
-                                                         "CSV file"])
+                                                         "CSV file",
+                                                         "GA cookie index"])
         self.setting_browser_choice.SetSelection(0)
         self.setting_browser_choice.Bind(wx.EVT_CHOICE, self.on_select_browser)
         settings_sizer.Add(self.setting_browser_choice, wx.GBPosition(0, 1), **setting_sizer_args)
@@ -311,11 +327,37 @@ class MainWindow(wx.Frame):
         self.update_browser()
         event.Skip()
 
+    def load_domain_page(self):
+        """
+        Add the next page of sorted domains to the domain dropdown, followed
+        by the option to load more if there may be any more
+        """
+        domains = list(self.parser.iter_domains(limit=DOMAIN_PAGE_SIZE,
+                                                offset=self.loaded_domains))
+        self.loaded_domains += len(domains)
+
+        # Remove the previous option to load more
+        last = self.setting_view_domain.GetCount() - 1
+        if last >= 0 and self.setting_view_domain.GetString(last) == LOAD_MORE_DOMAINS:
+            self.setting_view_domain.Delete(last)
+
+        for domain in domains:
+            self.setting_view_domain.Append(domain)
+
+        if len(domains) == DOMAIN_PAGE_SIZE:
+            self.setting_view_domain.Append(LOAD_MORE_DOMAINS)
+
     def on_select_domain(self, event):
         """
         When a domain is selected from the dropdown we should fetch
         its cookie info and update the domain info display
         """
+        if self.setting_view_domain.GetValue() == LOAD_MORE_DOMAINS:
+            self.load_domain_page()
+            self.setting_view_domain.SetValue("")
+            event.Skip()
+            return
+
         self.update_domain_info()
         event.Skip()
 
@@ -323,6 +365,8 @@ class MainWindow(wx.Frame):
         """
         When Export to CSV is clicked
         """
+        import export_helpers # pylint: disable=import-outside-toplevel
+
         with wx.DirDialog(self,
                           "Set .csv output folder",
                           style=wx.DD_DEFAULT_STYLE) as folder_dialog:
@@ -332,12 +376,8 @@ class MainWindow(wx.Frame):
 
             pathname = folder_dialog.GetPath()
 
-        conflicts = [] # Planned export filenames which already exist in the target folder
-
-        for filename in general_helpers.COOKIE_FILENAMES.values():
-            # If we find a conflict...
-            if os.path.exists(os.path.join(pathname, filename)):
-                conflicts.append(filename) # Add it to the list
+        # Planned export filenames which already exist in the target folder
+        conflicts = export_helpers.find_conflicts(pathname)
 
         if conflicts: # If there was a conflict
             # Prepare a dialog window
@@ -348,28 +388,16 @@ class MainWindow(wx.Frame):
             if popup.ShowModal() != wx.ID_YES: # User did not want to continue
                 return
 
-
-        for cookie in general_helpers.COOKIE_FILENAMES:
-            try:
-                with open(os.path.join(pathname,
-                                       general_helpers.COOKIE_FILENAMES[cookie]),
-                          "w",
-                          newline="\n") as csvfile:
-
-                    writer = csv.writer(csvfile,
-                                        delimiter=',',
-                                        quotechar='"',
-                                        quoting=csv.QUOTE_MINIMAL)
-
-                    writer.writerows(self.parser.get_cookies(cookie))
-            except PermissionError: # Unable to write to cookie file
-                self.show_message("Could not export cookies",
-                                  "Could not export cookies because access\
+        try:
+            export_helpers.export_csv(self.parser, pathname)
+        except PermissionError as error: # Unable to write to cookie file
+            self.show_message("Could not export cookies",
+                              "Could not export cookies because access\
 was denied to {}.\n(You probably have it open in another program)\
-".format(general_helpers.COOKIE_FILENAMES[cookie]),
-                                  wx.ICON_ERROR)
+".format(os.path.basename(error.filename)),
+                              wx.ICON_ERROR)
 
-                return
+            return
 
         self.show_message("Cookies exported", "Successfully exported cookies", wx.ICON_INFORMATION)
 
@@ -377,31 +405,39 @@ was denied to {}.\n(You probably have it open in another program)\
         """
         When the process button is clicked
         """
+        # pylint: disable=import-outside-toplevel
+        import cache_helpers
+        import compression_helpers
+
         cookies = ["_ga", "__utma", "__utmb", "__utmz"]
-        self.parser = cookie_parser.get_cookie_fetcher(self.get_browser_name(),
+        # Processing the same unchanged file again doesn't read it again
+        self.parser = cache_helpers.get_cached_fetcher(self.get_browser_name(),
                                                        self.setting_file_input.Value,
                                                        cookies)
 
         if self.parser.error is not None:
             self.show_message("Error opening file", str(self.parser.error), wx.ICON_ERROR)
             return
-        # Get all domains
-        domains = self.parser.get_domains()
-        domains.sort()
-
         # Clear the domain dropdown
         self.setting_view_domain.Clear()
+        self.loaded_domains = 0
 
-        # Then add each domain option to the dropdown
-        for domain in domains:
-            self.setting_view_domain.Append(domain)
+        try:
+            # Then add the first page of domains to the dropdown, the rest
+            # are only loaded when asked for
+            self.load_domain_page()
 
-        # Enable the output section of the UI
-        self.output_frame.Enable(True)
+            message_template = "Found {} GA cookies over {} domains"
 
-        message_template = "Found {} GA cookies over {} domains"
+            message = message_template.format(self.parser.get_cookie_count(),
+                                              self.parser.get_domain_count())
+        except compression_helpers.CompressionError as error:
+            # The file was damaged after the part read when it was opened
+            self.show_message("Error reading file", str(error), wx.ICON_ERROR)
+            return
 
-        message = message_template.format(self.parser.get_cookie_count(), len(domains))
+        # Enable the output section of the UI
+        self.output_frame.Enable(True)
 
         self.status_bar.SetStatusText(message)
         self.show_message("Successfully opened cookies database", message, wx.ICON_INFORMATION)
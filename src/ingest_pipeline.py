@@ -0,0 +1,301 @@
+"""
+Provides an asyncio pipeline for continually ingesting cookie stores which
+are delivered to a spool directory, parsing them and appending the parsed GA
+cookies to one set of .csv files
+"""
+
+import asyncio
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cookie_parser
+import general_helpers
+
+# The browser short name used to parse a spooled file, by file extension
+SPOOL_BROWSERS = {".sqlite": "firefox.3+",
+                  ".csv": "csv"}
+
+# Subdirectories of the spool directory which files are moved into once
+# their cookies have been written, or once they have failed to parse, so
+# that a restarted pipeline doesn't ingest them again
+DONE_DIR = "done"
+ERROR_DIR = "error"
+
+class SpoolIngester:
+    """
+    Watches a spool directory and ingests every cookie store delivered to it.
+
+    The pipeline has three stages joined by bounded queues, so a burst of
+    arriving files only ever holds queue_size files and parsed results in
+    memory at once:
+        producer: polls the spool directory for new, fully written files
+        workers: parse each file with a CookieFetcher in a thread executor
+        consumer: appends the parsed tables to the output .csv files in batches
+
+    Once a batch has been written, its files are moved into the DONE_DIR
+    subdirectory of the spool directory, and files which couldn't be parsed
+    are moved into ERROR_DIR, so the spool only holds files still to be
+    ingested. A file delivered again under the same name is a new file.
+    """
+    def __init__(self, spool_dir, output_dir, cookie_names, workers=4,
+                 queue_size=8, batch_rows=10000, poll_interval=1.0, deduplicator=None):
+        # pylint: disable=too-many-arguments
+        self.spool_dir = spool_dir
+        self.output_dir = output_dir
+        self.cookie_names = cookie_names
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_rows = batch_rows
+        self.poll_interval = poll_interval
+
+        # If given, a dedup_helpers.CookieDeduplicator which leaves out
+        # cookies already ingested from another file
+        self.deduplicator = deduplicator
+
+        # Paths which have been queued and are still in the spool directory,
+        # so they are not picked up twice. Paths are forgotten once their
+        # files are removed, so this only grows with the directory
+        self.seen = set()
+
+        # Files which were successfully ingested, and [(path, error), ...]
+        # for those which were not
+        self.ingested = []
+        self.errors = []
+
+        # The (size, modification time) of each pending file at the previous
+        # poll, used to tell whether a collector is still writing to it
+        self._pending = {}
+
+    def find_ready_files(self, wait_for_stable=True):
+        """
+        Return a sorted list of spooled files which have not yet been queued
+        and whose size has stopped changing since the previous poll
+        """
+        ready = []
+        current = {}
+        present = set()
+
+        for entry in os.scandir(self.spool_dir):
+            extension = os.path.splitext(entry.name)[1].lower()
+            if not entry.is_file() or extension not in SPOOL_BROWSERS:
+                continue
+
+            present.add(entry.path)
+            if entry.path in self.seen:
+                continue
+
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+
+            if not wait_for_stable or self._pending.get(entry.path) == signature:
+                ready.append(entry.path)
+            else:
+                current[entry.path] = signature
+
+        self._pending = current
+
+        # A file delivered again under the same name after being removed is
+        # a new file
+        self.seen &= present
+        return sorted(ready)
+
+    def move_file(self, path, subdirectory):
+        """
+        Move a spooled file into a subdirectory of the spool directory,
+        numbering its name if a file of that name was moved there before,
+        and return its new path
+        """
+        directory = os.path.join(self.spool_dir, subdirectory)
+        os.makedirs(directory, exist_ok=True)
+
+        name, extension = os.path.splitext(os.path.basename(path))
+        destination = os.path.join(directory, name + extension)
+        number = 0
+        while os.path.exists(destination):
+            number += 1
+            destination = os.path.join(directory, "{}.{}{}".format(name, number, extension))
+
+        os.replace(path, destination)
+        return destination
+
+    def parse_file(self, path):
+        """
+        Parse one spooled file, returning a dict of {cookie name: table} in
+        the format of parser_helpers.ga_generate_table, or raising ValueError
+        if the file could not be opened
+        """
+        browser = SPOOL_BROWSERS[os.path.splitext(path)[1].lower()]
+
+        fetcher = cookie_parser.get_cookie_fetcher(browser, path, self.cookie_names)
+        if fetcher.error is not None:
+            raise ValueError(fetcher.error)
+
+        return {cookie: fetcher.get_cookies(cookie) for cookie in self.cookie_names}
+
+    def filter_tables(self, tables, source):
+        """
+        Return {cookie name: [row, ...]} of the rows of the parsed tables,
+        without their header rows, which the deduplicator hasn't seen before
+        """
+        return {cookie: [row for row in table[1:]
+                         if self.deduplicator is None
+                         or not self.deduplicator.is_duplicate(row[0], cookie, row[1], source)]
+                for cookie, table in tables.items()}
+
+    def write_batch(self, batch):
+        """
+        Append a batch of {cookie name: [row, ...]} to the output files,
+        writing the header row first to any file which does not exist yet
+        """
+        for cookie, rows in batch.items():
+            if len(rows) <= 1: # Only the header row
+                continue
+
+            path = os.path.join(self.output_dir, general_helpers.COOKIE_FILENAMES[cookie])
+            write_header = not os.path.exists(path)
+
+            with open(path, "a", newline="\n") as csvfile:
+                writer = csv.writer(csvfile,
+                                    delimiter=',',
+                                    quotechar='"',
+                                    quoting=csv.QUOTE_MINIMAL)
+                if write_header:
+                    writer.writerow(rows[0])
+                writer.writerows(rows[1:])
+
+    def flush_batch(self, batch, paths):
+        """
+        Write a batch with write_batch and then save the cookies the
+        deduplicator has seen, so that they are only remembered once they
+        have been written, and move the files at paths it was parsed from
+        into DONE_DIR. If the batch can't be written the cookies are
+        forgotten and the files are left to be ingested again
+        """
+        try:
+            self.write_batch(batch)
+        except BaseException:
+            if self.deduplicator is not None:
+                self.deduplicator.rollback()
+            raise
+
+        if self.deduplicator is not None:
+            self.deduplicator.commit()
+
+        for path in paths:
+            self.move_file(path, DONE_DIR)
+
+    async def produce(self, path_queue, stop_when_idle):
+        """
+        Poll the spool directory, queueing each ready file. If stop_when_idle
+        is set, stop after the first poll which finds no new files
+        """
+        while True:
+            ready = self.find_ready_files(wait_for_stable=not stop_when_idle)
+
+            for path in ready:
+                self.seen.add(path)
+                await path_queue.put(path) # Blocks while the workers are behind
+
+            if stop_when_idle and not ready:
+                break
+
+            if not stop_when_idle:
+                await asyncio.sleep(self.poll_interval)
+
+        for _ in range(self.workers):
+            await path_queue.put(None)
+
+    async def work(self, executor, path_queue, result_queue):
+        """
+        Parse queued files in the executor until a None path is received
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            path = await path_queue.get()
+            if path is None:
+                break
+
+            try:
+                tables = await loop.run_in_executor(executor, self.parse_file, path)
+            except Exception as error: # pylint: disable=broad-except
+                # One bad file should not stop the rest of the spool
+                self.errors.append((path, str(error)))
+                await loop.run_in_executor(executor, self.move_file, path, ERROR_DIR)
+                continue
+
+            await result_queue.put((path, tables))
+
+        await result_queue.put(None)
+
+    async def consume(self, result_queue):
+        """
+        Collect parsed tables into batches and write them out, flushing
+        whenever a batch is full or no more results are waiting
+        """
+        loop = asyncio.get_running_loop()
+
+        # Writes, and the deduplicator's lookups, are kept off the event
+        # loop, in order, on a single thread
+        writer_executor = ThreadPoolExecutor(max_workers=1)
+
+        batch = {}
+        batch_size = 0
+        finished_workers = 0
+        batch_paths = []
+
+        try:
+            while finished_workers < self.workers:
+                result = await result_queue.get()
+
+                if result is None:
+                    finished_workers += 1
+                else:
+                    path, tables = result
+                    source = os.path.basename(path)
+
+                    new_tables = await loop.run_in_executor(writer_executor,
+                                                            self.filter_tables, tables, source)
+                    for cookie, table in tables.items():
+                        rows = batch.setdefault(cookie, [["Source file"] + table[0]])
+                        rows.extend([source] + row for row in new_tables[cookie])
+                        batch_size += len(new_tables[cookie])
+
+                    batch_paths.append(path)
+
+                if batch and (batch_size >= self.batch_rows or result_queue.empty()):
+                    await loop.run_in_executor(writer_executor, self.flush_batch, batch,
+                                               batch_paths)
+                    self.ingested.extend(batch_paths)
+                    batch, batch_size, batch_paths = {}, 0, []
+
+            if batch_paths:
+                await loop.run_in_executor(writer_executor, self.flush_batch, batch,
+                                           batch_paths)
+                self.ingested.extend(batch_paths)
+        finally:
+            writer_executor.shutdown()
+
+    async def run(self, stop_when_idle=False):
+        """
+        Run the pipeline. Runs until cancelled, or if stop_when_idle is set,
+        until every file currently in the spool directory has been ingested
+        """
+        path_queue = asyncio.Queue(maxsize=self.queue_size)
+        result_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            await asyncio.gather(self.produce(path_queue, stop_when_idle),
+                                 self.consume(result_queue),
+                                 *[self.work(executor, path_queue, result_queue)
+                                   for _ in range(self.workers)])
+
+def ingest_directory(spool_dir, output_dir, cookie_names, **kwargs):
+    """
+    Ingest every cookie store currently in spool_dir into output_dir,
+    returning the SpoolIngester so its ingested and errors lists can be read
+    """
+    ingester = SpoolIngester(spool_dir, output_dir, cookie_names, **kwargs)
+    asyncio.run(ingester.run(stop_when_idle=True))
+    return ingester
@@ -4,6 +4,8 @@ Provides functions to help with parsing GA cookies
 
 import time
 
+import time_helpers
+
 def create_ga_list(values, length):
     """Return the list of values, padded to specified length with '<not found>'"""
 
@@ -28,14 +30,19 @@ def try_parse_epoch_datetime(datetime, time_unit="seconds"):
     Try to parse a string containing an epoch datetime to a nicely formatted
     output, or return the string if not possible
     """
+    return time_helpers.EPOCH_FORMATTER.format(datetime, time_unit)
+
+def parse_epoch(text):
+    """
+    Return the epoch time in text as a float, or None if it is not a
+    valid time
+    """
     try:
-        converted = float(datetime) / (1.0 if time_unit == "seconds" else 1000.0)
-        try:
-            return time.strftime('%Y-%m-%d %H:%M:%SZ', time.gmtime(converted))
-        except (ValueError, OSError) as _:
-            return datetime
-    except ValueError:
-        return datetime # Could not be parsed into a float
+        epoch = float(text)
+        time.gmtime(epoch)
+    except (ValueError, TypeError, OSError, OverflowError):
+        return None
+    return epoch
 
 def try_parse_kvp(instring, key):
     """
@@ -98,47 +105,73 @@ def ga_parse(name, value):
                 "value_access_method": try_parse_kvp(padded_elements[4], "utmcmd"),
                 "value_search_term": try_parse_kvp(padded_elements[4], "utmctr")}
 
-def ga_generate_table(parsed_rows, cookie_name):
-    """
-    Converts a list of (cookie host, cookie creation time, cookie value) to a
-    csv-able list of dicts
-    """
-
-    headers = {
-        "_ga":    [["First visit time", "time_first_visit"],
-                   ["Client Identifier", "value_client_identifier"]],
+# The extra columns of the table generated for each cookie type, as
+# [column header, key of ga_parse output]
+GA_TABLE_HEADERS = {
+    "_ga":    [["First visit time", "time_first_visit"],
+               ["Client Identifier", "value_client_identifier"]],
 
-        "__utma": [["Total visits", "count_visits_utma"],
-                   ["Most recent visit", "time_most_recent_visit"],
-                   ["Second most recent visit", "time_2nd_most_recent_visit"],
-                   ["Visitor Identifier", "value_visitor_identifier"]],
+    "__utma": [["Total visits", "count_visits_utma"],
+               ["Most recent visit", "time_most_recent_visit"],
+               ["Second most recent visit", "time_2nd_most_recent_visit"],
+               ["Visitor Identifier", "value_visitor_identifier"]],
 
-        "__utmb": [["Page views in current session", "count_session_pageviews"],
-                   ["Time current session started", "time_session_start"],
-                   ["10 - Outbound link clicks", "count_outbound_clicks"]],
+    "__utmb": [["Page views in current session", "count_session_pageviews"],
+               ["Time current session started", "time_session_start"],
+               ["10 - Outbound link clicks", "count_outbound_clicks"]],
 
-        "__utmz": [["Total visits", "count_visits_utmz"],
-                   ["Source used to access site", "value_visit_source"],
-                   ["Keyword used to find site", "value_search_term"]]
-    }
+    "__utmz": [["Total visits", "count_visits_utmz"],
+               ["Source used to access site", "value_visit_source"],
+               ["Keyword used to find site", "value_search_term"]]
+}
 
+def ga_table_headers(cookie_name):
+    """
+    Returns the header row of the table generated for the given cookie type
+    """
     current_headers = ["Cookie host", cookie_name+" value", "Cookie creation time"]
-    current_headers += [pair[0] for pair in headers[cookie_name]]
-
-    output = [current_headers]
+    current_headers += [pair[0] for pair in GA_TABLE_HEADERS[cookie_name]]
+    return current_headers
 
-    for host, creation_time, value in parsed_rows:
+def ga_table_row(host, creation_time, value, cookie_name):
+    """
+    Returns the table row for one cookie of the given cookie type
+    """
+    parsed = ga_parse(cookie_name, value)
 
-        parsed = ga_parse(cookie_name, value)
+    values = [parsed[pair[1]] for pair in GA_TABLE_HEADERS[cookie_name]]
 
-        values = [parsed[pair[1]] for pair in headers[cookie_name]]
+    return [host, value, try_parse_epoch_datetime(creation_time)] + values
 
-        columns = [host, value, try_parse_epoch_datetime(creation_time)] + values
+def ga_table_rows(parsed_rows, cookie_name):
+    """
+    Returns the table rows for a list of (cookie host, cookie creation time,
+    cookie value) of the given cookie type, formatting all of the creation
+    times at once
+    """
+    try:
+        creation_times = time_helpers.EPOCH_FORMATTER.format_many(
+            [creation_time for _, creation_time, _ in parsed_rows])
+    except (TypeError, OverflowError):
+        # Raise the same error as formatting the rows one at a time would
+        return [ga_table_row(host, creation_time, value, cookie_name)
+                for host, creation_time, value in parsed_rows]
 
-        output.append(columns)
+    table_headers = GA_TABLE_HEADERS[cookie_name]
 
+    output = []
+    for (host, _, value), creation_time in zip(parsed_rows, creation_times):
+        parsed = ga_parse(cookie_name, value)
+        output.append([host, value, creation_time] + [parsed[pair[1]] for pair in table_headers])
     return output
 
+def ga_generate_table(parsed_rows, cookie_name):
+    """
+    Converts a list of (cookie host, cookie creation time, cookie value) to a
+    csv-able list of dicts
+    """
+    return [ga_table_headers(cookie_name)] + ga_table_rows(parsed_rows, cookie_name)
+
 def ga_summary(inp):
     """
     Returns a summary dict of the ga cookie info, taking list inp of
@@ -0,0 +1,59 @@
+"""
+Provides helpers for fetchers to report their progress through a cookie
+file, cheaply enough that it can be left on in the innermost loops
+"""
+
+import itertools
+
+# Number of rows between progress reports
+PROGRESS_INTERVAL = 4096
+
+def report_rows(rows, callback, interval=None):
+    """
+    Return an iterator over rows which calls callback(number of rows) after
+    every interval rows, by default PROGRESS_INTERVAL, or rows itself if
+    callback is None
+    """
+    if callback is None:
+        return rows
+    return iter_reporting_rows(rows, callback, interval or PROGRESS_INTERVAL)
+
+def iter_reporting_rows(rows, callback, interval):
+    """
+    Yield rows in chunks of interval, calling callback after each one, so
+    that counting the rows costs almost nothing per row
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, interval))
+        if not chunk:
+            return
+        yield from chunk
+        callback(len(chunk))
+
+def report_chunks(rows, position, total, callback, interval=None):
+    """
+    Yield lists of up to interval rows, by default PROGRESS_INTERVAL. After
+    each list has been used, callback is called with how far
+    position(last row of the list) has moved, if it has, and at the end
+    with the rest of total, so that progress through a file can be
+    reported in bytes. Looping over the lists adds nothing to the time
+    taken for each row
+    """
+    interval = interval or PROGRESS_INTERVAL
+    reported = 0
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, interval))
+        if not chunk:
+            break
+        yield chunk
+
+        current = position(chunk[-1])
+        if current > reported:
+            callback(current - reported)
+            reported = current
+
+    if total > reported:
+        callback(total - reported)
@@ -0,0 +1,229 @@
+"""
+Provides the rendering of the domain info the GUI shows for a single domain
+for every domain at once, as a single text or HTML report
+"""
+
+import collections
+import concurrent.futures
+import html
+import itertools
+import os
+import string
+
+import general_helpers
+import parser_helpers
+
+REPORT_FORMATS = ["text", "html"]
+
+# Title given to reports by default
+REPORT_TITLE = "GA cookie domain report"
+
+# How each domain's rendered info is laid out in each report format
+TEXT_HEADER = "{title}\n\n"
+TEXT_SECTION = "{domain}\n{rule}\n{info}\n\n"
+TEXT_FOOTER = ""
+
+HTML_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+HTML_SECTION = """<section>
+<h2>{domain}</h2>
+<pre>{info}</pre>
+</section>
+"""
+HTML_FOOTER = """</body>
+</html>
+"""
+
+# Number of domains rendered by each task given to a worker process
+CHUNK_DOMAINS = 500
+
+# Fewer domains than this are rendered without worker processes when the
+# number of processes isn't given, as starting them would take longer than
+# rendering the domains
+PROCESS_THRESHOLD = 5000
+
+# (CompiledTemplate, report format) used by render_chunk in worker
+# processes, see set_worker_template
+WORKER_TEMPLATE = None
+
+class CompiledTemplate:
+    """
+    A format string, parsed once, which renders a dict of values exactly as
+    general_helpers.format_string_default does: any {format} key which
+    isn't in the dict is given the default value.
+
+    The template is split into its literal text and replacement fields when
+    it is made, so that rendering it for each domain only joins the values
+    into place. Templates with fields that format_map looks up in a more
+    complicated way, such as {key.attribute}, {key[index]} or nested format
+    specs, are rendered by format_string_default instead
+    """
+    def __init__(self, template, default=general_helpers.DEFAULT_VALUE):
+        self.template = template
+        self.default = default
+
+        # [(literal text, key, conversion, format spec), ...], where key is
+        # None after the last replacement field, or None if the template
+        # has to be rendered by format_string_default
+        self.parts = []
+
+        for literal, key, format_spec, conversion in string.Formatter().parse(template):
+            if key is not None and not self.is_simple_field(key, format_spec):
+                self.parts = None
+                break
+            self.parts.append((literal, key, conversion, format_spec))
+
+    @staticmethod
+    def is_simple_field(key, format_spec):
+        """
+        Return whether format_map would look up the replacement field's
+        value as just dictionary[key]
+        """
+        # Empty and numeric keys are positional arguments, which format_map
+        # doesn't have
+        if not key or key.isdigit():
+            return False
+        return "." not in key and "[" not in key and "{" not in format_spec
+
+    def render(self, dictionary):
+        """
+        Return the template formatted with the values in dictionary
+        """
+        if self.parts is None:
+            return general_helpers.format_string_default(self.template, dictionary,
+                                                         self.default)
+
+        pieces = []
+        for literal, key, conversion, format_spec in self.parts:
+            pieces.append(literal)
+            if key is None:
+                continue
+
+            value = dictionary.get(key, self.default)
+            if conversion == "s":
+                value = str(value)
+            elif conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            pieces.append(format(value, format_spec))
+
+        return "".join(pieces)
+
+def render_section(template, report_format, domain, rows):
+    """
+    Return the part of the report for a domain, where rows are its
+    [(cookie name, value), ...] as given by the fetcher's get_domain_rows
+    """
+    info = template.render(parser_helpers.ga_summary(rows))
+
+    if report_format == "html":
+        return HTML_SECTION.format(domain=html.escape(str(domain)), info=html.escape(info))
+    return TEXT_SECTION.format(domain=domain, rule="="*len(str(domain)), info=info)
+
+def set_worker_template(template, report_format):
+    """
+    Keep the template and report format in a worker process, so that they
+    are only sent to it once rather than with every chunk
+    """
+    global WORKER_TEMPLATE # pylint: disable=global-statement
+    WORKER_TEMPLATE = (template, report_format)
+
+def render_chunk(chunk):
+    """
+    Return the rendered parts of the report for a chunk of [(domain, rows),
+    ...] in a worker process, joined together
+    """
+    template, report_format = WORKER_TEMPLATE
+    return "".join(render_section(template, report_format, domain, rows)
+                   for domain, rows in chunk)
+
+def iter_chunks(items, size):
+    """
+    Yield lists of up to size items at a time from the iterable items
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def render_in_processes(chunks, template, report_format, processes):
+    """
+    Yield (rendered chunk, number of domains in it) for each of the chunks
+    of [(domain, rows), ...], in order, rendering them in worker processes.
+    Only a few chunks are waiting for a worker at any time, so that they
+    are read from the fetcher no faster than they can be rendered
+    """
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=set_worker_template,
+                                                initargs=(template, report_format)) as executor:
+        pending = collections.deque()
+
+        for chunk in chunks:
+            pending.append((executor.submit(render_chunk, chunk), len(chunk)))
+            if len(pending) >= processes*2:
+                future, domain_count = pending.popleft()
+                yield future.result(), domain_count
+
+        while pending:
+            future, domain_count = pending.popleft()
+            yield future.result(), domain_count
+
+def write_report(fetcher, report_file, report_format="text", processes=None,
+                 template=general_helpers.DOMAIN_INFO_TEMPLATE, title=REPORT_TITLE,
+                 progress_callback=None):
+    """
+    Write the domain info of every domain found by the fetcher, in sorted
+    order, to the open text file report_file as a report_format report,
+    returning the number of domains written.
+
+    Each domain's info is the same as get_domain_info and the template give
+    for it. The domains are rendered in processes worker processes, or in
+    one worker per CPU if it isn't given and there are at least
+    PROCESS_THRESHOLD domains. progress_callback, if given, is called with
+    the number of domains written after each chunk of them
+    """
+    if report_format not in REPORT_FORMATS:
+        raise ValueError("Unknown report format {}".format(report_format))
+
+    if not isinstance(template, CompiledTemplate):
+        template = CompiledTemplate(template)
+
+    if processes is None:
+        processes = 1
+        if fetcher.get_domain_count() >= PROCESS_THRESHOLD:
+            processes = os.cpu_count() or 1
+
+    header, footer = TEXT_HEADER, TEXT_FOOTER
+    if report_format == "html":
+        header, footer = HTML_HEADER, HTML_FOOTER
+        title = html.escape(title)
+
+    chunks = iter_chunks(fetcher.iter_domain_rows(fetcher.iter_domains()), CHUNK_DOMAINS)
+
+    if processes > 1:
+        rendered_chunks = render_in_processes(chunks, template, report_format, processes)
+    else:
+        rendered_chunks = (("".join(render_section(template, report_format, domain, rows)
+                                    for domain, rows in chunk), len(chunk))
+                           for chunk in chunks)
+
+    report_file.write(header.format(title=title))
+
+    written = 0
+    for rendered, domain_count in rendered_chunks:
+        report_file.write(rendered)
+        written += domain_count
+        if progress_callback is not None:
+            progress_callback(domain_count)
+
+    report_file.write(footer)
+    return written
@@ -0,0 +1,288 @@
+"""
+Provides random samples of the GA cookies of a cookie store, with estimates
+of the number of cookies and domains and their error bounds, for a quick
+first look at stores too large to read in full
+"""
+
+import collections
+import hashlib
+import itertools
+import math
+
+import parser_helpers
+
+# Number of GA cookies sampled by default
+DEFAULT_SAMPLE_SIZE = 10000
+
+# Number of consecutive rowids read together by Firefox3Fetcher.get_sample
+SAMPLE_BLOCK_ROWS = 256
+
+# Fewest blocks read before a block sample may stop, so that the variance
+# between blocks, and so the error bounds, can be estimated
+MIN_SAMPLE_BLOCKS = 30
+
+# Number of bits of each hash which choose a HyperLogLog register, giving
+# 2**14 registers and a standard error of 0.8%
+HLL_PRECISION = 14
+
+# Multiplier of the standard error giving the 95% error bounds
+CONFIDENCE_Z = 1.96
+
+def hash_value(value):
+    """
+    Return an unsigned 64 bit hash of a string or None
+    """
+    # No string encodes to \xff, so None can't collide with one
+    key = b"\xff" if value is None else str(value).encode("utf-8", "surrogatepass")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values added to it, using a fixed
+    2**precision bytes of memory however many there are
+    """
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.register_count = 1 << precision
+        self.registers = bytearray(self.register_count)
+
+    def add(self, value):
+        """
+        Add a value, which is a string or None
+        """
+        self.update([value])
+
+    def update(self, values):
+        """
+        Add every value in the iterable values
+        """
+        # Looked up once rather than for every value
+        registers = self.registers
+        mask = self.register_count - 1
+        precision = self.precision
+        max_rank = 64 - precision + 1
+
+        for value in values:
+            hashed = hash_value(value)
+
+            # The position of the first set bit of the rest of the hash
+            rank = max_rank - (hashed >> precision).bit_length()
+            if rank > registers[hashed & mask]:
+                registers[hashed & mask] = rank
+
+    def count(self):
+        """
+        Return the estimated number of distinct values added
+        """
+        registers = self.register_count
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers * registers / sum(2.0 ** -rank for rank in self.registers)
+
+        # Few distinct values are counted more accurately by the number of
+        # registers which are still empty
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * registers and empty:
+            estimate = registers * math.log(registers / empty)
+
+        return int(round(estimate))
+
+    def get_error(self):
+        """
+        Return the 95% error bound of count, as a number of values
+        """
+        return int(math.ceil(CONFIDENCE_Z * 1.04 / math.sqrt(self.register_count) * self.count()))
+
+class CookieSample:
+    """
+    A random sample of the GA cookies of a cookie store, where cookies is a
+    list of their (cookie name, cookie host, creation time, value) in the
+    order they are stored in the cookie file. cookie_count and domain_count are the
+    estimated number of GA cookies and domains in the whole store, and
+    cookie_error and domain_error are their 95% error bounds, which are 0 if
+    they are exact
+    """
+    def __init__(self, cookies, cookie_count, cookie_error, domain_count, domain_error):
+        # pylint: disable=too-many-arguments
+        self.cookies = cookies
+        self.cookie_count = cookie_count
+        self.cookie_error = cookie_error
+        self.domain_count = domain_count
+        self.domain_error = domain_error
+
+    def get_domains(self):
+        """
+        Return the unique domains of the sampled cookies, in the order they
+        are first found
+        """
+        return list(collections.OrderedDict.fromkeys(host for _, host, _, _ in self.cookies))
+
+    def get_top_domains(self, top_n=10):
+        """
+        Return [(domain, estimated number of GA cookies, 95% error bound),
+        ...] of the top_n domains with the most sampled cookies. The bounds
+        treat the sampled cookies as if each was chosen independently
+        """
+        sampled = len(self.cookies)
+        counts = collections.Counter(host for _, host, _, _ in self.cookies)
+
+        # The finite population correction, which is 0 once every cookie has
+        # been sampled
+        correction = 0
+        if self.cookie_count > 1 and sampled < self.cookie_count:
+            correction = (self.cookie_count - sampled) / (self.cookie_count - 1)
+
+        top_domains = []
+        for host, count in counts.most_common(top_n):
+            share = count / sampled
+            error = CONFIDENCE_Z * self.cookie_count * math.sqrt(share * (1 - share) / sampled
+                                                                 * correction)
+            top_domains.append((host, int(round(share * self.cookie_count)),
+                                int(math.ceil(error))))
+        return top_domains
+
+def sample_stream(cookies, sample_size, rng):
+    """
+    Return a CookieSample of sample_size of the (cookie name, cookie host,
+    creation time, value) in the iterable cookies, chosen by reservoir
+    sampling as they are read. Every cookie is read, so the number of
+    cookies is exact and the number of domains is estimated by a
+    HyperLogLog of the hosts
+    """
+    reservoir = []
+    hosts = HyperLogLog()
+
+    count = 0
+    for cookie in cookies:
+        hosts.add(cookie[1])
+
+        # Each cookie replaces one already chosen with probability
+        # sample_size / (count + 1)
+        if count < sample_size:
+            reservoir.append((count, cookie))
+        else:
+            replaced = rng.randrange(count + 1)
+            if replaced < sample_size:
+                reservoir[replaced] = (count, cookie)
+        count += 1
+
+    reservoir.sort(key=lambda item: item[0])
+    sample = CookieSample([cookie for _, cookie in reservoir], count, 0,
+                          hosts.count(), hosts.get_error())
+
+    # Every cookie was sampled, so the domains are known exactly
+    if count <= sample_size:
+        sample.domain_count, sample.domain_error = len(sample.get_domains()), 0
+    return sample
+
+def iter_random_blocks(block_count, rng):
+    """
+    Yield every number in range(block_count) once, in random order, without
+    making a list of them all unless at least half are needed
+    """
+    chosen = set()
+    while len(chosen) < block_count // 2:
+        block = rng.randrange(block_count)
+        if block not in chosen:
+            chosen.add(block)
+            yield block
+
+    remaining = [block for block in range(block_count) if block not in chosen]
+    rng.shuffle(remaining)
+    yield from remaining
+
+def estimate_block_total(block_counts, block_count):
+    """
+    Return (estimated total, 95% error bound) of a count over all block_count
+    blocks, given its value in each of a random sample of the blocks
+    """
+    sampled = len(block_counts)
+    if sampled == 0:
+        return 0, 0
+
+    mean = sum(block_counts) / sampled
+    total = int(round(block_count * mean))
+    if sampled >= block_count:
+        return total, 0
+    if sampled == 1:
+        return total, total # Nothing is known of the variance
+
+    variance = sum((count - mean) ** 2 for count in block_counts) / (sampled - 1)
+    error = CONFIDENCE_Z * block_count * math.sqrt(variance / sampled
+                                                   * (1 - sampled / block_count))
+    return total, int(math.ceil(error))
+
+class SampledFetcher:
+    """
+    Wraps a fetcher, answering from a CookieSample of its GA cookies, taken
+    with the fetcher's get_sample the first time it is needed.
+
+    The cookie and domain counts are the sample's estimates, the domains
+    are those of the sampled cookies, and iter_cookies gives the sampled
+    cookies. get_domain_info, and everything else not based on the sample,
+    is passed straight to the wrapped fetcher, so it is exact
+    """
+    def __init__(self, fetcher, sample_size=DEFAULT_SAMPLE_SIZE, rng=None):
+        self.fetcher = fetcher
+        self.sample_size = sample_size
+        self.rng = rng
+        self.sample = None
+
+    def __getattr__(self, name):
+        # Only called for attributes this class doesn't have
+        return getattr(self.fetcher, name)
+
+    @property
+    def progress_callback(self):
+        """
+        The progress_callback of the wrapped fetcher, to which taking the
+        sample reports its progress
+        """
+        return self.fetcher.progress_callback
+
+    @progress_callback.setter
+    def progress_callback(self, callback):
+        self.fetcher.progress_callback = callback
+
+    def get_sample(self):
+        """
+        Return the CookieSample, taking it first if needed
+        """
+        if self.sample is None:
+            self.sample = self.fetcher.get_sample(self.sample_size, self.rng)
+        return self.sample
+
+    def get_domains(self):
+        return self.get_sample().get_domains()
+
+    def iter_domains(self, sorted=True, limit=None, offset=0):
+        # pylint: disable=redefined-builtin
+        domains = self.get_domains()
+        if sorted:
+            domains.sort(key=lambda host: (host is not None, host))
+        return itertools.islice(domains, offset, None if limit is None else offset + limit)
+
+    def get_domain_count(self):
+        return self.get_sample().domain_count
+
+    def get_cookie_count(self):
+        return self.get_sample().cookie_count
+
+    def get_domain_summary(self):
+        return self.get_domains(), self.get_cookie_count()
+
+    def get_cookies(self, cookie_name):
+        rows = [(host, creation_time, value) for name, host, creation_time, value
+                in self.get_sample().cookies if name == cookie_name]
+        return parser_helpers.ga_generate_table(rows, cookie_name)
+
+    def iter_cookies(self):
+        return iter(self.get_sample().cookies)
+
+    def iter_cookie_chunks(self, chunk_rows, position=None):
+        # A new sample would be different, so it can't be continued
+        if position is not None:
+            raise ValueError("An export of a sample can't be continued")
+
+        cookies = self.get_sample().cookies
+        for start in range(0, len(cookies), chunk_rows):
+            yield cookies[start:start + chunk_rows], None
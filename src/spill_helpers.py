@@ -0,0 +1,453 @@
+"""
+Provides a memory budget, and sets, counters and groups which are kept in
+memory until they would go over it, after which they spill to a temporary
+SQLite database on disk. This lets cookie files much larger than the
+available memory be processed
+"""
+
+import collections
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import tempfile
+import weakref
+
+# Estimated bytes used by each item of a collection besides the item itself,
+# for its hash table slot and the references to it
+ITEM_OVERHEAD = 100
+
+# Number of items added to a collection which has spilled that are kept in
+# memory before being written to its database together
+SPILL_BATCH = 10000
+
+# Multipliers of the units accepted by parse_size
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*$", re.IGNORECASE)
+
+# Each SQLite connection's page cache is limited to this fraction of the
+# budget
+SQLITE_CACHE_FRACTION = 8
+
+# The smallest page cache given to an SQLite connection, in KiB
+MIN_SQLITE_CACHE_KIB = 256
+
+def parse_size(text):
+    """
+    Return the number of bytes given by a size such as "512M", "2G" or
+    "1048576", where K, M, G and T are powers of 1024. Raises ValueError if
+    it isn't a size
+    """
+    match = SIZE_PATTERN.match(text)
+    if match is None:
+        raise ValueError("{} is not a size such as 512M or 2G".format(text))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def get_budget(max_memory):
+    """
+    Return a MemoryBudget of max_memory bytes, or None if it is None
+    """
+    if max_memory is None:
+        return None
+    return MemoryBudget(max_memory)
+
+def make_set(budget):
+    """
+    Return a SpillSet using the budget, or a plain set if there is no budget
+    """
+    if budget is None:
+        return set()
+    return SpillSet(budget=budget)
+
+def estimate_size(item):
+    """
+    Return the estimated number of bytes an item of a collection uses
+    """
+    size = sys.getsizeof(item) + ITEM_OVERHEAD
+    if isinstance(item, (list, tuple)):
+        size += sum(sys.getsizeof(element) for element in item)
+    return size
+
+def limit_sqlite_memory(conn, budget):
+    """
+    Keep the page caches of an SQLite connection, including the one of its
+    temporary tables, within a fraction of the budget, and have SQLite keep
+    temporary tables and indexes in files rather than in memory
+    """
+    if budget is None:
+        return
+
+    cache_kib = max(budget.max_memory // SQLITE_CACHE_FRACTION // 1024, MIN_SQLITE_CACHE_KIB)
+    conn.execute("PRAGMA temp_store = FILE")
+    conn.execute("PRAGMA main.cache_size = -{}".format(cache_kib))
+    conn.execute("PRAGMA temp.cache_size = -{}".format(cache_kib))
+
+def release_memory(budget, reserved):
+    """
+    Give back the memory a collection has reserved from the budget, where
+    reserved is a list of the number of bytes
+    """
+    budget.release(reserved[0])
+    reserved[0] = 0
+
+def remove_database(conn, path):
+    """
+    Close a spilled collection's database and delete its file
+    """
+    conn.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class MemoryBudget:
+    """
+    The number of bytes which the collections of a fetcher, and of the
+    aggregations, reports and exports made with it, may hold in memory
+    between them. Each collection reserves memory as it grows, and spills
+    to disk once it can't
+    """
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.used = 0
+
+    def available(self):
+        """
+        Return the number of bytes which haven't been reserved
+        """
+        return max(self.max_memory - self.used, 0)
+
+    def reserve(self, size):
+        """
+        Reserve size bytes, returning whether there were enough left
+        """
+        if self.used + size > self.max_memory:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size):
+        """
+        Give back size reserved bytes
+        """
+        self.used -= size
+
+class SpillCollection:
+    """
+    Template for collections which are kept in memory while they fit in the
+    budget, and are moved to a temporary SQLite database when they don't.
+    Without a budget they are never spilled
+    """
+
+    # The tables of the collection's database
+    SCHEMA = []
+
+    def __init__(self, budget=None):
+        self.budget = budget
+
+        # Bytes reserved from the budget for the items in memory, in a list
+        # so that they can be given back once the collection is no longer
+        # used
+        self.reserved = [0]
+        self.release_finalizer = None
+        if budget is not None:
+            self.release_finalizer = weakref.finalize(self, release_memory, budget,
+                                                      self.reserved)
+
+        self.conn = None
+        self.finalizer = None
+
+    @property
+    def spilled(self):
+        """
+        Whether the collection has been moved to disk
+        """
+        return self.conn is not None
+
+    def fits(self, item):
+        """
+        Reserve memory for another item, returning False if the collection
+        should be spilled instead
+        """
+        if self.budget is None:
+            return True
+
+        size = estimate_size(item)
+        if not self.budget.reserve(size):
+            return False
+        self.reserved[0] += size
+        return True
+
+    def open_database(self):
+        """
+        Make the temporary database which the collection spills to, and
+        give back the memory reserved for the items which were in memory
+        """
+        handle, path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(handle)
+
+        self.conn = sqlite3.connect(path)
+        # Nothing needs to survive a crash
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        limit_sqlite_memory(self.conn, self.budget)
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+
+        # Delete the database once the collection is no longer used
+        self.finalizer = weakref.finalize(self, remove_database, self.conn, path)
+
+        if self.budget is not None:
+            release_memory(self.budget, self.reserved)
+
+    def close(self):
+        """
+        Give back the collection's memory and delete its database, if it
+        has spilled
+        """
+        if self.budget is not None:
+            release_memory(self.budget, self.reserved)
+
+        if self.finalizer is not None:
+            self.finalizer()
+
+class SpillSet(SpillCollection):
+    """
+    A set of strings or numbers. Until it spills, it is iterated over in the
+    same order as a set of the same items added in the same order would be.
+    Once spilled, it is iterated over in sorted order, with None first
+    """
+    SCHEMA = ["CREATE TABLE items (item PRIMARY KEY) WITHOUT ROWID"]
+
+    def __init__(self, items=(), budget=None):
+        super().__init__(budget)
+        self.items = set()
+
+        # Items added since the database was last written to, and whether
+        # None, which the database can't hold as a key, has been added
+        self.buffer = set()
+        self.has_none = False
+
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        """
+        Add an item to the set
+        """
+        if not self.spilled:
+            if item in self.items:
+                return
+            if self.fits(item):
+                self.items.add(item)
+                return
+            self.spill()
+
+        if item is None:
+            self.has_none = True
+        else:
+            self.buffer.add(item)
+            if len(self.buffer) >= SPILL_BATCH:
+                self.flush()
+
+    def spill(self):
+        """
+        Move the items in memory to the database
+        """
+        self.open_database()
+        self.buffer, self.items = self.items, set()
+        self.has_none = None in self.buffer
+        self.buffer.discard(None)
+        self.flush()
+
+    def flush(self):
+        """
+        Write the buffered items to the database
+        """
+        self.conn.executemany("INSERT OR IGNORE INTO items VALUES (?)",
+                              ((item,) for item in self.buffer))
+        self.buffer.clear()
+
+    def __contains__(self, item):
+        if not self.spilled:
+            return item in self.items
+        if item is None:
+            return self.has_none
+        if item in self.buffer:
+            return True
+        return self.conn.execute("SELECT 1 FROM items WHERE item = ?", (item,)).fetchone()\
+               is not None
+
+    def __len__(self):
+        if not self.spilled:
+            return len(self.items)
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] + self.has_none
+
+    def __iter__(self):
+        if not self.spilled:
+            yield from self.items
+            return
+
+        self.flush()
+        if self.has_none:
+            yield None
+        for (item,) in self.conn.execute("SELECT item FROM items ORDER BY item"):
+            yield item
+
+class SpillCounter(SpillCollection):
+    """
+    A counter of strings or numbers, which gives the same most_common
+    results as collections.Counter whether or not it has spilled
+    """
+    # Rows are added in the order their keys were first counted, so that
+    # keys with the same count are in the same order as in a Counter
+    SCHEMA = ["CREATE TABLE counts (key, count INTEGER)",
+              "CREATE INDEX counts_key ON counts (key)"]
+
+    def __init__(self, budget=None):
+        super().__init__(budget)
+        self.counts = collections.Counter()
+
+    def add(self, key, count=1):
+        """
+        Add count to the count of key
+        """
+        if not self.spilled and key not in self.counts and not self.fits(key):
+            self.spill()
+
+        self.counts[key] += count
+        if self.spilled and len(self.counts) >= SPILL_BATCH:
+            self.flush()
+
+    def spill(self):
+        """
+        Move the counts in memory to the database
+        """
+        self.open_database()
+        self.flush()
+
+    def flush(self):
+        """
+        Add the counts in memory to the database
+        """
+        self.conn.executemany("INSERT INTO counts SELECT ?, 0 WHERE NOT EXISTS \
+(SELECT 1 FROM counts WHERE key IS ?)", ((key, key) for key in self.counts))
+        self.conn.executemany("UPDATE counts SET count = count + ? WHERE key IS ?",
+                              ((count, key) for key, count in self.counts.items()))
+        self.counts.clear()
+
+    def most_common(self, n=None):
+        """
+        Return a list of the n most common (key, count), or of all of them
+        """
+        if not self.spilled:
+            return self.counts.most_common(n)
+
+        self.flush()
+        return self.conn.execute("SELECT key, count FROM counts ORDER BY count DESC, rowid \
+LIMIT ?", (-1 if n is None else n,)).fetchall()
+
+    def __len__(self):
+        if not self.spilled:
+            return len(self.counts)
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM counts").fetchone()[0]
+
+class SpillGroups(SpillCollection):
+    """
+    Lists of values grouped by key, where the keys are added first and the
+    values are then appended to the group of their key. Groups are given
+    by items in the order their keys were added, whether or not they have
+    spilled
+    """
+    SCHEMA = ["CREATE TABLE keys (position INTEGER PRIMARY KEY, key)",
+              "CREATE INDEX keys_key ON keys (key)",
+              "CREATE TABLE spilled_values (position INTEGER, value BLOB)",
+              "CREATE INDEX spilled_values_position ON spilled_values (position)"]
+
+    def __init__(self, budget=None):
+        super().__init__(budget)
+        self.groups = {}
+
+        # Values appended since the database was last written to, as
+        # [(position of their key, pickled value), ...]
+        self.buffer = []
+
+    def add_key(self, key):
+        """
+        Add a key with an empty group, if it isn't already there
+        """
+        if not self.spilled:
+            if key in self.groups:
+                return
+            if self.fits(key):
+                self.groups[key] = []
+                return
+            self.spill()
+
+        if self.get_position(key) is None:
+            self.conn.execute("INSERT INTO keys (key) VALUES (?)", (key,))
+
+    def get_position(self, key):
+        """
+        Return the position of a key in the database, or None if it isn't
+        there
+        """
+        row = self.conn.execute("SELECT position FROM keys WHERE key IS ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __contains__(self, key):
+        if not self.spilled:
+            return key in self.groups
+        return self.get_position(key) is not None
+
+    def append(self, key, value):
+        """
+        Append a value to the group of key, which must have been added
+        """
+        if not self.spilled:
+            if self.fits(value):
+                self.groups[key].append(value)
+                return
+            self.spill()
+
+        self.buffer.append((self.get_position(key), pickle.dumps(value)))
+        if len(self.buffer) >= SPILL_BATCH:
+            self.flush()
+
+    def spill(self):
+        """
+        Move the groups in memory to the database
+        """
+        self.open_database()
+        for key, values in self.groups.items():
+            position = self.conn.execute("INSERT INTO keys (key) VALUES (?)", (key,)).lastrowid
+            self.buffer.extend((position, pickle.dumps(value)) for value in values)
+            self.flush()
+        self.groups = {}
+
+    def flush(self):
+        """
+        Write the buffered values to the database
+        """
+        self.conn.executemany("INSERT INTO spilled_values VALUES (?, ?)", self.buffer)
+        self.buffer = []
+
+    def items(self):
+        """
+        Yield (key, list of values) for each group
+        """
+        if not self.spilled:
+            yield from self.groups.items()
+            return
+
+        self.flush()
+        cursor = self.conn.cursor()
+        for position, key in self.conn.execute("SELECT position, key FROM keys \
+ORDER BY position"):
+            cursor.execute("SELECT value FROM spilled_values WHERE position = ? ORDER BY rowid",
+                           (position,))
+            yield key, [pickle.loads(value) for (value,) in cursor]
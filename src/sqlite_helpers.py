@@ -0,0 +1,241 @@
+"""
+Provides inspection of SQLite schemas and query plans, and the planning of
+the GA cookie queries made on a Firefox cookie database
+"""
+
+import re
+
+# Matches a query plan step which reads every row of a table in rowid order,
+# rather than searching it or reading it through an index
+TABLE_SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+
+# Name of the temporary table of GA cookies, see GAQueryPlanner
+GA_TABLE = "ga_cookies"
+
+# Each query used by Firefox3Fetcher, as (query on moz_cookies, the same
+# query on the GA table). {names} is replaced with a parameter for each
+# cookie name. Queries whose order isn't fixed by an ORDER BY give rows in
+# the order moz_cookies is scanned in, which is rowid order, so the same
+# query on the GA table, whose id is the moz_cookies rowid, is ordered by id
+QUERIES = {
+    "domains": ("SELECT DISTINCT host FROM moz_cookies WHERE name IN ({names})",
+                "SELECT host FROM temp.ga_cookies GROUP BY host ORDER BY MIN(id)"),
+    "domain_page": ("SELECT DISTINCT host FROM moz_cookies WHERE name IN ({names}) \
+LIMIT ? OFFSET ?",
+                    "SELECT host FROM temp.ga_cookies GROUP BY host ORDER BY MIN(id) \
+LIMIT ? OFFSET ?"),
+    "first_sorted_domains": ("SELECT DISTINCT host FROM moz_cookies WHERE name IN ({names}) \
+ORDER BY host LIMIT ? OFFSET ?",
+                             "SELECT DISTINCT host FROM temp.ga_cookies \
+ORDER BY host LIMIT ? OFFSET ?"),
+    "next_sorted_domains": ("SELECT DISTINCT host FROM moz_cookies WHERE name IN ({names}) \
+AND host > ? ORDER BY host LIMIT ?",
+                            "SELECT DISTINCT host FROM temp.ga_cookies WHERE host > ? \
+ORDER BY host LIMIT ?"),
+    "domain_count": ("SELECT COUNT(*) FROM (SELECT DISTINCT host FROM moz_cookies \
+WHERE name IN ({names}))",
+                     "SELECT COUNT(*) FROM (SELECT DISTINCT host FROM temp.ga_cookies)"),
+    "domain_info": ("SELECT name,value FROM moz_cookies WHERE name IN ({names}) AND host = ?",
+                    "SELECT name, value FROM temp.ga_cookies WHERE host = ? ORDER BY id"),
+    "cookies": ("SELECT host, {creation_time}, value FROM moz_cookies WHERE name = ?",
+                "SELECT host, creationTime, value FROM temp.ga_cookies WHERE name = ? \
+ORDER BY id"),
+    "cookie_count": ("SELECT COUNT(host) FROM moz_cookies WHERE name IN ({names})",
+                     "SELECT COUNT(host) FROM temp.ga_cookies"),
+    "row_count": ("SELECT COUNT(*) FROM moz_cookies WHERE name IN ({names})",
+                  "SELECT COUNT(*) FROM temp.ga_cookies"),
+    "all_cookies": ("SELECT name, host, {creation_time}, value FROM moz_cookies WHERE \
+name IN ({names})",
+                    "SELECT name, host, creationTime, value FROM temp.ga_cookies ORDER BY id"),
+    "cookie_chunks": ("SELECT rowid, name, host, {creation_time}, value FROM moz_cookies \
+WHERE name IN ({names}) LIMIT -1 OFFSET ?",
+                      "SELECT id, name, host, creationTime, value FROM temp.ga_cookies \
+ORDER BY id LIMIT -1 OFFSET ?"),
+    "hosts": ("SELECT host FROM moz_cookies WHERE name IN ({names})",
+              "SELECT host FROM temp.ga_cookies ORDER BY id"),
+    # NOT INDEXED, as otherwise SQLite reads every GA cookie through the
+    # index on name rather than finding the block's rows by their rowid
+    "sample_block": ("SELECT rowid, name, host, {creation_time}, value FROM moz_cookies \
+NOT INDEXED WHERE name IN ({names}) AND rowid BETWEEN ? AND ?",
+                     "SELECT id, name, host, creationTime, value FROM temp.ga_cookies \
+WHERE id BETWEEN ? AND ? ORDER BY id")}
+
+# Example parameters for each query's extra parameters, used when asking
+# SQLite for its plan
+PLAN_PARAMETERS = {"domain_page": [-1, 0],
+                   "first_sorted_domains": [1, 0],
+                   "next_sorted_domains": ["", 1],
+                   "domain_info": [""],
+                   "cookies": [""],
+                   "cookie_chunks": [0],
+                   "sample_block": [0, 0]}
+
+# Columns of moz_cookies which every query needs
+REQUIRED_COLUMNS = ["name", "host", "value"]
+
+# Queries which read every GA cookie once, which are only worth running on
+# the GA table if it has already been made
+SINGLE_PASS_QUERIES = ["all_cookies", "cookie_chunks", "hosts"]
+
+class CookieSchema:
+    """
+    The layout of a Firefox moz_cookies table, which has changed between
+    Firefox versions, where columns is {column name: declared type}
+    """
+    def __init__(self, columns):
+        self.columns = columns
+
+        # Before creationTime was added, the id of each cookie was its
+        # creation time
+        self.creation_time_column = "creationTime"
+        if "creationTime" not in columns and "id" in columns:
+            self.creation_time_column = "id"
+
+    def get_missing_columns(self):
+        """
+        Return a list of the columns the queries need which the table
+        doesn't have
+        """
+        return [column for column in REQUIRED_COLUMNS + [self.creation_time_column]
+                if column not in self.columns]
+
+def detect_schema(conn):
+    """
+    Return the CookieSchema of the moz_cookies table
+    """
+    return CookieSchema(get_column_types(conn, "moz_cookies"))
+
+def get_statements(schema, name_count):
+    """
+    Return {query name: (query on moz_cookies, query on the GA table)} for
+    the schema and number of cookie names
+    """
+    question_marks = ",".join(["?"]*name_count)
+    return {name: (queries[0].format(names=question_marks,
+                                     creation_time=schema.creation_time_column),
+                   queries[1])
+            for name, queries in QUERIES.items()}
+
+def get_column_types(conn, table):
+    """
+    Return a dict of {column name: declared type} for the table
+    """
+    return {row[1]: row[2] for row in conn.execute("PRAGMA table_info({})".format(
+        quote_identifier(table)))}
+
+def quote_identifier(name):
+    """
+    Return name quoted for use as an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+def get_query_plan(conn, sql, parameters=()):
+    """
+    Return the list of steps SQLite plans to take to run the query
+    """
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+
+def scans_table(plan, table):
+    """
+    Return whether the query plan reads every row of the table without an
+    index
+    """
+    for step in plan:
+        match = TABLE_SCAN_PATTERN.match(step)
+        if match is not None and match.group(1) == table:
+            return True
+    return False
+
+class GAQueryPlanner:
+    """
+    Chooses, for each query in QUERIES, whether to run it on moz_cookies or
+    on a temporary table holding only the GA cookies.
+
+    Firefox databases don't always have an index which the queries can use,
+    in which case every query reads the whole of moz_cookies. The plan of
+    each query is checked with EXPLAIN QUERY PLAN, and the queries which
+    would scan the whole table are run instead on the GA table, which is
+    made on first use with indexes on (name) and (host, name). Queries which
+    read moz_cookies through an index are left as they are. The GA table
+    keeps each cookie's rowid as its id so that every query gives the same
+    rows in the same order either way.
+
+    Queries which only read the cookies once anyway, such as for an export,
+    only use the GA table if it has already been made, since making it would
+    read the cookies once more.
+    """
+    def __init__(self, conn, cookie_names, schema):
+        self.conn = conn
+        self.cookie_names = list(cookie_names)
+        self.schema = schema
+
+        self.statements = get_statements(schema, len(self.cookie_names))
+
+        # {query name: whether it would scan the whole of moz_cookies}
+        self.scans = {}
+
+        self.ga_table_made = False
+
+    def needs_ga_table(self, query):
+        """
+        Return whether running the query on moz_cookies would read the whole
+        table
+        """
+        if query not in self.scans:
+            parameters = self.get_parameters(query, PLAN_PARAMETERS.get(query, []))
+            plan = get_query_plan(self.conn, self.statements[query][0], parameters)
+            self.scans[query] = scans_table(plan, "moz_cookies")
+        return self.scans[query]
+
+    def get_parameters(self, query, parameters):
+        """
+        Return the full list of parameters of the query on moz_cookies
+        """
+        if query == "cookies":
+            return list(parameters)
+        return self.cookie_names + list(parameters)
+
+    def make_ga_table(self):
+        """
+        Copy the GA cookies into the GA table and index it, if that hasn't
+        already been done
+        """
+        if self.ga_table_made:
+            return
+
+        # The same declared types, so that values are stored unchanged
+        columns = {"name": "name",
+                   "host": "host",
+                   "creationTime": self.schema.creation_time_column,
+                   "value": "value"}
+
+        self.conn.execute("CREATE TEMP TABLE {} (id INTEGER PRIMARY KEY, {})".format(
+            GA_TABLE, ", ".join("{} {}".format(column, self.schema.columns[source])
+                                for column, source in columns.items())))
+        self.conn.execute("INSERT INTO temp.{} SELECT rowid, {} FROM moz_cookies WHERE \
+name IN ({})".format(GA_TABLE, ", ".join(columns.values()),
+                     ",".join(["?"]*len(self.cookie_names))),
+                          self.cookie_names)
+        self.conn.execute("CREATE INDEX temp.{0}_name ON {0} (name)".format(GA_TABLE))
+        self.conn.execute("CREATE INDEX temp.{0}_host_name ON {0} (host, name)".format(GA_TABLE))
+        self.conn.commit()
+
+        self.ga_table_made = True
+
+    def execute(self, cursor, query, parameters=()):
+        """
+        Run one of QUERIES with the given extra parameters on whichever
+        table is best, and return the cursor
+        """
+        if query in SINGLE_PASS_QUERIES:
+            use_ga_table = self.ga_table_made
+        elif query == "cookies" and parameters[0] not in self.cookie_names:
+            use_ga_table = False # Not a cookie the GA table holds
+        else:
+            use_ga_table = self.needs_ga_table(query)
+
+        if use_ga_table:
+            self.make_ga_table()
+            return cursor.execute(self.statements[query][1], parameters)
+
+        return cursor.execute(self.statements[query][0], self.get_parameters(query, parameters))
@@ -0,0 +1,28 @@
+"""
+Fixtures shared by the tests
+"""
+
+import random
+
+import pytest
+
+import generator_helpers
+
+@pytest.fixture(scope="module")
+def paths(request, tmp_path_factory):
+    """
+    Write ROWS cookies, generated with the random seed SEED of the test
+    module, as a Firefox database, a .csv file and a gzipped .csv file, and
+    return their paths
+    """
+    directory = tmp_path_factory.mktemp(request.module.__name__)
+    rng = random.Random(request.module.SEED)
+    cookies = generator_helpers.generate_cookies(rng, request.module.ROWS)
+
+    paths = {"firefox.3+": str(directory / "cookies.sqlite"),
+             "csv": str(directory / "cookies.csv"),
+             "csv gzip": str(directory / "cookies.csv.gz")}
+    generator_helpers.write_firefox(paths["firefox.3+"], cookies)
+    generator_helpers.write_csv(paths["csv"], cookies)
+    generator_helpers.gzip_file(paths["csv"], paths["csv gzip"])
+    return paths
@@ -0,0 +1,176 @@
+"""
+Helpers shared by the tests, which generate randomised and adversarial
+cookie stores, write them as each kind of input file, and compare the
+outputs of fetchers
+"""
+
+import csv
+import gzip
+import shutil
+import sqlite3
+
+import pytest
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# The schema of moz_cookies in a current Firefox profile
+FIREFOX_SCHEMA = """CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, baseDomain TEXT,
+originAttributes TEXT NOT NULL DEFAULT '', name TEXT, value TEXT, host TEXT, path TEXT,
+expiry INTEGER, lastAccessed INTEGER, creationTime INTEGER, isSecure INTEGER,
+isHttpOnly INTEGER, inBrowserElement INTEGER DEFAULT 0, sameSite INTEGER DEFAULT 0,
+rawSameSite INTEGER DEFAULT 0,
+CONSTRAINT moz_uniqueid UNIQUE (name, host, path, originAttributes))"""
+
+# Cookie names which are not GA cookies, some of which contain a GA cookie
+# name so that they are found by a plain text search
+NOISE_NAMES = ["_gid", "_gat", "__utmc", "_ga_1A2B3C", "session", "__utmzz", "ga"]
+
+# Epoch time fields which parse differently: not numbers, numbers which
+# float() accepts unexpectedly, NaN, and times gmtime rejects with an OSError
+ODD_EPOCHS = ["", "abc", "nan", "-1", "0", "1e17", "-1e17", "-1e12", "1e11", " 1567201232 ",
+              "1_567_201_232", "0x10", "1567201232.999999", "١٥٦٧", "<not found>"]
+
+# __utmz campaign fields, including malformed key-value pairs
+CAMPAIGNS = ["utmcsr=google|utmccn=(organic)|utmcmd=organic|utmctr=cookie parser",
+             "utmcsr=(direct)|utmccn=(direct)|utmcmd=(none)",
+             "utmcsr=news.example.com|utmccn=(referral)|utmcmd=referral|utmcct=/a.html",
+             "utmcsr", "utmcsr=", "utmcsr=a=b|utmctr==", "=|==|", "|||", "utmctr=a|utmctr=b",
+             "utmcsr=café|utmctr=東京", ""]
+
+# Hosts which are unusual, but which a cookie file might hold
+ODD_HOSTS = ["", "localhost", ".bücher.de", ".a,b.com", "\"quoted\".com", ".example.com ",
+             "192.168.0.1", ".مثال.com"]
+
+def random_epoch(rng):
+    """
+    Return an epoch time field, usually a plausible one
+    """
+    if rng.random() < 0.2:
+        return rng.choice(ODD_EPOCHS)
+    return str(rng.randint(0, 2**31))
+
+def random_number(rng):
+    """
+    Return a count field, usually a small number
+    """
+    return rng.choice([str(rng.randint(0, 50)), "10", "", "x", "-3", "1.5"])
+
+def random_value(rng, name):
+    """
+    Return a cookie value for the given cookie name, which is often missing
+    fields, has extra fields or has no dots at all
+    """
+    if name == "_ga":
+        parts = ["GA1", str(rng.randint(1, 4)), str(rng.randint(0, 2**31)), random_epoch(rng)]
+    elif name == "__utma":
+        parts = [str(rng.randint(0, 2**31)), str(rng.randint(0, 2**31)), random_epoch(rng),
+                 random_epoch(rng), random_epoch(rng), random_number(rng)]
+    elif name == "__utmb":
+        parts = [str(rng.randint(0, 2**31)), random_number(rng), random_number(rng),
+                 random_epoch(rng)]
+    elif name == "__utmz":
+        parts = [str(rng.randint(0, 2**31)), random_epoch(rng), random_number(rng),
+                 random_number(rng), rng.choice(CAMPAIGNS)]
+    else:
+        parts = [str(rng.randint(0, 2**31)) for _ in range(rng.randint(1, 4))]
+
+    damage = rng.random()
+    if damage < 0.05:
+        return rng.choice(["", "GA1", "no dots here", "éè", "1,2", "\"quoted\""])
+    if damage < 0.1:
+        parts = parts[:rng.randint(1, len(parts))] # Missing fields
+    elif damage < 0.15:
+        parts = parts + [random_epoch(rng) for _ in range(rng.randint(1, 3))] # Extra fields
+
+    return ".".join(parts)
+
+def random_creation_time(rng):
+    """
+    Return a Firefox creationTime in microseconds, or an odd value which a
+    damaged or hand-edited database might hold
+    """
+    if rng.random() < 0.05:
+        return rng.choice(["abc", "", 1.5, 0, -1, 1e23, "1567201232000000"])
+    return rng.randint(10**15, 2 * 10**15)
+
+def generate_cookies(rng, count):
+    """
+    Return a list of (name, host, creation time, value) for count generated
+    cookies, most of them GA cookies
+    """
+    hosts = [".site{}.example.com".format(index) for index in range(max(count // 5, 1))]
+    hosts += ODD_HOSTS
+
+    cookies = []
+    for _ in range(count):
+        name = rng.choice(COOKIES) if rng.random() < 0.8 else rng.choice(NOISE_NAMES)
+        host = rng.choice(ODD_HOSTS) if rng.random() < 0.02 else rng.choice(hosts)
+        cookies.append((name, host, random_creation_time(rng), random_value(rng, name)))
+    return cookies
+
+def write_firefox(path, cookies, schema=FIREFOX_SCHEMA):
+    """
+    Write the cookies to a Firefox cookies.sqlite database at path, whose
+    moz_cookies table is made with the given schema
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(schema)
+    conn.executemany("INSERT INTO moz_cookies (name, host, path, creationTime, value) \
+VALUES (?, ?, ?, ?, ?)", [(name, host, "/{}".format(index), creation_time, value)
+                          for index, (name, host, creation_time, value) in enumerate(cookies)])
+    conn.commit()
+    conn.close()
+
+def write_csv(path, cookies):
+    """
+    Write the cookies to a .csv file at path, in the layout of a cookie
+    export tool, with creation times in seconds
+    """
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Host", "Name", "Value", "Path", "Creation Time"])
+        for name, host, creation_time, value in cookies:
+            if isinstance(creation_time, int):
+                creation_time = creation_time // 1000000
+            elif isinstance(creation_time, float):
+                creation_time = creation_time / 1000000
+            writer.writerow([host, name, value, "/", creation_time])
+
+def gzip_file(source, destination):
+    """
+    Write a gzip-compressed copy of the file at source to destination
+    """
+    with open(source, "rb") as infile, gzip.open(destination, "wb") as outfile:
+        shutil.copyfileobj(infile, outfile)
+
+def outcome(function, *args):
+    """
+    Return ("ok", result) or, if the function raised, ("error", exception
+    type), so that engines can be checked to fail in the same way
+    """
+    try:
+        return ("ok", function(*args))
+    except Exception as error: # pylint: disable=broad-except
+        return ("error", type(error))
+
+def snapshot(fetcher, domains):
+    """
+    Return every output of the fetcher, for comparison with the reference
+    """
+    result = {"count": outcome(fetcher.get_cookie_count),
+              "domains": outcome(lambda: sorted(fetcher.get_domains(),
+                                                key=lambda host: (host is not None, host)))}
+    for cookie_name in COOKIES:
+        result[cookie_name] = outcome(fetcher.get_cookies, cookie_name)
+    for domain in domains:
+        result["info {}".format(domain)] = outcome(fetcher.get_domain_info, domain)
+    return result
+
+def assert_same(result, expected):
+    """
+    Assert two snapshots are the same, naming the first output which isn't
+    """
+    assert(sorted(result) == sorted(expected))
+    for key in expected:
+        if result[key] != expected[key]:
+            pytest.fail("{} differs from the reference implementation".format(key))
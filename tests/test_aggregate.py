@@ -0,0 +1,64 @@
+"""
+Tests that the one-pass aggregate report agrees with the per-domain and
+per-cookie outputs of the fetchers
+"""
+
+import os.path
+
+import aggregate_helpers
+import cookie_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def test_aggregate_report():
+    parser = cookie_parser.get_cookie_fetcher("csv", os.path.join("tests", "firefox.csv"), COOKIES)
+
+    report = aggregate_helpers.aggregate(parser, top_n=1, bucket="year")
+
+    assert(report["total_cookies"] == parser.get_cookie_count())
+    assert(abs(report["domain_count"] - len(parser.get_domains())) <= report["domain_error"])
+    assert(report["cookie_counts"] == {"_ga": 2, "__utma": 1, "__utmb": 1, "__utmz": 1})
+
+    assert(report["top_hosts_utma"] == [(1, ".testdomain.com")])
+    assert(report["top_hosts_utmz"] == [(1, ".testdomain.com")])
+    assert(report["top_visit_sources"] == [("visit_source", 1)])
+    assert(report["top_search_terms"] == [("search_query", 1)])
+
+    assert(report["first_visit_range"] == ["2017-07-14 02:40:00Z", "2019-08-30 21:40:32Z"])
+    assert(report["recent_visit_range"] == ["2019-09-20 17:31:57Z", "2019-09-20 17:31:57Z"])
+    assert(report["first_visit_histogram"] == [("2017", 1), ("2019", 1)])
+
+def test_top_hosts_and_bad_values():
+    aggregator = aggregate_helpers.CookieAggregator(top_n=2)
+
+    for host, visits in [("a", "3"), ("b", "not a number"), ("c", "7"), ("d", "5")]:
+        aggregator.add("__utma", host, None, "1.2.3.4.5.{}".format(visits))
+    aggregator.add("_ga", "e", None, "GA1.2.3.1e30")
+
+    report = aggregator.report()
+
+    assert(report["top_hosts_utma"] == [(7, "c"), (5, "d")])
+    assert(report["first_visit_range"] == ["<not found>", "<not found>"])
+    assert(report["recent_visit_range"] == ["1970-01-01 00:00:05Z", "1970-01-01 00:00:05Z"])
+
+def test_top_hosts_once_each():
+    aggregator = aggregate_helpers.CookieAggregator(top_n=3)
+
+    # a has several cookies, which only count once, with the most visits
+    for host, visits in [("a", 9), ("a", 8), ("b", 4), ("a", 12), ("c", 6), ("d", 2),
+                         ("b", 10), ("e", 5), ("d", 7)]:
+        aggregator.add("__utma", host, None, "1.2.3.4.5.{}".format(visits))
+
+    report = aggregator.report()
+    assert(report["top_hosts_utma"] == [(12, "a"), (10, "b"), (7, "d")])
+
+def test_domain_count_estimate():
+    aggregator = aggregate_helpers.CookieAggregator()
+
+    # Each domain has several cookies, which only count once
+    for index in range(60000):
+        aggregator.add("_ga", ".site{}.example.com".format(index % 20000), None, "GA1.2.3.4")
+
+    report = aggregator.report()
+    assert(abs(report["domain_count"] - 20000) <= report["domain_error"])
+    assert(0 < report["domain_error"] < 20000 * 0.02)
@@ -0,0 +1,143 @@
+"""
+Tests that the caching facade gives the same results as the fetcher it
+wraps, reads the file as few times as possible and notices when it changes
+"""
+
+import collections
+import os
+import os.path
+import shutil
+import sqlite3
+
+import pytest
+
+import cache_helpers
+import cookie_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def count_passes(monkeypatch):
+    """
+    Return a list which gets an item for every pass over a .csv file
+    """
+    passes = []
+    iter_ga_rows = cookie_parser.CSVFetcher.iter_ga_rows
+
+    def counted(self):
+        passes.append(self.file_path)
+        return iter_ga_rows(self)
+
+    monkeypatch.setattr(cookie_parser.CSVFetcher, "iter_ga_rows", counted)
+    return passes
+
+def test_csv_single_pass(tmp_path, monkeypatch):
+    path = str(tmp_path / "cookies.csv")
+    shutil.copy(os.path.join("tests", "firefox.csv"), path)
+
+    plain = cookie_parser.get_cookie_fetcher("csv", path, COOKIES)
+    expected = (plain.get_domains(), plain.get_cookie_count(), plain.get_domain_count(),
+                list(plain.iter_domains()))
+    expected_info = plain.get_domain_info(expected[3][0])
+
+    passes = count_passes(monkeypatch)
+    cached = cache_helpers.CachedFetcher("csv", path, COOKIES)
+
+    # In the order the GUI asks for them
+    domains = list(cached.iter_domains())
+    result = (cached.get_domains(), cached.get_cookie_count(), cached.get_domain_count(), domains)
+    assert(result == expected)
+    assert(len(passes) == 1)
+
+    assert(cached.get_domain_info(domains[0]) == expected_info)
+    assert(cached.get_domain_info(domains[0]) == expected_info)
+    assert(len(passes) == 2)
+
+def test_file_changes(tmp_path):
+    path = str(tmp_path / "cookies.csv")
+    shutil.copy(os.path.join("tests", "firefox.csv"), path)
+
+    cached = cache_helpers.CachedFetcher("csv", path, COOKIES)
+    count = cached.get_cookie_count()
+    info = cached.get_domain_info(".newdomain.com")
+
+    with open(path, "a") as csv_file:
+        csv_file.write(".newdomain.com,_ga,GA1.2.3.1567201232,/,1567201232\n")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert(cached.get_cookie_count() == count + 1)
+    assert(".newdomain.com" in cached.get_domains())
+    assert(cached.get_domain_info(".newdomain.com") != info)
+
+def test_firefox(monkeypatch):
+    path = os.path.join("tests", "firefox.sqlite")
+    plain = cookie_parser.get_cookie_fetcher("firefox.3+", path, COOKIES)
+    cached = cache_helpers.get_cached_fetcher("firefox.3+", path, COOKIES)
+    assert(cache_helpers.get_cached_fetcher("firefox.3+", os.path.abspath(path),
+                                            COOKIES) is cached)
+
+    assert(cached.get_domains() == plain.get_domains())
+    assert(cached.get_cookie_count() == plain.get_cookie_count())
+    assert(cached.get_domain_count() == plain.get_domain_count())
+    assert(cached.get_cookies("_ga") == plain.get_cookies("_ga"))
+    assert(cached.browser == "firefox.3+" and cached.error is None)
+
+    lookups = []
+    monkeypatch.setattr(cookie_parser.Firefox3Fetcher, "get_domain_info",
+                        lambda self, domain: lookups.append(domain) or {"domain": domain})
+    for domain in [".a.com", ".b.com", ".a.com"]:
+        assert(cached.get_domain_info(domain) == {"domain": domain})
+    assert(lookups == [".a.com", ".b.com"])
+
+    # The callback is passed on to the wrapped fetcher
+    reports = []
+    cached.progress_callback = reports.append
+    cookies = list(cached.iter_cookies())
+    assert(sum(reports) == cached.get_progress_total()[0] == len(cookies))
+    cached.progress_callback = None
+
+def test_fetchers_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_helpers, "FETCHERS", collections.OrderedDict())
+    monkeypatch.setattr(cache_helpers, "FETCHER_CACHE_SIZE", 2)
+
+    paths = []
+    for number in range(3):
+        path = str(tmp_path / "cookies{}.sqlite".format(number))
+        shutil.copy(os.path.join("tests", "firefox.sqlite"), path)
+        paths.append(path)
+
+    first = cache_helpers.get_cached_fetcher("firefox.3+", paths[0], COOKIES)
+    domains = first.get_domains()
+    second = cache_helpers.get_cached_fetcher("firefox.3+", paths[1], COOKIES)
+
+    # Using the first fetcher again makes the second the least recently used
+    assert(cache_helpers.get_cached_fetcher("firefox.3+", paths[0], COOKIES) is first)
+    wrapped = second.fetcher
+    cache_helpers.get_cached_fetcher("firefox.3+", paths[2], COOKIES)
+
+    assert(len(cache_helpers.FETCHERS) == 2)
+    assert(cache_helpers.get_cached_fetcher("firefox.3+", paths[0], COOKIES) is first)
+    assert(second.fetcher is None)
+    with pytest.raises(sqlite3.ProgrammingError):
+        wrapped.conn.execute("SELECT 1")
+
+    # An evicted fetcher opens the file again if it is still used
+    assert(second.get_domains() == domains)
+
+def test_fetcher_with_error_not_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_helpers, "FETCHERS", collections.OrderedDict())
+
+    path = str(tmp_path / "cookies.sqlite")
+    with open(path, "w") as broken_file:
+        broken_file.write("not a database")
+
+    broken = cache_helpers.get_cached_fetcher("firefox.3+", path, COOKIES)
+    assert(broken.error is not None)
+    assert(not cache_helpers.FETCHERS)
+
+    # Once the file is fixed, it is opened again
+    os.remove(path)
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), path)
+    fixed = cache_helpers.get_cached_fetcher("firefox.3+", path, COOKIES)
+    assert(fixed is not broken and fixed.error is None)
+    assert(cache_helpers.get_cached_fetcher("firefox.3+", path, COOKIES) is fixed)
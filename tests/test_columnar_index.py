@@ -0,0 +1,74 @@
+"""
+Tests that an index gives exactly the same output as the cookie store it
+was written from
+"""
+
+import math
+import os.path
+
+import pytest
+
+import columnar_index
+import cookie_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+@pytest.mark.parametrize("browser,filename", [("firefox.3+", "firefox.sqlite"),
+                                              ("csv", "firefox.csv")])
+def test_index_matches_source(tmp_path, browser, filename):
+    source = cookie_parser.get_cookie_fetcher(browser, os.path.join("tests", filename), COOKIES)
+    path = str(tmp_path / "cookies.gacpidx")
+
+    assert(columnar_index.write_index(source, path, COOKIES) == source.get_cookie_count())
+
+    parser = cookie_parser.get_cookie_fetcher("index", path, COOKIES)
+
+    assert(parser.error == None)
+    assert(sorted(parser.get_domains()) == sorted(source.get_domains()))
+    assert(parser.get_cookie_count() == source.get_cookie_count())
+    if browser == "firefox.3+": # csv creation times are stored as numbers
+        assert(list(parser.iter_cookies()) == list(source.iter_cookies()))
+    for domain in source.get_domains() + [".missing.com"]:
+        assert(parser.get_domain_info(domain) == source.get_domain_info(domain))
+    for cookie_name in COOKIES:
+        assert(parser.get_cookies(cookie_name) == source.get_cookies(cookie_name))
+
+def test_index_subset_and_columns(tmp_path):
+    source = cookie_parser.get_cookie_fetcher("csv", os.path.join("tests", "firefox.csv"), COOKIES)
+    path = str(tmp_path / "cookies.gacpidx")
+    columnar_index.write_index(source, path, COOKIES)
+
+    parser = cookie_parser.get_cookie_fetcher("index", path, ["_ga"])
+    assert(parser.get_cookie_count() == 2)
+    assert(sorted(parser.get_domains()) == [".other.net", ".testdomain.com"])
+    assert(parser.get_domain_info(".testdomain.com") ==
+           {"time_first_visit": "2019-08-30 21:40:32Z", "value_client_identifier": "974259038"})
+
+    full = cookie_parser.get_cookie_fetcher("index", path, COOKIES)
+    names = [name for name, _, _, _ in full.iter_cookies()]
+    visits = list(full.column("visits"))
+    first_visits = list(full.column("time_first_visit"))
+
+    assert(visits[names.index("__utma")] == 1)
+    assert(visits[names.index("_ga")] == columnar_index.MISSING)
+    assert(sorted(time for time in first_visits if time != columnar_index.MISSING) ==
+           [1500000000, 1567201232])
+
+def test_index_keeps_unparsable_creation_times(tmp_path):
+    path = tmp_path / "odd.csv"
+    path.write_text("Host,Name,Value,Creation Time\n"
+                    ".a.com,_ga,GA1.2.3.4,not a time\n"
+                    ".a.com,_ga,GA1.2.3.4,nan\n")
+    source = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES)
+
+    index_path = str(tmp_path / "odd.gacpidx")
+    columnar_index.write_index(source, index_path, COOKIES)
+    parser = cookie_parser.get_cookie_fetcher("index", index_path, COOKIES)
+
+    assert(parser.get_cookies("_ga") == source.get_cookies("_ga"))
+    assert(math.isnan(parser.column("creation_time")[0]))
+
+def test_not_an_index():
+    parser = cookie_parser.get_cookie_fetcher("index", os.path.join("tests", "firefox.csv"),
+                                              COOKIES)
+    assert(parser.error == "The selected file is not a GA cookie index")
@@ -0,0 +1,103 @@
+"""
+Tests that compressed cookie files give the same output as the files
+they were compressed from
+"""
+
+import gzip
+import lzma
+import os.path
+import random
+import shutil
+import zipfile
+
+import pytest
+
+import compression_helpers
+import cookie_parser
+import generator_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def compress(source, destination, compression):
+    """
+    Write the file at source to destination with the given compression
+    """
+    if compression == "gzip":
+        with open(source, "rb") as infile, gzip.open(destination, "wb") as outfile:
+            shutil.copyfileobj(infile, outfile)
+    elif compression == "xz":
+        with open(source, "rb") as infile, lzma.open(destination, "wb") as outfile:
+            shutil.copyfileobj(infile, outfile)
+    elif compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        with open(source, "rb") as infile, open(destination, "wb") as outfile:
+            zstandard.ZstdCompressor().copy_stream(infile, outfile)
+    elif compression == "zip":
+        with zipfile.ZipFile(destination, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("readme.txt", "Collected cookies")
+            archive.write(source, os.path.basename(source))
+
+def assert_same_output(parser, reference):
+    """
+    Check that two fetchers give the same output for every query
+    """
+    assert(parser.error == None)
+    assert(sorted(parser.get_domains()) == sorted(reference.get_domains()))
+    assert(parser.get_cookie_count() == reference.get_cookie_count())
+    assert(parser.get_domain_info(".testdomain.com") == reference.get_domain_info(".testdomain.com"))
+    for cookie_name in COOKIES:
+        assert(parser.get_cookies(cookie_name) == reference.get_cookies(cookie_name))
+
+@pytest.mark.parametrize("compression", ["gzip", "xz", "zstd", "zip"])
+@pytest.mark.parametrize("browser,filename", [("firefox.3+", "firefox.sqlite"),
+                                              ("csv", "firefox.csv")])
+def test_compressed_input(tmp_path, compression, browser, filename):
+    source = os.path.join("tests", filename)
+    compressed = str(tmp_path / "cookies.compressed")
+    compress(source, compressed, compression)
+
+    reference = cookie_parser.get_cookie_fetcher(browser, source, COOKIES)
+    parser = cookie_parser.get_cookie_fetcher(browser, compressed, COOKIES)
+
+    assert_same_output(parser, reference)
+
+def test_large_database_uses_temp_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(cookie_parser, "MAX_IN_MEMORY_SQLITE", 0)
+
+    source = os.path.join("tests", "firefox.sqlite")
+    compressed = str(tmp_path / "cookies.sqlite.gz")
+    compress(source, compressed, "gzip")
+
+    reference = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", compressed, COOKIES)
+
+    assert_same_output(parser, reference)
+
+def test_corrupt_compressed_input(tmp_path):
+    compressed = tmp_path / "cookies.csv.gz"
+    compressed.write_bytes(gzip.compress(b"Host,Name,Value,Creation Time\n")[:20])
+
+    parser = cookie_parser.get_cookie_fetcher("csv", str(compressed), COOKIES)
+
+    assert(parser.error.startswith("The selected file could not be decompressed"))
+
+@pytest.mark.parametrize("compression,filename", [("gzip", "cookies.csv.gz"),
+                                                  ("xz", "cookies.csv.xz")])
+def test_truncated_compressed_input(tmp_path, compression, filename):
+    # Large enough that only the start is read to find the layout
+    source = str(tmp_path / "cookies.csv")
+    cookies = generator_helpers.generate_cookies(random.Random(29), 5000)
+    generator_helpers.write_csv(source, cookies)
+    compressed = tmp_path / filename
+    compress(source, str(compressed), compression)
+
+    # The header can still be read, but the rest of the file is missing
+    data = compressed.read_bytes()
+    compressed.write_bytes(data[:len(data) * 2 // 3])
+
+    parser = cookie_parser.get_cookie_fetcher("csv", str(compressed), COOKIES)
+    assert(parser.error is None)
+    with pytest.raises(compression_helpers.CompressionError):
+        parser.get_cookie_count()
+    with pytest.raises(compression_helpers.CompressionError):
+        list(parser.iter_cookies())
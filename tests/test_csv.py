@@ -0,0 +1,83 @@
+"""
+Integration tests for CSVFetcher, checking that every scan mode gives the
+same output as the Firefox fetcher does for the same cookies
+"""
+
+import os.path
+
+import pytest
+
+import cookie_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+CSV_PATH = os.path.join("tests", "firefox.csv")
+
+@pytest.mark.parametrize("scan_mode", ["full", "mmap"])
+def test_csv_matches_firefox(scan_mode):
+    parser = cookie_parser.get_cookie_fetcher("csv", CSV_PATH, COOKIES, scan_mode=scan_mode)
+    firefox = cookie_parser.get_cookie_fetcher("firefox.3+",
+                                               os.path.join("tests", "firefox.sqlite"),
+                                               COOKIES)
+
+    assert(parser.error == None)
+
+    assert(sorted(parser.get_domains()) == [".other.net", ".testdomain.com"])
+    assert(parser.get_cookie_count() == 5)
+    assert(parser.get_domain_info(".testdomain.com") == firefox.get_domain_info(".testdomain.com"))
+
+    for cookie_name in COOKIES:
+        # The csv file also has a _ga cookie for .other.net
+        table = [row for row in parser.get_cookies(cookie_name) if row[0] != ".other.net"]
+        assert(table == firefox.get_cookies(cookie_name))
+
+def test_mmap_scan_quoted_newline(tmp_path):
+    # The second row's value contains a newline followed by what looks like
+    # a _ga row, which the mmap scan must not treat as a row of its own
+    path = tmp_path / "quoted.csv"
+    path.write_text('Host,Name,Value,Creation Time\n'
+                    '.a.com,note,"line one\n.b.com,_ga,GA1.2.3.4,5",1569000716\n'
+                    '.c.com,_ga,GA1.2.974259038.1567201232,1569000716\n')
+
+    expected = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES, scan_mode="full")
+    parser = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES, scan_mode="mmap")
+
+    assert(parser.find_candidate_lines() is None)
+    assert(parser.get_cookies("_ga") == expected.get_cookies("_ga"))
+    assert(parser.get_domains() == [".c.com"])
+
+def test_wide_header(tmp_path):
+    # A header row much longer than the first sniffing sample
+    padding = ",".join("Unused column {}".format(i) for i in range(300))
+    path = tmp_path / "wide.csv"
+    path.write_text("{},Host,Name,Value,Creation Time\n".format(padding) +
+                    "{},.c.com,_ga,GA1.2.974259038.1567201232,1569000716\n".format("," * 299))
+
+    parser = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES)
+
+    assert(parser.error == None)
+    assert(parser.get_domains() == [".c.com"])
+
+def test_explicit_layout(tmp_path):
+    # Neither the delimiter nor the column names can be detected
+    path = tmp_path / "explicit.csv"
+    path.write_text("a:b:c:d\n.c.com:_ga:GA1.2.974259038.1567201232:1569000716\n")
+
+    parser = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES, delimiter=":")
+    assert(parser.error == "Could not find the column headers: name, value, host, create_time")
+
+    columns = {"host": "A", "name": 1, "value": "c", "create_time": 3}
+    parser = cookie_parser.get_cookie_fetcher("csv", str(path), COOKIES,
+                                              delimiter=":", columns=columns)
+    assert(parser.error == None)
+    assert(parser.get_cookies("_ga")[1][:3] == [".c.com", "GA1.2.974259038.1567201232",
+                                                 "2019-09-20 17:31:56Z"])
+
+def test_layout_cache():
+    first = cookie_parser.get_cookie_fetcher("csv", CSV_PATH, COOKIES)
+    cached = len(cookie_parser.CSV_LAYOUT_CACHE)
+    second = cookie_parser.get_cookie_fetcher("csv", CSV_PATH, COOKIES)
+
+    assert(len(cookie_parser.CSV_LAYOUT_CACHE) == cached)
+    assert(first.csv_dialect is second.csv_dialect)
+    assert(first.header_indices == second.header_indices)
@@ -0,0 +1,205 @@
+"""
+Tests that duplicate cookies are left out of exports, across runs which
+share a dedup store, without ever dropping a distinct cookie
+"""
+
+import csv
+import hashlib
+import os.path
+import shutil
+import sqlite3
+
+import pytest
+
+import cookie_parser
+import dedup_helpers
+import export_helpers
+import general_helpers
+import generator_helpers
+import ingest_pipeline
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def read_rows(path):
+    with open(path, newline="") as csvfile:
+        return list(csv.reader(csvfile))
+
+def test_export_twice_with_store(tmp_path):
+    source = os.path.abspath(os.path.join("tests", "firefox.sqlite"))
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+    store = str(tmp_path / "store.sqlite")
+    first_dir = tmp_path / "first"
+    second_dir = tmp_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    export_helpers.export_csv(parser, str(first_dir), deduplicator=deduplicator, source=source)
+    deduplicator.close()
+
+    # The first export is the same as without deduplication
+    for cookie in COOKIES:
+        rows = read_rows(str(first_dir / general_helpers.COOKIE_FILENAMES[cookie]))
+        assert(rows == parser.get_cookies(cookie))
+    assert(read_rows(str(first_dir / general_helpers.DUPLICATES_FILENAME))[1:] == [])
+
+    # Reopening the store, every cookie is now a duplicate
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    export_helpers.export_csv(parser, str(second_dir), deduplicator=deduplicator, source=source)
+    assert(deduplicator.duplicate_count == parser.get_cookie_count())
+    deduplicator.close()
+
+    for cookie in COOKIES:
+        rows = read_rows(str(second_dir / general_helpers.COOKIE_FILENAMES[cookie]))
+        assert(rows == parser.get_cookies(cookie)[:1])
+
+    duplicates = read_rows(str(second_dir / general_helpers.DUPLICATES_FILENAME))[1:]
+    assert(len(duplicates) == parser.get_cookie_count())
+    assert(all(row[3] == source and row[4] == "1" for row in duplicates))
+
+def test_hash_collisions_keep_distinct_cookies(monkeypatch):
+    # Every cookie hashes the same, so only the exact comparison tells them apart
+    monkeypatch.setattr(dedup_helpers, "cookie_hash", lambda host, name, value: 42)
+
+    deduplicator = dedup_helpers.CookieDeduplicator(filter_bytes=8)
+    assert(not deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.4", "one"))
+    assert(not deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.5", "one"))
+    assert(not deduplicator.is_duplicate(".b.com", "_ga", "GA1.2.3.4", "one"))
+    assert(deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.4", "two"))
+    assert(list(deduplicator.iter_duplicated()) == [(".a.com", "_ga", "GA1.2.3.4", "one", 1)])
+    deduplicator.close()
+    assert(not os.path.exists(deduplicator.path))
+
+def test_ingest_dedup(tmp_path):
+    spool_dir = tmp_path / "spool"
+    output_dir = tmp_path / "output"
+    spool_dir.mkdir()
+    output_dir.mkdir()
+
+    # The same profile delivered twice
+    with open(os.path.join("tests", "firefox.sqlite"), "rb") as source:
+        data = source.read()
+    (spool_dir / "a.sqlite").write_bytes(data)
+    (spool_dir / "b.sqlite").write_bytes(data)
+
+    deduplicator = dedup_helpers.CookieDeduplicator()
+    ingest_pipeline.ingest_directory(str(spool_dir), str(output_dir), COOKIES,
+                                     deduplicator=deduplicator)
+    deduplicator.close()
+
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", os.path.join("tests", "firefox.sqlite"),
+                                              COOKIES)
+    assert(deduplicator.duplicate_count == parser.get_cookie_count())
+
+    # Either copy may be parsed first, but only one is written out
+    sources = set()
+    for cookie in COOKIES:
+        path = str(output_dir / general_helpers.COOKIE_FILENAMES[cookie])
+        if os.path.exists(path):
+            rows = read_rows(path)
+            assert(len(rows) == len(parser.get_cookies(cookie)))
+            sources.update(row[0] for row in rows[1:])
+    assert(len(sources) == 1)
+
+def test_failed_export_keeps_store_unchanged(tmp_path, monkeypatch):
+    source = os.path.abspath(os.path.join("tests", "firefox.sqlite"))
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+    store = str(tmp_path / "store.sqlite")
+
+    # The __utma writer fails once every cookie has been read
+    write = export_helpers.CookieFileWriter.write
+    def fail(self, raw_file):
+        write(self, raw_file)
+        if self.cookie_name == "__utma":
+            raise PermissionError(13, "Permission denied", self.path)
+    monkeypatch.setattr(export_helpers.CookieFileWriter, "write", fail)
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    with pytest.raises(PermissionError):
+        export_helpers.export_csv(parser, str(tmp_path), deduplicator=deduplicator,
+                                  source=source)
+    deduplicator.close()
+
+    # None of the cookies count as seen, so all are exported next time
+    monkeypatch.setattr(export_helpers.CookieFileWriter, "write", write)
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    export_helpers.export_csv(parser, str(tmp_path), deduplicator=deduplicator, source=source)
+    assert(deduplicator.duplicate_count == 0)
+    deduplicator.close()
+
+    for cookie in COOKIES:
+        rows = read_rows(str(tmp_path / general_helpers.COOKIE_FILENAMES[cookie]))
+        assert(rows == parser.get_cookies(cookie))
+
+def test_failed_ingest_write_keeps_store_unchanged(tmp_path, monkeypatch):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool_dir / "a.sqlite"))
+    store = str(tmp_path / "store.sqlite")
+
+    def fail(self, batch):
+        raise PermissionError("The output is locked")
+    monkeypatch.setattr(ingest_pipeline.SpoolIngester, "write_batch", fail)
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    with pytest.raises(PermissionError):
+        ingest_pipeline.ingest_directory(str(spool_dir), str(tmp_path), COOKIES,
+                                         deduplicator=deduplicator)
+    deduplicator.close()
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    assert(not deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.4"))
+    assert(deduplicator.conn.execute("SELECT COUNT(*) FROM cookies").fetchone()[0] == 1)
+    deduplicator.close()
+
+def test_null_fields():
+    deduplicator = dedup_helpers.CookieDeduplicator(filter_bytes=1024)
+    assert(not deduplicator.is_duplicate(None, "_ga", "GA1.2.3.4", "one"))
+    assert(not deduplicator.is_duplicate("", "_ga", "GA1.2.3.4", "one"))
+    assert(not deduplicator.is_duplicate(".a.com", "__utmz", None, "one"))
+    assert(not deduplicator.is_duplicate(".a.com", "__utmz", "", "one"))
+
+    # None only matches None, even though "" hashes the same way when joined
+    assert(deduplicator.is_duplicate(None, "_ga", "GA1.2.3.4", "two"))
+    assert(deduplicator.is_duplicate(".a.com", "__utmz", None, "two"))
+    assert(deduplicator.duplicate_count == 2)
+    assert(dedup_helpers.cookie_hash(None, "_ga", "x") != dedup_helpers.cookie_hash("", "_ga", "x"))
+    deduplicator.close()
+
+def test_store_of_old_hashes_is_rehashed(tmp_path):
+    store = str(tmp_path / "store.sqlite")
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.4", "one")
+    deduplicator.commit()
+    deduplicator.close()
+
+    # As a store written before the hashes changed
+    conn = sqlite3.connect(store)
+    old_hash = int.from_bytes(hashlib.blake2b(".a.com\0_ga\0GA1.2.3.4".encode("utf-8"),
+                                              digest_size=8).digest(), "little", signed=True)
+    conn.execute("UPDATE cookies SET hash = ?", (old_hash,))
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+    conn.close()
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store, filter_bytes=1024)
+    assert(deduplicator.is_duplicate(".a.com", "_ga", "GA1.2.3.4", "two"))
+    deduplicator.close()
+
+def test_export_with_null_fields(tmp_path):
+    source = str(tmp_path / "cookies.sqlite")
+    generator_helpers.write_firefox(source, [
+        ("_ga", None, 1567201232000000, "GA1.2.974259038.1567201232"),
+        ("_ga", "", 1567201232000000, "GA1.2.974259038.1567201232"),
+        ("__utmb", None, 1567201232000000, "1.2.3.4"),
+        ("__utmb", None, 1567201233000000, "1.2.3.4")])
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+
+    deduplicator = dedup_helpers.CookieDeduplicator(filter_bytes=1024)
+    export_helpers.export_csv(parser, str(tmp_path), deduplicator=deduplicator, source=source)
+    assert(deduplicator.duplicate_count == 1)
+    deduplicator.close()
+
+    # A NULL host isn't the same as an empty one
+    assert(len(read_rows(str(tmp_path / general_helpers.COOKIE_FILENAMES["_ga"]))) == 3)
+    assert(len(read_rows(str(tmp_path / general_helpers.COOKIE_FILENAMES["__utmb"]))) == 2)
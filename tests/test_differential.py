@@ -0,0 +1,202 @@
+"""
+Differential tests which generate randomised and adversarial cookie stores
+and check that every engine and mode gives exactly the same output as the
+frozen reference parser in reference_parser.py, recording the throughput of
+each engine as a property of its test. The properties are written to the
+report given with --junitxml, in the xunit1 format.
+
+The number of generated cookies and the random seed can be changed with the
+GACP_DIFFERENTIAL_ROWS and GACP_DIFFERENTIAL_SEED environment variables, so
+that the same tests can be run at a much larger scale, e.g.
+    GACP_DIFFERENTIAL_ROWS=1000000 python -m pytest tests --junitxml=report.xml \
+        -o junit_family=xunit1
+"""
+
+import csv
+import os
+import random
+import time
+
+import pytest
+
+import columnar_index
+import cookie_parser
+import export_helpers
+import general_helpers
+import generator_helpers
+import reference_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+ROWS = int(os.environ.get("GACP_DIFFERENTIAL_ROWS", "3000"))
+SEED = int(os.environ.get("GACP_DIFFERENTIAL_SEED", "20190920"))
+
+# Number of domains whose get_domain_info output is compared, as the
+# reference parser reads the whole file for every domain
+DOMAIN_SAMPLE_SIZE = 40
+
+# Epoch times which make gmtime raise an OverflowError, which the reference
+# parser does not catch
+OVERFLOW_EPOCHS = ["1e20", "inf", "-inf"]
+
+# Cookies with a NULL host, which a damaged Firefox database might hold
+NULL_HOST_COOKIES = [("_ga", None, 1567201232000000, "GA1.2.974259038.1567201232"),
+                     ("__utma", None, 1567201232000000, "1.2.3.1567201232.1567201233.4"),
+                     ("__utmb", None, 1567201232000000, "1.2.3.1567201232"),
+                     ("__utmz", None, 1567201232000000, "1.1567201232.1.1.utmcsr=google")]
+
+@pytest.fixture(scope="module")
+def dataset(tmp_path_factory):
+    """
+    Write the generated cookies as each kind of input file, and return their
+    paths, the domains to compare and the reference snapshots
+    """
+    directory = tmp_path_factory.mktemp("differential")
+    rng = random.Random(SEED)
+    cookies = generator_helpers.generate_cookies(rng, ROWS) + NULL_HOST_COOKIES
+
+    paths = {"sqlite": str(directory / "cookies.sqlite"),
+             "csv": str(directory / "cookies.csv")}
+    generator_helpers.write_firefox(paths["sqlite"], cookies)
+    generator_helpers.write_csv(paths["csv"], cookies)
+
+    domains = sorted({host for _, host, _, _ in cookies if host is not None})
+    domains = rng.sample(domains, min(DOMAIN_SAMPLE_SIZE, len(domains)))
+    domains += [host for host in generator_helpers.ODD_HOSTS if host not in domains]
+    domains += [".missing.example.com", None]
+
+    references = {"sqlite": reference_parser.Firefox3Fetcher(paths["sqlite"], COOKIES),
+                  "csv": reference_parser.CSVFetcher(paths["csv"], COOKIES)}
+    references = {source: generator_helpers.snapshot(reference, domains)
+                  for source, reference in references.items()}
+
+    return {"directory": directory, "paths": paths, "domains": domains,
+            "references": references}
+
+def open_engine(engine, dataset_info):
+    """
+    Return the fetcher for an engine and the source file type it is compared
+    against, preparing whatever file the engine reads
+    """
+    directory = dataset_info["directory"]
+    paths = dataset_info["paths"]
+
+    if engine == "firefox":
+        return cookie_parser.get_cookie_fetcher("firefox.3+", paths["sqlite"], COOKIES), "sqlite"
+    if engine == "firefox gzip":
+        compressed = str(directory / "cookies.sqlite.gz")
+        generator_helpers.gzip_file(paths["sqlite"], compressed)
+        return cookie_parser.get_cookie_fetcher("firefox.3+", compressed, COOKIES), "sqlite"
+    if engine in ["csv full", "csv mmap"]:
+        return cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES,
+                                                scan_mode=engine.split()[1]), "csv"
+    if engine == "csv gzip":
+        compressed = str(directory / "cookies.csv.gz")
+        generator_helpers.gzip_file(paths["csv"], compressed)
+        return cookie_parser.get_cookie_fetcher("csv", compressed, COOKIES), "csv"
+    if engine == "index":
+        index_path = str(directory / "cookies.gacpidx")
+        columnar_index.write_index(
+            cookie_parser.get_cookie_fetcher("firefox.3+", paths["sqlite"], COOKIES),
+            index_path, COOKIES)
+        return cookie_parser.get_cookie_fetcher("index", index_path, COOKIES), "sqlite"
+    raise ValueError(engine)
+
+ENGINES = ["firefox", "firefox gzip", "csv full", "csv mmap", "csv gzip", "index"]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_reference(dataset, record_property, engine):
+    fetcher, source = open_engine(engine, dataset)
+    assert(fetcher.error is None)
+
+    start = time.perf_counter()
+    result = generator_helpers.snapshot(fetcher, dataset["domains"])
+    elapsed = time.perf_counter() - start
+
+    # Every engine reads all of the cookies once per get_cookies call and
+    # once for each of the count and the domains
+    rows_per_second = ROWS * (len(COOKIES) + 2) / max(elapsed, 1e-9)
+    record_property("rows_per_second", round(rows_per_second))
+
+    generator_helpers.assert_same(result, dataset["references"][source])
+
+@pytest.mark.parametrize("source", ["sqlite", "csv"])
+def test_export_matches_reference(dataset, tmp_path, source):
+    paths = dataset["paths"]
+    if source == "sqlite":
+        fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", paths["sqlite"], COOKIES)
+    else:
+        fetcher = cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES)
+
+    export_helpers.export_csv(fetcher, str(tmp_path))
+
+    for cookie_name in COOKIES:
+        kind, table = dataset["references"][source][cookie_name]
+        assert(kind == "ok")
+
+        expected = tmp_path / "expected.csv"
+        with open(str(expected), "w", newline="\n") as csvfile:
+            writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerows(table)
+
+        path = tmp_path / general_helpers.COOKIE_FILENAMES[cookie_name]
+        assert(path.read_bytes() == expected.read_bytes())
+
+@pytest.mark.parametrize("engine", ["firefox", "csv full", "csv mmap"])
+@pytest.mark.parametrize("epoch", OVERFLOW_EPOCHS)
+def test_overflow_parity(tmp_path, engine, epoch):
+    # A time which gmtime can't represent at all makes the reference parser
+    # raise an OverflowError, which every engine has to do too rather than
+    # quietly giving different output
+    cookies = [("_ga", ".a.com", 1567201232000000, "GA1.2.974259038.1567201232"),
+               ("_ga", ".b.com", 1567201232000000, "GA1.2.974259038." + epoch),
+               ("__utmz", ".b.com", 1567201232000000, "1." + epoch + ".1.1.utmcsr=google")]
+    paths = {"sqlite": str(tmp_path / "cookies.sqlite"), "csv": str(tmp_path / "cookies.csv")}
+    generator_helpers.write_firefox(paths["sqlite"], cookies)
+    generator_helpers.write_csv(paths["csv"], cookies)
+
+    dataset_info = {"directory": tmp_path, "paths": paths}
+    fetcher, source = open_engine(engine, dataset_info)
+    if source == "sqlite":
+        reference = reference_parser.Firefox3Fetcher(paths["sqlite"], COOKIES)
+    else:
+        reference = reference_parser.CSVFetcher(paths["csv"], COOKIES)
+
+    domains = [".a.com", ".b.com"]
+    expected = generator_helpers.snapshot(reference, domains)
+    assert(expected["_ga"] == ("error", OverflowError))
+
+    generator_helpers.assert_same(generator_helpers.snapshot(fetcher, domains), expected)
+
+def test_null_creation_time_parity(tmp_path):
+    # The reference parser can't convert a NULL creationTime either
+    path = str(tmp_path / "cookies.sqlite")
+    generator_helpers.write_firefox(path, [("_ga", ".a.com", None, "GA1.2.974259038.1567201232")])
+
+    reference = reference_parser.Firefox3Fetcher(path, COOKIES)
+    expected = generator_helpers.snapshot(reference, [".a.com"])
+    assert(expected["_ga"] == ("error", TypeError))
+
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", path, COOKIES)
+    generator_helpers.assert_same(generator_helpers.snapshot(fetcher, [".a.com"]), expected)
+
+@pytest.mark.parametrize("engine", ["firefox", "index"])
+def test_null_host_and_value_parity(tmp_path, engine):
+    # A NULL value makes the reference parser fail for its cookie name,
+    # while a NULL host is a domain of its own
+    cookies = [("_ga", None, 1567201232000000, "GA1.2.974259038.1567201232"),
+               ("__utma", ".a.com", 1567201232000000, "1.2.3.4.5.6"),
+               ("__utmz", ".a.com", 1567201232000000, None),
+               ("__utmb", None, 1567201232000000, None)]
+    paths = {"sqlite": str(tmp_path / "cookies.sqlite")}
+    generator_helpers.write_firefox(paths["sqlite"], cookies)
+
+    domains = [".a.com", None]
+    reference = reference_parser.Firefox3Fetcher(paths["sqlite"], COOKIES)
+    expected = generator_helpers.snapshot(reference, domains)
+    assert(expected["__utmz"] == ("error", TypeError))
+    assert(expected["domains"] == ("ok", [None, ".a.com"]))
+
+    fetcher, _ = open_engine(engine, {"directory": tmp_path, "paths": paths})
+    generator_helpers.assert_same(generator_helpers.snapshot(fetcher, domains), expected)
+    assert(list(fetcher.iter_domains()) == [None, ".a.com"])
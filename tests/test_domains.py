@@ -0,0 +1,90 @@
+"""
+Tests that paging through the domains gives the same domains as
+get_domains, in order
+"""
+
+import os.path
+import random
+import sqlite3
+
+import pytest
+
+import columnar_index
+import cookie_parser
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def write_cookies(tmp_path, hosts):
+    """
+    Write one _ga cookie for each host, and a non-GA cookie, to both a
+    Firefox database and a .csv file, returning their paths
+    """
+    sqlite_path = str(tmp_path / "cookies.sqlite")
+    conn = sqlite3.connect(sqlite_path)
+    conn.execute("CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, name TEXT, value TEXT, \
+host TEXT, path TEXT, creationTime INTEGER)")
+    rows = [("_ga", "GA1.2.3.4", host, "/", 1567201232000000) for host in hosts]
+    rows.append(("session", "1", ".not-ga.com", "/", 0))
+    conn.executemany("INSERT INTO moz_cookies (name, value, host, path, creationTime) \
+VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    csv_path = tmp_path / "cookies.csv"
+    csv_path.write_text("Host,Name,Value,Creation Time\n" +
+                        "".join("{},{},{},{}\n".format(host, name, value, creation_time)
+                                for name, value, host, _, creation_time in rows))
+
+    return {"firefox.3+": sqlite_path, "csv": str(csv_path)}
+
+@pytest.fixture
+def fetchers(tmp_path, monkeypatch):
+    # Small pages, so that every query crosses several of them
+    monkeypatch.setattr(cookie_parser, "DOMAIN_PAGE_SIZE", 3)
+
+    rng = random.Random(36)
+    hosts = [".site{}.example.com".format(rng.randint(0, 50)) for _ in range(40)]
+    hosts += [".bücher.de", ".Upper.com", "localhost"]
+    paths = write_cookies(tmp_path, hosts)
+
+    fetchers = {browser: cookie_parser.get_cookie_fetcher(browser, path, COOKIES)
+                for browser, path in paths.items()}
+
+    index_path = str(tmp_path / "cookies.gacpidx")
+    columnar_index.write_index(fetchers["firefox.3+"], index_path, COOKIES)
+    fetchers["index"] = cookie_parser.get_cookie_fetcher("index", index_path, COOKIES)
+
+    return fetchers
+
+@pytest.mark.parametrize("browser", ["firefox.3+", "csv", "index"])
+def test_iter_domains(fetchers, browser):
+    fetcher = fetchers[browser]
+    domains = sorted(fetcher.get_domains())
+
+    assert(list(fetcher.iter_domains()) == domains)
+    assert(fetcher.get_domain_count() == len(domains))
+    assert(sorted(fetcher.iter_domains(sorted=False)) == domains)
+
+    for offset in [0, 1, 2, 3, 4, 10, len(domains) - 1, len(domains), len(domains) + 5]:
+        for limit in [None, 0, 1, 2, 3, 5, 100]:
+            end = None if limit is None else offset + limit
+            assert(list(fetcher.iter_domains(limit=limit, offset=offset)) == domains[offset:end])
+
+    unsorted = list(fetcher.iter_domains(sorted=False))
+    assert(list(fetcher.iter_domains(sorted=False, limit=4, offset=2)) == unsorted[2:6])
+
+def test_fixture_domains():
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+",
+                                              os.path.join("tests", "firefox.sqlite"), COOKIES)
+    assert(list(parser.iter_domains()) == sorted(parser.get_domains()))
+    assert(parser.get_domain_count() == len(parser.get_domains()))
+
+def test_null_host(tmp_path, monkeypatch):
+    monkeypatch.setattr(cookie_parser, "DOMAIN_PAGE_SIZE", 2)
+
+    path = write_cookies(tmp_path, [None, ".b.com", ".a.com", ".c.com"])["firefox.3+"]
+    parser = cookie_parser.get_cookie_fetcher("firefox.3+", path, COOKIES)
+
+    assert(list(parser.iter_domains()) == [None, ".a.com", ".b.com", ".c.com"])
+    assert(list(parser.iter_domains(offset=1)) == [".a.com", ".b.com", ".c.com"])
+    assert(parser.get_domain_count() == len(parser.get_domains()))
@@ -0,0 +1,76 @@
+"""
+Tests that the pipelined export writes exactly the same files as writing
+each get_cookies table with csv.writer
+"""
+
+import csv
+import gzip
+import os.path
+
+import pytest
+
+import cookie_parser
+import export_helpers
+import general_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def expected_files(parser, directory):
+    """
+    Write every cookie table the way exports were originally written, and
+    return a dict of {cookie name: file contents}
+    """
+    contents = {}
+    for cookie in COOKIES:
+        path = os.path.join(str(directory), general_helpers.COOKIE_FILENAMES[cookie])
+        with open(path, "w", newline="\n") as csvfile:
+            writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerows(parser.get_cookies(cookie))
+        with open(path, "rb") as written:
+            contents[cookie] = written.read()
+    return contents
+
+@pytest.mark.parametrize("browser,filename", [("firefox.3+", "firefox.sqlite"),
+                                              ("csv", "firefox.csv")])
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_export_matches_tables(tmp_path, monkeypatch, browser, filename, compression):
+    # Small batches, so that every writer gets several
+    monkeypatch.setattr(export_helpers, "BATCH_ROWS", 1)
+
+    parser = cookie_parser.get_cookie_fetcher(browser, os.path.join("tests", filename), COOKIES)
+
+    (tmp_path / "expected").mkdir()
+    (tmp_path / "output").mkdir()
+    expected = expected_files(parser, tmp_path / "expected")
+
+    output = tmp_path / "output"
+    export_helpers.export_csv(parser, str(output), compression)
+
+    filenames = export_helpers.get_export_filenames(compression)
+    assert(sorted(os.listdir(str(output))) == sorted(filenames.values()))
+    assert(export_helpers.find_conflicts(str(output), compression) == list(filenames.values()))
+
+    for cookie in COOKIES:
+        with open(str(output / filenames[cookie]), "rb") as written:
+            contents = written.read()
+        if compression == "gzip":
+            contents = gzip.decompress(contents)
+        assert(contents == expected[cookie])
+
+def test_export_failure_keeps_old_files(tmp_path):
+    class FailingFetcher(cookie_parser.CookieFetcher):
+        """
+        Fetcher which fails part way through reading cookies
+        """
+        def iter_cookies(self):
+            yield "_ga", ".a.com", "1569000716", "GA1.2.974259038.1567201232"
+            raise ValueError("Read failed")
+
+    existing = tmp_path / general_helpers.COOKIE_FILENAMES["_ga"]
+    existing.write_text("previous export")
+
+    with pytest.raises(ValueError):
+        export_helpers.export_csv(FailingFetcher(None), str(tmp_path))
+
+    assert(os.listdir(str(tmp_path)) == [existing.name])
+    assert(existing.read_text() == "previous export")
@@ -0,0 +1,114 @@
+"""
+Tests that the spool ingestion pipeline produces the same tables as parsing
+each cookie store on its own
+"""
+
+import csv
+import os.path
+import shutil
+
+import cookie_parser
+import general_helpers
+import ingest_pipeline
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+def test_ingest_directory(tmp_path):
+    spool = tmp_path / "spool"
+    output = tmp_path / "output"
+    spool.mkdir()
+    output.mkdir()
+
+    for name in ["first.sqlite", "second.sqlite", "ignored.txt"]:
+        shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool / name))
+
+    ingester = ingest_pipeline.ingest_directory(str(spool), str(output), COOKIES,
+                                                workers=2, queue_size=1)
+
+    assert(ingester.errors == [])
+    assert(sorted(os.path.basename(path) for path in ingester.ingested) ==
+           ["first.sqlite", "second.sqlite"])
+
+    reference = cookie_parser.get_cookie_fetcher("firefox.3+",
+                                                 os.path.join("tests", "firefox.sqlite"),
+                                                 COOKIES)
+
+    for cookie in COOKIES:
+        with open(str(output / general_helpers.COOKIE_FILENAMES[cookie]), newline="") as csvfile:
+            rows = list(csv.reader(csvfile))
+
+        table = reference.get_cookies(cookie)
+        assert(rows[0] == ["Source file"] + table[0])
+        assert(sorted(rows[1:]) == sorted([source] + row for source in ["first.sqlite", "second.sqlite"]
+                                          for row in table[1:]))
+
+def test_ingest_bad_file(tmp_path):
+    (tmp_path / "broken.sqlite").write_text("not a database")
+
+    ingester = ingest_pipeline.ingest_directory(str(tmp_path), str(tmp_path), COOKIES)
+
+    assert(ingester.ingested == [])
+    assert(len(ingester.errors) == 1)
+
+def test_removed_files_are_forgotten(tmp_path):
+    spool = tmp_path / "spool"
+    output = tmp_path / "output"
+    spool.mkdir()
+    output.mkdir()
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool / "first.sqlite"))
+
+    ingester = ingest_pipeline.SpoolIngester(str(spool), str(output), COOKIES)
+    assert(ingester.find_ready_files(wait_for_stable=False) == [str(spool / "first.sqlite")])
+    ingester.seen.add(str(spool / "first.sqlite"))
+
+    # Still there, so not picked up again
+    assert(ingester.find_ready_files(wait_for_stable=False) == [])
+    assert(ingester.seen == {str(spool / "first.sqlite")})
+
+    # Once removed it is forgotten, and the same name is a new file
+    (spool / "first.sqlite").unlink()
+    assert(ingester.find_ready_files(wait_for_stable=False) == [])
+    assert(ingester.seen == set())
+
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool / "first.sqlite"))
+    assert(ingester.find_ready_files(wait_for_stable=False) == [str(spool / "first.sqlite")])
+
+def read_output(output):
+    rows = {}
+    for cookie in COOKIES:
+        path = str(output / general_helpers.COOKIE_FILENAMES[cookie])
+        if os.path.exists(path):
+            with open(path, newline="") as csvfile:
+                rows[cookie] = list(csv.reader(csvfile))
+    return rows
+
+def test_restart_ingests_nothing_again(tmp_path):
+    spool = tmp_path / "spool"
+    output = tmp_path / "output"
+    spool.mkdir()
+    output.mkdir()
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool / "first.sqlite"))
+    (spool / "broken.sqlite").write_text("not a database")
+
+    ingest_pipeline.ingest_directory(str(spool), str(output), COOKIES)
+    written = read_output(output)
+
+    # Ingested and broken files are moved out of the way
+    assert(sorted(os.listdir(str(spool))) == [ingest_pipeline.DONE_DIR,
+                                               ingest_pipeline.ERROR_DIR])
+    assert(os.listdir(str(spool / ingest_pipeline.DONE_DIR)) == ["first.sqlite"])
+    assert(os.listdir(str(spool / ingest_pipeline.ERROR_DIR)) == ["broken.sqlite"])
+
+    # A restarted pipeline finds nothing to ingest, so no row is repeated
+    ingester = ingest_pipeline.ingest_directory(str(spool), str(output), COOKIES)
+    assert(ingester.ingested == [] and ingester.errors == [])
+    assert(read_output(output) == written)
+
+    # The same name delivered again is a new file, kept apart once done
+    shutil.copy(os.path.join("tests", "firefox.sqlite"), str(spool / "first.sqlite"))
+    ingester = ingest_pipeline.ingest_directory(str(spool), str(output), COOKIES)
+    assert(len(ingester.ingested) == 1)
+    assert(sorted(os.listdir(str(spool / ingest_pipeline.DONE_DIR))) ==
+           ["first.1.sqlite", "first.sqlite"])
+    assert(all(len(rows) == 2 * len(written[cookie]) - 1
+               for cookie, rows in read_output(output).items()))
@@ -0,0 +1,69 @@
+"""
+Tests that fetchers report their progress up to exactly the total they
+give, without changing what they return
+"""
+
+import gzip
+import os.path
+import shutil
+
+import pytest
+
+import columnar_index
+import cookie_parser
+import progress_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+@pytest.mark.parametrize("browser,filename,options", [
+    ("firefox.3+", "firefox.sqlite", {}),
+    ("csv", "firefox.csv", {"scan_mode": "full"}),
+    ("csv", "firefox.csv", {"scan_mode": "mmap"}),
+    ("csv", "firefox.csv.gz", {}),
+    ("index", "firefox.gacpidx", {})])
+def test_progress_reaches_total(tmp_path, monkeypatch, browser, filename, options):
+    # Report as often as possible
+    monkeypatch.setattr(progress_helpers, "PROGRESS_INTERVAL", 1)
+
+    path = os.path.join("tests", filename)
+    if filename.endswith(".gz"):
+        path = str(tmp_path / filename)
+        with open(os.path.join("tests", "firefox.csv"), "rb") as infile,\
+             gzip.open(path, "wb") as outfile:
+            shutil.copyfileobj(infile, outfile)
+    elif browser == "index":
+        path = str(tmp_path / filename)
+        source = cookie_parser.get_cookie_fetcher("firefox.3+",
+                                                  os.path.join("tests", "firefox.sqlite"),
+                                                  COOKIES)
+        columnar_index.write_index(source, path, COOKIES)
+
+    parser = cookie_parser.get_cookie_fetcher(browser, path, COOKIES, **options)
+    expected = list(parser.iter_cookies())
+
+    reports = []
+    parser.progress_callback = reports.append
+    assert(list(parser.iter_cookies()) == expected)
+
+    total, unit = parser.get_progress_total()
+    assert(unit == ("bytes" if browser == "csv" else "rows"))
+    assert(sum(reports) == total)
+    assert(all(amount > 0 for amount in reports))
+
+def test_report_rows():
+    reports = []
+    rows = list(progress_helpers.report_rows(range(10), reports.append, interval=4))
+    assert(rows == list(range(10)))
+    assert(reports == [4, 4, 2])
+
+    rows = range(3)
+    assert(progress_helpers.report_rows(rows, None) is rows)
+
+def test_report_chunks():
+    reports = []
+    chunks = progress_helpers.report_chunks(range(10), lambda row: row * 10, 120,
+                                            reports.append, interval=4)
+    assert(next(chunks) == [0, 1, 2, 3])
+    assert(reports == [])
+    assert(list(chunks) == [[4, 5, 6, 7], [8, 9]])
+    assert(reports == [30, 40, 20, 30])
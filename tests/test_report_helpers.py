@@ -0,0 +1,167 @@
+"""
+Tests that bulk domain reports contain, for every domain, exactly the text
+the GUI and the domain-info command show for it
+"""
+
+import html
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cookie_parser
+import general_helpers
+import reference_parser
+import report_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# The cookies in the files of the paths fixture
+ROWS = 1500
+SEED = 42
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Writes a report with two worker processes which are spawned, as they are
+# on Windows and macOS, rather than forked. Each worker imports the main
+# script again
+SPAWN_SCRIPT = """
+import multiprocessing
+import sys
+
+import cookie_parser
+import report_helpers
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    fetcher = cookie_parser.get_cookie_fetcher("csv", sys.argv[1],
+                                               ["_ga", "__utma", "__utmb", "__utmz"])
+    with open(sys.argv[2], "w") as report_file:
+        report_helpers.write_report(fetcher, report_file, processes=2)
+"""
+
+# Runs cli.py as the main script with two spawned worker processes
+SPAWN_CLI = "import multiprocessing, runpy, sys; multiprocessing.set_start_method('spawn'); \
+sys.argv = ['cli.py'] + sys.argv[1:]; runpy.run_path('cli.py', run_name='__main__')"
+
+REFERENCE_FETCHERS = {"firefox.3+": reference_parser.Firefox3Fetcher,
+                      "csv": reference_parser.CSVFetcher}
+
+def expected_report(reference, domains, report_format):
+    """
+    Return the report made by formatting each domain's info one at a time
+    """
+    sections = []
+    for domain in domains:
+        info = general_helpers.format_string_default(general_helpers.DOMAIN_INFO_TEMPLATE,
+                                                     reference.get_domain_info(domain))
+        if report_format == "html":
+            sections.append(report_helpers.HTML_SECTION.format(domain=html.escape(str(domain)),
+                                                               info=html.escape(info)))
+        else:
+            sections.append(report_helpers.TEXT_SECTION.format(domain=domain,
+                                                               rule="="*len(str(domain)),
+                                                               info=info))
+    return "".join(sections)
+
+@pytest.mark.parametrize("report_format", report_helpers.REPORT_FORMATS)
+@pytest.mark.parametrize("browser", ["firefox.3+", "csv"])
+def test_report_matches_domain_info(paths, monkeypatch, browser, report_format):
+    # Small chunks, so that there are several for the workers
+    monkeypatch.setattr(report_helpers, "CHUNK_DOMAINS", 40)
+
+    fetcher = cookie_parser.get_cookie_fetcher(browser, paths[browser], COOKIES)
+    reference = REFERENCE_FETCHERS[browser](paths[browser], COOKIES)
+    domains = list(fetcher.iter_domains())
+
+    expected = expected_report(reference, domains, report_format)
+
+    reports = []
+    for processes in [1, 2]:
+        report_file = io.StringIO()
+        progress = []
+        written = report_helpers.write_report(fetcher, report_file, report_format, processes,
+                                              progress_callback=progress.append)
+        assert(written == sum(progress) == len(domains))
+        reports.append(report_file.getvalue())
+
+    assert(reports[0] == reports[1])
+
+    header = report_helpers.TEXT_HEADER
+    footer = report_helpers.TEXT_FOOTER
+    if report_format == "html":
+        header, footer = report_helpers.HTML_HEADER, report_helpers.HTML_FOOTER
+    assert(reports[0] == header.format(title=report_helpers.REPORT_TITLE) + expected + footer)
+
+def test_domain_rows(paths):
+    fetcher = cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES)
+    domains = list(fetcher.iter_domains())[:20] + [".missing.example.com"]
+
+    rows = list(fetcher.iter_domain_rows(domains))
+    assert(rows == [(domain, fetcher.get_domain_rows(domain)) for domain in domains])
+    assert(rows[-1] == (".missing.example.com", []))
+
+@pytest.mark.parametrize("template", [
+    general_helpers.DOMAIN_INFO_TEMPLATE,
+    "{{escaped}} {value_search_term!r} {missing!s:>15} {count_visits_utma:<6}|",
+    "{value_search_term.upper} {missing[0]} {count_visits_utma:{width}}",
+    "no fields at all"])
+def test_compiled_template(template):
+    infos = [{"value_search_term": "a term", "count_visits_utma": "3", "width": "4"}, {}]
+    compiled = report_helpers.CompiledTemplate(template, default="<none>")
+
+    for info in infos:
+        try:
+            expected = general_helpers.format_string_default(template, info, "<none>")
+        except (AttributeError, TypeError, ValueError) as error:
+            expected = type(error)
+
+        try:
+            result = compiled.render(info)
+        except (AttributeError, TypeError, ValueError) as error:
+            result = type(error)
+
+        assert(result == expected)
+
+def run_in_source_dir(arguments):
+    """
+    Run python with the arguments in src, returning the finished process
+    """
+    environment = dict(os.environ, PYTHONPATH=SOURCE_DIR)
+    return subprocess.run([sys.executable] + arguments, cwd=SOURCE_DIR, env=environment,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=False)
+
+def expected_file_report(path, title=report_helpers.REPORT_TITLE):
+    """
+    Return the report of the .csv file at path written in this process
+    """
+    report_file = io.StringIO()
+    report_helpers.write_report(cookie_parser.get_cookie_fetcher("csv", path, COOKIES),
+                                report_file, processes=1, title=title)
+    return report_file.getvalue()
+
+def test_report_in_spawned_processes(paths, tmp_path):
+    script = tmp_path / "spawn_report.py"
+    script.write_text(SPAWN_SCRIPT)
+    output = tmp_path / "report.txt"
+
+    result = run_in_source_dir([str(script), paths["csv"], str(output)])
+    assert(result.returncode == 0)
+    assert(output.read_text() == expected_file_report(paths["csv"]))
+
+@pytest.mark.skipif(importlib.util.find_spec("click") is None, reason="click is not installed")
+def test_report_command_in_spawned_processes(paths, tmp_path):
+    output = tmp_path / "report.txt"
+
+    result = run_in_source_dir(["-c", SPAWN_CLI, "-i", paths["csv"], "-b", "csv", "report",
+                                "-o", str(output), "--processes", "2"])
+
+    # The workers don't run the CLI again when they import cli.py
+    assert(result.returncode == 0)
+    assert(result.stdout.count("Processing cookie file") == 1)
+    title = "{}: {}".format(report_helpers.REPORT_TITLE, paths["csv"])
+    assert(output.read_text() == expected_file_report(paths["csv"], title))
@@ -0,0 +1,286 @@
+"""
+Tests that an interrupted export, continued from its last checkpoint, gives
+exactly the same files as an export which was never interrupted
+"""
+
+import gzip
+import json
+import os
+import random
+
+import pytest
+
+import columnar_index
+import cookie_parser
+import dedup_helpers
+import export_helpers
+import general_helpers
+import generator_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# The cookies in the files of the paths fixture
+ROWS = 2000
+SEED = 38
+
+CHECKPOINT_ROWS = 150
+
+ENGINES = ["firefox", "csv full", "csv mmap", "csv gzip", "index"]
+
+class Interrupted(Exception):
+    """
+    Stands in for the export being killed
+    """
+
+def interrupt():
+    """
+    Generator which raises Interrupted as soon as it is iterated over
+    """
+    raise Interrupted()
+    yield # pylint: disable=unreachable
+
+def interrupt_at(fetcher, chunk):
+    """
+    Make the fetcher's next export stop halfway through the given chunk,
+    after some of it has already been handed to the writers
+    """
+    iter_cookie_chunks = type(fetcher).iter_cookie_chunks
+
+    def interrupted(chunk_rows, position=None):
+        chunks = iter_cookie_chunks(fetcher, chunk_rows, position)
+        for index, (cookies, next_position) in enumerate(chunks):
+            if index == chunk:
+                half = cookies[:len(cookies) // 2]
+                yield [cookie for part in [half, interrupt()] for cookie in part], None
+            yield cookies, next_position
+
+    fetcher.iter_cookie_chunks = interrupted
+
+@pytest.fixture(scope="module")
+def paths(paths, tmp_path_factory):
+    """
+    The files of the shared paths fixture, along with an index of the
+    Firefox database
+    """
+    paths = dict(paths, index=str(tmp_path_factory.mktemp("resume") / "cookies.gacpidx"))
+    columnar_index.write_index(cookie_parser.get_cookie_fetcher("firefox.3+", paths["firefox.3+"],
+                                                                COOKIES),
+                               paths["index"], COOKIES)
+    return paths
+
+def open_engine(engine, paths):
+    """
+    Return a new fetcher for the engine and the path of the file it reads
+    """
+    if engine == "firefox":
+        return cookie_parser.get_cookie_fetcher("firefox.3+", paths["firefox.3+"], COOKIES),\
+               paths["firefox.3+"]
+    if engine in ["csv full", "csv mmap"]:
+        return cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES,
+                                                scan_mode=engine.split()[1]), paths["csv"]
+    if engine == "csv gzip":
+        return cookie_parser.get_cookie_fetcher("csv", paths["csv gzip"], COOKIES),\
+               paths["csv gzip"]
+    return cookie_parser.get_cookie_fetcher("index", paths["index"], COOKIES), paths["index"]
+
+def read_files(directory):
+    return {filename: (directory / filename).read_bytes()
+            for filename in os.listdir(str(directory))}
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_resumed_export_is_identical(paths, tmp_path, monkeypatch, engine, compression):
+    # Small batches, so that some are written after the last checkpoint
+    monkeypatch.setattr(export_helpers, "BATCH_ROWS", 7)
+
+    expected_dir = tmp_path / "expected"
+    plain_dir = tmp_path / "plain"
+    resumed_dir = tmp_path / "resumed"
+    for directory in [expected_dir, plain_dir, resumed_dir]:
+        directory.mkdir()
+
+    fetcher, source = open_engine(engine, paths)
+    export_helpers.export_csv(fetcher, str(expected_dir), compression, source=source,
+                              checkpoint_rows=CHECKPOINT_ROWS)
+    export_helpers.export_csv(fetcher, str(plain_dir), compression)
+
+    expected = read_files(expected_dir)
+    assert(sorted(expected) == sorted(export_helpers.get_export_filenames(compression).values()))
+
+    # Checkpoints don't change the exported cookies
+    for filename, data in read_files(plain_dir).items():
+        if compression == "gzip":
+            assert(gzip.decompress(data) == gzip.decompress(expected[filename]))
+        else:
+            assert(data == expected[filename])
+
+    # Interrupted twice, once before the first checkpoint, then continued
+    for chunk, resume in [(0, False), (4, True)]:
+        fetcher, source = open_engine(engine, paths)
+        interrupt_at(fetcher, chunk)
+        with pytest.raises(Interrupted):
+            export_helpers.export_csv(fetcher, str(resumed_dir), compression, source=source,
+                                      checkpoint_rows=CHECKPOINT_ROWS, resume=resume)
+
+        assert(general_helpers.EXPORT_MANIFEST_FILENAME in os.listdir(str(resumed_dir)))
+        assert(not any(filename in expected for filename in os.listdir(str(resumed_dir))))
+
+    fetcher, source = open_engine(engine, paths)
+    export_helpers.export_csv(fetcher, str(resumed_dir), compression, source=source,
+                              resume=True)
+
+    assert(read_files(resumed_dir) == expected)
+
+def test_resume_with_dedup(paths, tmp_path, monkeypatch):
+    monkeypatch.setattr(export_helpers, "BATCH_ROWS", 7)
+
+    # Every cookie is in the database twice
+    source = str(tmp_path / "doubled.sqlite")
+    cookies = generator_helpers.generate_cookies(random.Random(SEED), ROWS // 2)
+    generator_helpers.write_firefox(source, cookies + cookies)
+
+    expected_dir = tmp_path / "expected"
+    resumed_dir = tmp_path / "resumed"
+    expected_dir.mkdir()
+    resumed_dir.mkdir()
+
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+    deduplicator = dedup_helpers.CookieDeduplicator(str(tmp_path / "expected.sqlite"))
+    export_helpers.export_csv(fetcher, str(expected_dir), deduplicator=deduplicator,
+                              source=source, checkpoint_rows=CHECKPOINT_ROWS)
+    expected_duplicates = deduplicator.duplicate_count
+    deduplicator.close()
+    assert(expected_duplicates > 0)
+
+    # Killed just after the dedup store saved a checkpoint, but before the
+    # manifest file was replaced, which the store's copy makes up for
+    store = str(tmp_path / "resumed.sqlite")
+    save_checkpoint = export_helpers.save_checkpoint
+    saved = []
+
+    def crash_while_saving(output_dir, manifest, deduplicator=None):
+        saved.append(manifest["sequence"])
+        if len(saved) == 5:
+            manifest["sequence"] += 1
+            deduplicator.commit(checkpoint=json.dumps(manifest))
+            raise Interrupted()
+        save_checkpoint(output_dir, manifest, deduplicator)
+
+    monkeypatch.setattr(export_helpers, "save_checkpoint", crash_while_saving)
+
+    deduplicator = dedup_helpers.CookieDeduplicator(store)
+    with pytest.raises(Interrupted):
+        export_helpers.export_csv(fetcher, str(resumed_dir), deduplicator=deduplicator,
+                                  source=source, checkpoint_rows=CHECKPOINT_ROWS)
+    deduplicator.close()
+
+    monkeypatch.setattr(export_helpers, "save_checkpoint", save_checkpoint)
+
+    # Then killed halfway through a chunk
+    interrupt_at(fetcher, 3)
+    deduplicator = dedup_helpers.CookieDeduplicator(store)
+    with pytest.raises(Interrupted):
+        export_helpers.export_csv(fetcher, str(resumed_dir), deduplicator=deduplicator,
+                                  source=source, resume=True)
+    deduplicator.close()
+
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", source, COOKIES)
+    deduplicator = dedup_helpers.CookieDeduplicator(store)
+    export_helpers.export_csv(fetcher, str(resumed_dir), deduplicator=deduplicator,
+                              source=source, resume=True)
+    assert(deduplicator.duplicate_count == expected_duplicates)
+    deduplicator.close()
+
+    assert(read_files(resumed_dir) == read_files(expected_dir))
+
+def test_resume_after_rename_failed(paths, tmp_path, monkeypatch):
+    expected_dir = tmp_path / "expected"
+    failed_dir = tmp_path / "failed"
+    expected_dir.mkdir()
+    failed_dir.mkdir()
+
+    fetcher, source = open_engine("firefox", paths)
+    deduplicator = dedup_helpers.CookieDeduplicator()
+    export_helpers.export_csv(fetcher, str(expected_dir), deduplicator=deduplicator,
+                              source=source, checkpoint_rows=CHECKPOINT_ROWS)
+    deduplicator.close()
+
+    # Every cookie has been read, but one writer can't replace its file
+    blocked = str(failed_dir / export_helpers.get_export_filenames()["__utma"])
+    replace = os.replace
+    def fail_once(source_path, path):
+        if path == blocked:
+            monkeypatch.setattr(export_helpers.os, "replace", replace)
+            raise PermissionError(13, "Permission denied", path)
+        replace(source_path, path)
+    monkeypatch.setattr(export_helpers.os, "replace", fail_once)
+
+    store = str(tmp_path / "store.sqlite")
+    deduplicator = dedup_helpers.CookieDeduplicator(store)
+    with pytest.raises(PermissionError):
+        export_helpers.export_csv(fetcher, str(failed_dir), deduplicator=deduplicator,
+                                  source=source, checkpoint_rows=CHECKPOINT_ROWS)
+    deduplicator.close()
+
+    # The files which were renamed are continued along with the others
+    assert(export_helpers.can_resume(str(failed_dir)))
+    deduplicator = dedup_helpers.CookieDeduplicator(store)
+    export_helpers.export_csv(fetcher, str(failed_dir), deduplicator=deduplicator,
+                              source=source, resume=True)
+    deduplicator.close()
+
+    assert(read_files(failed_dir) == read_files(expected_dir))
+    assert(not export_helpers.can_resume(str(failed_dir)))
+
+def test_resume_errors(paths, tmp_path):
+    fetcher, source = open_engine("csv full", paths)
+
+    # Nothing to continue
+    assert(not export_helpers.can_resume(str(tmp_path)))
+    with pytest.raises(cookie_parser.ResumeError):
+        export_helpers.export_csv(fetcher, str(tmp_path), source=source, resume=True)
+
+    interrupt_at(fetcher, 2)
+    with pytest.raises(Interrupted):
+        export_helpers.export_csv(fetcher, str(tmp_path), source=source,
+                                  checkpoint_rows=CHECKPOINT_ROWS)
+
+    assert(export_helpers.can_resume(str(tmp_path)))
+
+    # Different options
+    fetcher, source = open_engine("csv full", paths)
+    with pytest.raises(cookie_parser.ResumeError):
+        export_helpers.export_csv(fetcher, str(tmp_path), "gzip", source=source, resume=True)
+
+    fetcher, _ = open_engine("firefox", paths)
+    with pytest.raises(cookie_parser.ResumeError):
+        export_helpers.export_csv(fetcher, str(tmp_path), source=source, resume=True)
+
+    # A different mmap scan of the same file
+    fetcher, source = open_engine("csv mmap", paths)
+    with pytest.raises(cookie_parser.ResumeError):
+        export_helpers.export_csv(fetcher, str(tmp_path), source=source, resume=True)
+
+    # A checkpoint of an earlier version
+    manifest_path = str(tmp_path / general_helpers.EXPORT_MANIFEST_FILENAME)
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    old_manifest = dict(manifest, version=1, fetcher="CSVFetcher")
+    del old_manifest["browser"]
+    with open(manifest_path, "w") as file:
+        json.dump(old_manifest, file)
+    fetcher, source = open_engine("csv full", paths)
+    with pytest.raises(cookie_parser.ResumeError):
+        export_helpers.export_csv(fetcher, str(tmp_path), source=source, resume=True)
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file)
+
+    # The file has changed
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        fetcher, source = open_engine("csv full", paths)
+        with pytest.raises(cookie_parser.ResumeError):
+            export_helpers.export_csv(fetcher, str(tmp_path), source=source, resume=True)
+    finally:
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
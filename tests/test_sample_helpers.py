@@ -0,0 +1,141 @@
+"""
+Tests that samples of the GA cookies are drawn from every engine in file
+order, and that their estimates are within their error bounds
+"""
+
+import random
+import sqlite3
+
+import pytest
+
+import cookie_parser
+import export_helpers
+import sample_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# The cookies in the files of the paths fixture
+ROWS = 20000
+SEED = 45
+
+def read_cookies(fetcher, browser, path):
+    """
+    Return every GA cookie in the order the file stores them in, which for
+    Firefox is rowid order rather than the order of iter_cookies
+    """
+    if browser == "csv":
+        return list(fetcher.iter_cookies())
+
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT name, host, creationTime, value FROM moz_cookies WHERE name \
+IN (?, ?, ?, ?) ORDER BY rowid", COOKIES).fetchall()
+    conn.close()
+    return [(name, host, cookie_parser.microseconds_to_seconds(creation_time), value)
+            for name, host, creation_time, value in rows]
+
+def is_subsequence(sample, cookies):
+    """
+    Return whether every sampled cookie is in cookies, in the same order
+    """
+    remaining = iter(cookies)
+    return all(any(cookie == other for other in remaining) for cookie in sample)
+
+def test_hyperloglog():
+    small = sample_helpers.HyperLogLog()
+    for index in range(300):
+        small.add(str(index % 100))
+    small.add(None)
+    assert(abs(small.count() - 101) <= 1)
+
+    large = sample_helpers.HyperLogLog()
+    for index in range(100000):
+        large.add(".site{}.example.com".format(index))
+    assert(abs(large.count() - 100000) <= large.get_error())
+
+def test_estimate_block_total():
+    assert(sample_helpers.estimate_block_total([3, 5, 4], 3) == (12, 0))
+    total, error = sample_helpers.estimate_block_total([3, 5, 4, 4], 100)
+    assert(total == 400 and 0 < error < 200)
+
+def test_random_blocks():
+    blocks = list(sample_helpers.iter_random_blocks(1001, random.Random(1)))
+    assert(sorted(blocks) == list(range(1001)))
+    assert(blocks != sorted(blocks))
+
+@pytest.mark.parametrize("browser", ["firefox.3+", "csv"])
+def test_sample(paths, browser):
+    fetcher = cookie_parser.get_cookie_fetcher(browser, paths[browser], COOKIES)
+    cookies = read_cookies(fetcher, browser, paths[browser])
+    domain_count = len(set(host for _, host, _, _ in cookies))
+
+    sample = fetcher.get_sample(1500, random.Random(1))
+    assert(len(sample.cookies) >= 1500)
+    assert(is_subsequence(sample.cookies, cookies))
+
+    assert(abs(sample.cookie_count - len(cookies)) <= sample.cookie_error)
+    assert(abs(sample.domain_count - domain_count) <= sample.domain_error)
+    if browser == "csv":
+        # Every row is read, so the number of cookies is exact
+        assert(sample.cookie_error == 0 and sample.cookie_count == len(cookies))
+
+    top_domains = sample.get_top_domains(3)
+    assert(len(top_domains) == 3)
+    assert(all(estimate > 0 for _, estimate, _ in top_domains))
+
+    # A sample of everything is exact
+    whole = fetcher.get_sample(ROWS, random.Random(1))
+    assert(whole.cookies == cookies)
+    assert((whole.cookie_count, whole.cookie_error) == (len(cookies), 0))
+    assert((whole.domain_count, whole.domain_error) == (domain_count, 0))
+
+def test_firefox_sample_from_ga_table(paths):
+    # The same blocks give the same cookies whichever table they come from
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", paths["firefox.3+"], COOKIES)
+    expected = fetcher.get_sample(500, random.Random(2)).cookies
+
+    fetcher.planner.make_ga_table()
+    fetcher.planner.scans["sample_block"] = True
+    assert(fetcher.get_sample(500, random.Random(2)).cookies == expected)
+
+def test_sampled_fetcher(paths, tmp_path):
+    fetcher = cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES)
+    sampled = sample_helpers.SampledFetcher(fetcher, 200, random.Random(3))
+    sample = sampled.get_sample()
+
+    assert(sampled.get_cookie_count() == sample.cookie_count)
+    assert(sampled.get_domain_count() == sample.domain_count)
+    assert(list(sampled.iter_cookies()) == sample.cookies)
+    assert(list(sampled.iter_domains()) == sorted(sample.get_domains()))
+    # With the header row
+    assert(len(sampled.get_cookies("_ga")) ==
+           sum(1 for name, _, _, _ in sample.cookies if name == "_ga") + 1)
+
+    # Domain info is exact, from the whole file
+    domain = sample.get_domains()[0]
+    assert(sampled.get_domain_info(domain) == fetcher.get_domain_info(domain))
+
+    export_helpers.export_csv(sampled, str(tmp_path))
+    exported = sum(len((tmp_path / filename).read_text().splitlines()) - 1
+                   for filename in export_helpers.get_export_filenames().values())
+    assert(exported == len(sample.cookies))
+
+@pytest.mark.parametrize("counts_hosts", [True, False])
+def test_firefox_sample_progress(paths, counts_hosts):
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", paths["firefox.3+"], COOKIES)
+    cookie_count = fetcher.get_cookie_count()
+    total, _ = fetcher.get_progress_total()
+
+    # Whether the domains are estimated by reading every host
+    fetcher.planner.scans["domain_count"] = counts_hosts
+    reported = []
+    fetcher.progress_callback = reported.append
+
+    sample = fetcher.get_sample(500, random.Random(4))
+    assert(len(reported) > 1 and sum(reported) == total)
+
+    if counts_hosts:
+        # Reading every host counts the cookies exactly
+        assert((sample.cookie_count, sample.cookie_error) == (cookie_count, 0))
+    else:
+        assert(sample.cookie_error > 0)
+        assert(abs(sample.cookie_count - cookie_count) <= sample.cookie_error)
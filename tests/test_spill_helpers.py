@@ -0,0 +1,119 @@
+"""
+Tests that collections which spill to disk, and the fetchers, aggregations
+and reports using them, give the same results as when everything is kept in
+memory
+"""
+
+import io
+import random
+from collections import Counter
+
+import pytest
+
+import aggregate_helpers
+import cookie_parser
+import report_helpers
+import spill_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# The cookies in the files of the paths fixture
+ROWS = 2000
+SEED = 43
+
+def test_parse_size():
+    assert(spill_helpers.parse_size("1048576") == 1048576)
+    assert(spill_helpers.parse_size("512M") == 512 * 1024**2)
+    assert(spill_helpers.parse_size("1.5gb") == 3 * 1024**3 // 2)
+    with pytest.raises(ValueError):
+        spill_helpers.parse_size("lots")
+
+def test_spill_set(monkeypatch):
+    monkeypatch.setattr(spill_helpers, "SPILL_BATCH", 7)
+    rng = random.Random(1)
+    items = [rng.choice(["a", "b"]) + str(rng.randrange(300)) if rng.random() > 0.01
+             else None for _ in range(1000)]
+
+    budget = spill_helpers.MemoryBudget(5000)
+    spilled = spill_helpers.SpillSet(items, budget)
+    assert(spilled.spilled)
+    assert(budget.used == 0)
+
+    expected = set(items)
+    assert(len(spilled) == len(expected))
+    assert(all(item in spilled for item in expected))
+    assert("c1" not in spilled)
+    assert(list(spilled) == [None] + sorted(expected - {None}))
+
+    # Until it spills, it is just a set
+    in_memory = spill_helpers.SpillSet(items, spill_helpers.MemoryBudget(10**7))
+    assert(not in_memory.spilled and list(in_memory) == list(expected))
+    in_memory.close()
+    assert(in_memory.budget.used == 0)
+
+def test_spill_counter(monkeypatch):
+    monkeypatch.setattr(spill_helpers, "SPILL_BATCH", 5)
+    rng = random.Random(2)
+    keys = [str(rng.randrange(50)) for _ in range(2000)]
+
+    counter = spill_helpers.SpillCounter(spill_helpers.MemoryBudget(1000))
+    for key in keys:
+        counter.add(key)
+
+    assert(counter.spilled)
+    assert(len(counter) == len(set(keys)))
+    # Including the order of keys with the same count
+    assert(counter.most_common() == Counter(keys).most_common())
+    assert(counter.most_common(3) == Counter(keys).most_common(3))
+
+def test_spill_groups(monkeypatch):
+    monkeypatch.setattr(spill_helpers, "SPILL_BATCH", 3)
+    groups = spill_helpers.SpillGroups(spill_helpers.MemoryBudget(2000))
+    expected = {}
+
+    for key in ["d", "a", "c", "b", "a"]:
+        groups.add_key(key)
+        expected.setdefault(key, [])
+    for index in range(100):
+        key = "abcd"[index % 4]
+        groups.append(key, ["value", str(index)])
+        expected[key].append(["value", str(index)])
+
+    assert(groups.spilled)
+    assert("a" in groups and "e" not in groups)
+    assert(list(groups.items()) == list(expected.items()))
+
+@pytest.mark.parametrize("scan_mode", ["full", "mmap"])
+def test_csv_fetcher(paths, scan_mode):
+    plain = cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES, scan_mode=scan_mode)
+    limited = cookie_parser.get_cookie_fetcher("csv", paths["csv"], COOKIES,
+                                               scan_mode=scan_mode, max_memory=20000)
+
+    domains, count = limited.get_domain_summary()
+    assert(isinstance(domains, spill_helpers.SpillSet) and domains.spilled)
+    assert(sorted(domains) == sorted(plain.get_domains()))
+    assert(count == plain.get_cookie_count())
+
+    assert(sorted(limited.get_domains()) == sorted(plain.get_domains()))
+    assert(list(limited.iter_domains()) == list(plain.iter_domains()))
+    assert(list(limited.iter_domains(limit=5, offset=10)) ==
+           list(plain.iter_domains(limit=5, offset=10)))
+    assert(list(limited.iter_domains(sorted=False)) == list(plain.iter_domains(sorted=False)))
+    assert(limited.get_domain_count() == plain.get_domain_count())
+
+    report = io.StringIO()
+    report_helpers.write_report(limited, report, processes=1)
+    expected = io.StringIO()
+    report_helpers.write_report(plain, expected, processes=1)
+    assert(report.getvalue() == expected.getvalue())
+
+@pytest.mark.parametrize("browser", ["firefox.3+", "csv"])
+def test_aggregate(paths, browser):
+    plain = cookie_parser.get_cookie_fetcher(browser, paths[browser], COOKIES)
+    limited = cookie_parser.get_cookie_fetcher(browser, paths[browser], COOKIES, max_memory=0)
+
+    assert(aggregate_helpers.aggregate(limited, top_n=5) ==
+           aggregate_helpers.aggregate(plain, top_n=5))
+    # A spilled set of domains is in sorted order
+    assert(sorted(limited.get_domains(), key=str) == sorted(plain.get_domains(), key=str))
+    assert(limited.get_cookies("__utmz") == plain.get_cookies("__utmz"))
@@ -0,0 +1,118 @@
+"""
+Tests that Firefox databases without a usable index are queried through the
+GA table, giving exactly the same results in the same order as querying
+moz_cookies directly
+"""
+
+import random
+import sqlite3
+
+import pytest
+
+import cookie_parser
+import generator_helpers
+import reference_parser
+import sqlite_helpers
+
+COOKIES = ["_ga", "__utma", "__utmb", "__utmz"]
+
+# moz_cookies as in early Firefox versions, without the unique index
+UNINDEXED_SCHEMA = """CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, name TEXT,
+value TEXT, host TEXT, path TEXT, expiry INTEGER, lastAccessed INTEGER,
+creationTime INTEGER, isSecure INTEGER, isHttpOnly INTEGER)"""
+
+@pytest.fixture(scope="module")
+def databases(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("planner")
+    cookies = generator_helpers.generate_cookies(random.Random(39), 1500)
+    cookies.append(("_ga", None, 1567201232000000, "GA1.2.3.4"))
+
+    paths = {"unindexed": str(directory / "unindexed.sqlite"),
+             "indexed": str(directory / "indexed.sqlite")}
+    generator_helpers.write_firefox(paths["unindexed"], cookies, UNINDEXED_SCHEMA)
+    generator_helpers.write_firefox(paths["indexed"], cookies)
+
+    domains = sorted({host for _, host, _, _ in cookies if host is not None})[:30]
+    return paths, domains + [".missing.example.com"]
+
+@pytest.mark.parametrize("schema,uses_ga_table", [("unindexed", True), ("indexed", False)])
+def test_planned_queries_match(databases, schema, uses_ga_table):
+    paths, domains = databases
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", paths[schema], COOKIES)
+    reference = reference_parser.Firefox3Fetcher(paths[schema], COOKIES)
+
+    # In the same order, not just the same domains
+    assert(fetcher.get_domains() == reference.get_domains())
+    assert(fetcher.planner.ga_table_made == uses_ga_table)
+
+    expected = generator_helpers.snapshot(reference, domains)
+    generator_helpers.assert_same(generator_helpers.snapshot(fetcher, domains), expected)
+
+    # Reading straight from moz_cookies and from the GA table give the
+    # same cookies in the same order
+    cookies = list(fetcher.iter_cookies())
+    assert(cookies == list(cookie_parser.get_cookie_fetcher("firefox.3+", paths[schema],
+                                                            COOKIES).iter_cookies()))
+    assert(cookies == [cookie for chunk, _ in fetcher.iter_cookie_chunks(100)
+                       for cookie in chunk])
+
+    assert(list(fetcher.iter_domains(sorted=False)) == reference.get_domains())
+    assert(list(fetcher.iter_domains()) == sorted(reference.get_domains(),
+                                                  key=lambda host: (host is not None, host)))
+    assert(fetcher.get_domain_count() == len(reference.get_domains()))
+
+def test_other_cookie_names(databases):
+    # Cookies other than the GA ones still come from moz_cookies
+    paths, _ = databases
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", paths["unindexed"], ["_ga"])
+    fetcher.get_domains()
+    assert(fetcher.planner.ga_table_made)
+
+    reference = reference_parser.Firefox3Fetcher(paths["unindexed"], ["_ga"])
+    assert(fetcher.get_cookies("__utma") == reference.get_cookies("__utma"))
+    assert(len(fetcher.get_cookies("__utma")) > 1)
+
+def test_scans_table():
+    assert(sqlite_helpers.scans_table(["SCAN moz_cookies"], "moz_cookies"))
+    assert(sqlite_helpers.scans_table(["SCAN TABLE moz_cookies",
+                                       "USE TEMP B-TREE FOR DISTINCT"], "moz_cookies"))
+    assert(not sqlite_helpers.scans_table(["SCAN moz_cookies USING INDEX host"], "moz_cookies"))
+    assert(not sqlite_helpers.scans_table(["SEARCH moz_cookies USING INDEX \
+sqlite_autoindex_moz_cookies_1 (name=?)"], "moz_cookies"))
+
+def test_schema_without_creation_time(tmp_path):
+    # Before creationTime was added, each cookie's id was its creation time
+    path = str(tmp_path / "old.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE moz_cookies (id INTEGER PRIMARY KEY, name TEXT, value TEXT, \
+host TEXT, path TEXT, expiry INTEGER, lastAccessed INTEGER, isSecure INTEGER, \
+isHttpOnly INTEGER)")
+    conn.execute("PRAGMA user_version = 1")
+    conn.executemany("INSERT INTO moz_cookies (id, name, value, host, path) \
+VALUES (?, ?, ?, ?, '/')", [(1567201232000000, "_ga", "GA1.2.974259038.1567201232", ".a.com"),
+                            (1567201233000000, "_ga", "GA1.2.1.1567201233", ".b.com")])
+    conn.commit()
+    conn.close()
+
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", path, COOKIES)
+    assert(fetcher.error is None)
+    assert(fetcher.schema.creation_time_column == "id")
+
+    cookies = list(fetcher.iter_cookies())
+    assert(cookies[0] == ("_ga", ".a.com", 1567201232.0, "GA1.2.974259038.1567201232"))
+    assert(fetcher.get_cookies("_ga")[1][2] == "2019-08-30 21:40:32Z")
+
+    # The GA table has the creation times too
+    fetcher.get_domains()
+    assert(fetcher.planner.ga_table_made)
+    assert(list(fetcher.iter_cookies()) == cookies)
+
+def test_missing_columns(tmp_path):
+    path = str(tmp_path / "broken.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE moz_cookies (name TEXT, value TEXT)")
+    conn.commit()
+    conn.close()
+
+    fetcher = cookie_parser.get_cookie_fetcher("firefox.3+", path, COOKIES)
+    assert(fetcher.error is not None and "host, creationTime" in fetcher.error)
@@ -0,0 +1,85 @@
+"""
+Tests that starting the GUI doesn't import the cookie fetchers and exports,
+and that what it does import stays within a startup time budget, measured
+with python -X importtime
+"""
+
+import ast
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pytest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Modules which should only be imported once a file is processed
+DEFERRED_MODULES = ["cache_helpers", "cookie_parser", "export_helpers", "sqlite3", "csv",
+                    "compression_helpers", "columnar_index"]
+
+# Total import time, in microseconds, allowed for the modules the GUI
+# imports before showing its window, not counting wx itself
+STARTUP_BUDGET_US = 100000
+
+def get_import_times(statement):
+    """
+    Return {module name: (self time, cumulative time)} in microseconds of
+    every module imported by running the statement in a new interpreter
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=SOURCE_DIR, stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+def get_module_imports(filename):
+    """
+    Return the names of the modules imported at the top level of a file in
+    src, which are imported as soon as it is
+    """
+    with open(os.path.join(SOURCE_DIR, filename)) as source_file:
+        tree = ast.parse(source_file.read())
+
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            names.append(node.module)
+    return names
+
+def startup_time(times, excluded="wx"):
+    """
+    Return the total self time of the imported modules, leaving out the
+    excluded package
+    """
+    return sum(self_time for name, (self_time, _) in times.items()
+               if name != excluded and not name.startswith(excluded + "."))
+
+def test_gui_imports_are_deferred():
+    for filename in ["start.py", "gui_classes.py"]:
+        imports = get_module_imports(filename)
+        assert(not set(imports) & set(DEFERRED_MODULES))
+
+def test_startup_budget_without_wx():
+    # What the GUI imports before its window is shown, apart from wx
+    modules = [name for name in get_module_imports("gui_classes.py")
+               if name != "wx" and not name.startswith("wx.")]
+    times = get_import_times("import {}".format(", ".join(modules)))
+
+    assert(not set(times) & set(DEFERRED_MODULES))
+    assert(startup_time(times) < STARTUP_BUDGET_US)
+
+@pytest.mark.skipif(importlib.util.find_spec("wx") is None, reason="wx is not installed")
+def test_startup_budget():
+    times = get_import_times("import gui_classes")
+
+    assert(not set(times) & set(DEFERRED_MODULES))
+    assert(startup_time(times) < STARTUP_BUDGET_US)
@@ -0,0 +1,53 @@
+"""
+Tests that the fast epoch formatter gives exactly the same output, and
+raises exactly the same errors, as formatting with time.strftime
+"""
+
+import random
+
+import pytest
+
+import parser_helpers
+import reference_parser
+import time_helpers
+
+EDGE_VALUES = [0, 0.0, -0.0, 0.5, -0.5, -1, 86399.999, 86400, 951782400, 1567201232,
+               "1567201232", " 1567201232 ", "1567201232.9999999", 2**31, 2**31 - 1,
+               time_helpers.MAX_FAST_EPOCH - 1, time_helpers.MAX_FAST_EPOCH - 0.001,
+               time_helpers.MAX_FAST_EPOCH, "1e11", "-1e12", "1e17", "-1e17", "nan", "",
+               "abc", "<not found>", "0x10", "1_000", "١٥٦٧"]
+
+@pytest.mark.parametrize("time_unit", ["seconds", "milliseconds"])
+def test_matches_reference(time_unit):
+    rng = random.Random(35)
+    values = EDGE_VALUES + [rng.uniform(0, time_helpers.MAX_FAST_EPOCH) for _ in range(5000)]
+    values += [str(rng.randint(0, 2**32)) for _ in range(5000)]
+
+    expected = [reference_parser.try_parse_epoch_datetime(value, time_unit) for value in values]
+
+    formatter = time_helpers.EpochFormatter(cache_size=16) # Also test clearing the cache
+    assert([formatter.format(value, time_unit) for value in values] == expected)
+    assert(formatter.format_many(values, time_unit) == expected)
+    assert([parser_helpers.try_parse_epoch_datetime(value, time_unit)
+            for value in values] == expected)
+
+@pytest.mark.parametrize("value,error", [("1e20", OverflowError), ("inf", OverflowError),
+                                         (None, TypeError), (10**400, OverflowError)])
+def test_same_errors(value, error):
+    with pytest.raises(error):
+        reference_parser.try_parse_epoch_datetime(value)
+    with pytest.raises(error):
+        time_helpers.EPOCH_FORMATTER.format(value)
+    with pytest.raises(error):
+        time_helpers.EPOCH_FORMATTER.format_many([1567201232, value])
+
+def test_table_rows_raise_in_row_order():
+    # The first row's value overflows before the second row's creation time
+    # is reached, so formatting all the creation times first must not change
+    # which error is raised
+    rows = [(".a.com", 1567201232, "GA1.2.3.1e20"), (".b.com", None, "GA1.2.3.4")]
+
+    with pytest.raises(OverflowError):
+        reference_parser.ga_generate_table(rows, "_ga")
+    with pytest.raises(OverflowError):
+        parser_helpers.ga_generate_table(rows, "_ga")